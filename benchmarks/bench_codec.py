@@ -0,0 +1,88 @@
+"""Compares the length of the tracking URLs and the time to encode and decode
+them with the JSON and compact codecs, with and without compression.
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.bench_codec [--number 10000]
+"""
+import argparse
+import timeit
+
+from pytracking import (
+    Configuration, get_click_tracking_result, get_click_tracking_url)
+from pytracking.codec import get_compression_dictionary
+
+
+URL_TO_TRACK = "https://www.example.com/products/shoes/?utm_source=email"
+
+METADATA = {
+    "campaign_id": 123456,
+    "recipient_id": 98765432,
+    "variant": "b",
+    "list_id": 42,
+}
+
+CRYPTO_KEY = b"XdhWbQZnqCIPLBL0ViPIW2vBTsmUNxAS-7mOtTdu6ZM="
+
+
+def get_configurations():
+    try:
+        import cryptography  # noqa
+        encryption_keys = [None, CRYPTO_KEY]
+    except ImportError:
+        encryption_keys = [None]
+
+    configurations = []
+    for encryption_key in encryption_keys:
+        for codec in ("json", "compact"):
+            for compress in (False, True):
+                name = codec
+                kwargs = {}
+                if compress:
+                    name += "+zlib"
+                    # A dictionary built from the links of another campaign
+                    kwargs["compression_dictionary"] =\
+                        get_compression_dictionary([{
+                            "url": "https://www.example.com/",
+                            "metadata": dict(METADATA, campaign_id=1)}],
+                            codec)
+                if encryption_key:
+                    name += "+fernet"
+                configurations.append((name, Configuration(
+                    base_click_tracking_url="https://t.example.com/c/",
+                    encryption_bytestring_key=encryption_key, codec=codec,
+                    compress=compress, **kwargs).freeze()))
+    return configurations
+
+
+def print_results(configurations, number):
+    """Prints the URL length and the encode and decode times of the click
+    tracking URL of each (name, configuration) tuple.
+    """
+    print("{0:<24}{1:>8}{2:>14}{3:>14}".format(
+        "configuration", "length", "encode (us)", "decode (us)"))
+    for name, configuration in configurations:
+        url = get_click_tracking_url(URL_TO_TRACK, METADATA, configuration)
+        encode_time = timeit.timeit(
+            lambda: get_click_tracking_url(
+                URL_TO_TRACK, METADATA, configuration),
+            number=number)
+        decode_time = timeit.timeit(
+            lambda: get_click_tracking_result(
+                url, configuration=configuration),
+            number=number)
+        print("{0:<24}{1:>8}{2:>14.2f}{3:>14.2f}".format(
+            name, len(url), encode_time / number * 1000000,
+            decode_time / number * 1000000))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=10000)
+    options = parser.parse_args(args)
+
+    print_results(get_configurations(), options.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Compares the length of the tracking URLs and the time to encode and decode
+them when they are signed (sign_links) or encrypted
+(encryption_bytestring_key).
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.bench_signing [--number 10000]
+"""
+import argparse
+
+from pytracking import Configuration
+
+from benchmarks.bench_codec import CRYPTO_KEY, print_results
+
+
+SIGNING_KEY = b"a long random secret"
+
+
+def get_configurations():
+    configurations = []
+    for codec in ("json", "compact"):
+        configurations.append((codec + "+hmac", Configuration(
+            base_click_tracking_url="https://t.example.com/c/",
+            codec=codec, sign_links=True,
+            signing_key=SIGNING_KEY).freeze()))
+        configurations.append((codec + "+fernet", Configuration(
+            base_click_tracking_url="https://t.example.com/c/",
+            codec=codec, encryption_bytestring_key=CRYPTO_KEY).freeze()))
+    return configurations
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=10000)
+    options = parser.parse_args(args)
+
+    print_results(get_configurations(), options.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+"""URL configuration of the Django views measured by benchmarks.suite.
+"""
+from django.urls import path
+
+from pytracking.django import ClickTrackingView, OpenTrackingView
+
+
+urlpatterns = [
+    path("open/<str:path>/", OpenTrackingView.as_view()),
+    path("click/<str:path>/", ClickTrackingView.as_view()),
+]
@@ -0,0 +1,367 @@
+"""Measures the performance of pytracking, writes the results as JSON and
+compares them with a baseline.
+
+The suite measures:
+
+- the time to generate tracking URLs and to decode them, with and without
+  Fernet encryption,
+- the distribution of the length of the tracking URLs,
+- the latency and the peak memory of adapt_html on small, medium and huge
+  newsletters,
+- the latency of the Django views through the test client,
+- the time to import the modules of pytracking in a new interpreter
+  (python -X importtime).
+
+All metrics are lower-is-better. The benchmarks whose optional dependencies
+are not installed are skipped.
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline results.json [--threshold 0.2]
+
+With --baseline, the command exits with status 1 if a metric is more than
+threshold (e.g., 0.2 for 20%) above its baseline value.
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+from pytracking import (
+    Configuration, get_click_tracking_result, get_click_tracking_url,
+    get_open_tracking_result, get_open_tracking_url)
+
+from benchmarks.bench_codec import CRYPTO_KEY, METADATA, URL_TO_TRACK
+
+
+BASE_OPEN_TRACKING_URL = "https://t.example.com/open/"
+
+BASE_CLICK_TRACKING_URL = "https://t.example.com/click/"
+
+DEFAULT_THRESHOLD = 0.2
+
+# (name, number of links, number of paragraphs per link)
+NEWSLETTER_SIZES = (
+    ("small", 5, 1),
+    ("medium", 50, 4),
+    ("huge", 2000, 4),
+)
+
+# Modules imported by a process serving the tracking links, changing HTML or
+# sending webhooks.
+IMPORTED_MODULES = (
+    "pytracking", "pytracking.wsgi", "pytracking.html", "pytracking.webhook")
+
+
+class Suite(object):
+    """Collects the metrics of the benchmarks.
+    """
+
+    def __init__(self, number=1000, repeat=5, only=None):
+        """
+        :param number: The number of calls of a function in a timing run.
+        :param repeat: The number of timing runs. The fastest run is kept.
+        :param only: An optional substring: only the benchmarks whose name
+            contains it are run.
+        """
+        self.number = number
+        self.repeat = repeat
+        self.only = only
+        # name -> {"value": float, "unit": str}
+        self.metrics = {}
+
+    def add(self, name, value, unit):
+        self.metrics[name] = {"value": round(value, 3), "unit": unit}
+
+    def time(self, name, function, number=None):
+        """Adds the time of one call of function, in microseconds.
+        """
+        number = number or self.number
+        best = min(timeit.repeat(function, number=number, repeat=self.repeat))
+        self.add(name, best / number * 1000000, "us")
+
+    def run(self):
+        for (name, benchmark) in BENCHMARKS:
+            if self.only and self.only not in name:
+                continue
+            try:
+                benchmark(self)
+            except ImportError as e:
+                print("Skipped {0}: {1}".format(name, e), file=sys.stderr)
+        return self.metrics
+
+    def get_results(self):
+        return {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "number": self.number,
+            "metrics": self.metrics,
+        }
+
+
+def get_configurations():
+    """Returns a list of (name, configuration) with and without Fernet.
+    """
+    configurations = [("plain", Configuration(
+        base_open_tracking_url=BASE_OPEN_TRACKING_URL,
+        base_click_tracking_url=BASE_CLICK_TRACKING_URL).freeze())]
+    try:
+        import cryptography  # noqa
+    except ImportError:
+        return configurations
+    configurations.append(("fernet", Configuration(
+        base_open_tracking_url=BASE_OPEN_TRACKING_URL,
+        base_click_tracking_url=BASE_CLICK_TRACKING_URL,
+        encryption_bytestring_key=CRYPTO_KEY).freeze()))
+    return configurations
+
+
+def bench_encode_decode(suite):
+    for (name, configuration) in get_configurations():
+        open_url = get_open_tracking_url(METADATA, configuration)
+        click_url = get_click_tracking_url(
+            URL_TO_TRACK, METADATA, configuration)
+        suite.time(
+            "encode.open.{0}".format(name),
+            lambda: get_open_tracking_url(METADATA, configuration))
+        suite.time(
+            "encode.click.{0}".format(name),
+            lambda: get_click_tracking_url(
+                URL_TO_TRACK, METADATA, configuration))
+        suite.time(
+            "decode.open.{0}".format(name),
+            lambda: get_open_tracking_result(
+                open_url, configuration=configuration))
+        suite.time(
+            "decode.click.{0}".format(name),
+            lambda: get_click_tracking_result(
+                click_url, configuration=configuration))
+
+
+def get_recipient_links(count, seed=0):
+    """Returns a list of (url, metadata) resembling the links of a campaign.
+    """
+    rng = random.Random(seed)
+    links = []
+    for _ in range(count):
+        url = "https://www.example.com/{0}/{1}?utm_source=email".format(
+            rng.choice(("products", "blog", "offers/summer-sale")),
+            "".join(rng.choice("abcdefghij-") for _ in range(
+                rng.randint(5, 60))))
+        metadata = {
+            "campaign_id": rng.randint(1, 10 ** 6),
+            "recipient_id": rng.randint(1, 10 ** 9),
+        }
+        if rng.random() < 0.5:
+            metadata["variant"] = rng.choice("abc")
+        links.append((url, metadata))
+    return links
+
+
+def bench_url_lengths(suite):
+    links = get_recipient_links(1000)
+    for (name, configuration) in get_configurations():
+        lengths = sorted(
+            len(get_click_tracking_url(url, metadata, configuration))
+            for (url, metadata) in links)
+        for (percentile_name, percentile) in (
+                ("min", 0), ("p50", 50), ("p95", 95), ("max", 100)):
+            index = min(
+                len(lengths) - 1, len(lengths) * percentile // 100)
+            suite.add(
+                "url_length.click.{0}.{1}".format(name, percentile_name),
+                lengths[index], "chars")
+
+
+def get_newsletter(links, paragraphs):
+    """Returns the HTML of a newsletter with links links.
+    """
+    parts = ["<html><head><title>News</title></head><body>"]
+    for index in range(links):
+        parts.extend(
+            "<p>Paragraph {0} of the article {1}, with some text to make "
+            "the newsletter look real.</p>".format(paragraph, index)
+            for paragraph in range(paragraphs))
+        parts.append(
+            '<a href="https://www.example.com/articles/{0}?utm_source=email">'
+            "Read the article {0}</a>".format(index))
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def bench_adapt_html(suite):
+    from pytracking.html import adapt_html
+
+    configuration = get_configurations()[0][1]
+    for (name, links, paragraphs) in NEWSLETTER_SIZES:
+        html_text = get_newsletter(links, paragraphs)
+        # Keep about the same total number of links per timing run.
+        number = max(1, suite.number // (links * 4))
+
+        def function():
+            adapt_html(html_text, METADATA, configuration=configuration)
+
+        suite.time("adapt_html.{0}.latency".format(name), function, number)
+
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        suite.add("adapt_html.{0}.peak_memory".format(name), peak / 1024, "KB")
+
+
+def bench_django_views(suite):
+    import django
+    from django.conf import settings
+
+    if not settings.configured:
+        settings.configure(
+            ROOT_URLCONF="benchmarks.django_urls", ALLOWED_HOSTS=["*"],
+            MIDDLEWARE=[], INSTALLED_APPS=[],
+            PYTRACKING_CONFIGURATION={
+                "base_open_tracking_url": "http://testserver/open/",
+                "base_click_tracking_url": "http://testserver/click/",
+            })
+        django.setup()
+    from django.test import Client
+
+    client = Client()
+    open_url = get_open_tracking_url(
+        METADATA, base_open_tracking_url="http://testserver/open/",
+        append_slash=True)
+    click_url = get_click_tracking_url(
+        URL_TO_TRACK, METADATA,
+        base_click_tracking_url="http://testserver/click/",
+        append_slash=True)
+    for (name, url) in (("open", open_url), ("click", click_url)):
+        path = url[len("http://testserver"):]
+        response = client.get(path)
+        assert response.status_code in (200, 302), response.status_code
+        suite.time(
+            "django.{0}_view".format(name), lambda: client.get(path),
+            max(1, suite.number // 10))
+
+
+def get_import_time(module_name):
+    """Returns the time, in microseconds, to import module_name and the
+    modules that it imports in a new interpreter.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         "import " + module_name],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    lines = process.stderr.splitlines()
+    # The modules imported at startup are reported before site.
+    names = [line.rsplit("|", 1)[-1] for line in lines]
+    start = names.index(" site") + 1 if " site" in names else 0
+    total = 0
+    for line in lines[start:]:
+        (_, cumulative, name) = line.split("|")
+        # Top-level imports are not indented.
+        if not name[1:].startswith(" "):
+            total += int(cumulative)
+    return total
+
+
+def bench_import_time(suite):
+    if sys.version_info < (3, 7):
+        print("Skipped import_time: python -X importtime requires Python 3.7",
+              file=sys.stderr)
+        return
+    for module_name in IMPORTED_MODULES:
+        suite.add(
+            "import_time.{0}".format(module_name),
+            min(get_import_time(module_name) for _ in range(suite.repeat)),
+            "us")
+
+
+BENCHMARKS = (
+    ("encode_decode", bench_encode_decode),
+    ("url_lengths", bench_url_lengths),
+    ("adapt_html", bench_adapt_html),
+    ("django_views", bench_django_views),
+    ("import_time", bench_import_time),
+)
+
+
+def compare_results(metrics, baseline_metrics, threshold=DEFAULT_THRESHOLD):
+    """Returns the list of (name, baseline value, value) of the metrics that
+    are more than threshold above their baseline value. The metrics without
+    a baseline value or with a zero baseline value are skipped.
+    """
+    regressions = []
+    for (name, metric) in sorted(metrics.items()):
+        baseline_metric = baseline_metrics.get(name)
+        if not baseline_metric or not baseline_metric["value"]:
+            continue
+        if metric["value"] > baseline_metric["value"] * (1 + threshold):
+            regressions.append(
+                (name, baseline_metric["value"], metric["value"]))
+    return regressions
+
+
+def print_metrics(metrics, baseline_metrics=None):
+    baseline_metrics = baseline_metrics or {}
+    print("{0:<36}{1:>14}{2:>14}{3:>9}".format(
+        "metric", "value", "baseline", "change"))
+    for (name, metric) in sorted(metrics.items()):
+        baseline_metric = baseline_metrics.get(name)
+        if baseline_metric and baseline_metric["value"]:
+            baseline = "{0:.2f}".format(baseline_metric["value"])
+            change = "{0:+.0%}".format(
+                metric["value"] / baseline_metric["value"] - 1)
+        else:
+            baseline = change = "-"
+        print("{0:<36}{1:>11.2f} {2:<2}{3:>14}{4:>9}".format(
+            name, metric["value"], metric["unit"], baseline, change))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--only", help="Only run the benchmarks whose name contains ONLY.")
+    parser.add_argument("--output", help="Write the results to this file.")
+    parser.add_argument(
+        "--baseline", help="Compare the results with this results file.")
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="The relative increase of a metric that fails the comparison.")
+    options = parser.parse_args(args)
+
+    suite = Suite(options.number, options.repeat, options.only)
+    metrics = suite.run()
+
+    if options.output:
+        with open(options.output, "w") as output_file:
+            json.dump(suite.get_results(), output_file, indent=2,
+                      sort_keys=True)
+
+    baseline_metrics = None
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            baseline_metrics = json.load(baseline_file)["metrics"]
+    print_metrics(metrics, baseline_metrics)
+
+    if baseline_metrics is not None:
+        regressions = compare_results(
+            metrics, baseline_metrics, options.threshold)
+        for (name, baseline, value) in regressions:
+            print("Regression: {0} {1:.2f} > {2:.2f} (+{3:.0%})".format(
+                name, value, baseline, value / baseline - 1))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,16 @@
 from pytracking.tracking import (
-    Configuration, TrackingResult, get_click_tracking_result,
-    get_click_tracking_url, get_open_tracking_url_path,
-    get_click_tracking_url_path, get_open_tracking_url,
-    get_open_tracking_result, get_open_tracking_pixel,
+    Configuration, FrozenConfiguration, TrackingResult,
+    get_click_tracking_result, get_click_tracking_url,
+    get_open_tracking_url_path, get_click_tracking_url_path,
+    get_open_tracking_url, get_open_tracking_result, get_open_tracking_pixel,
+    generate_tracking_urls, TrackingURLs,
     TRACKING_PIXEL, PNG_MIME_TYPE, DEFAULT_TIMEOUT_SECONDS)
 
 
 __all__ = [
-    "Configuration", "TrackingResult", "get_click_tracking_url",
-    "get_click_tracking_result", "get_click_tracking_url_path",
-    "get_open_tracking_url_path", "get_open_tracking_url",
-    "get_open_tracking_result", "get_open_tracking_pixel",
+    "Configuration", "FrozenConfiguration", "TrackingResult",
+    "get_click_tracking_url", "get_click_tracking_result",
+    "get_click_tracking_url_path", "get_open_tracking_url_path",
+    "get_open_tracking_url", "get_open_tracking_result",
+    "get_open_tracking_pixel", "generate_tracking_urls", "TrackingURLs",
     "TRACKING_PIXEL", "PNG_MIME_TYPE", "DEFAULT_TIMEOUT_SECONDS"]
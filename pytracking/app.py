@@ -0,0 +1,224 @@
+"""Base of the standalone tracking apps (see pytracking.wsgi and
+pytracking.asgi), which serve open and click tracking links without a web
+framework.
+"""
+from collections import namedtuple
+import ipaddress
+from urllib.parse import quote, urlsplit
+
+from pytracking.metrics import DROPPED_EVENTS_TOTAL, REGISTRY
+from pytracking.tracking import (
+    get_configuration, TRACKING_PIXEL, PNG_MIME_TYPE)
+
+
+# Characters that are not percent-encoded in the Location header. Same as
+# django.utils.encoding.iri_to_uri.
+LOCATION_SAFE_CHARACTERS = "/#%[]=:;$&()+,!?*@'~"
+
+REDIRECT_SCHEMES = frozenset(("http", "https", "ftp", ""))
+
+Response = namedtuple("Response", ["status", "reason", "headers", "body"])
+
+PIXEL_RESPONSE = Response(200, "OK", (
+    ("Content-Type", PNG_MIME_TYPE),
+    ("Content-Length", str(len(TRACKING_PIXEL)))), TRACKING_PIXEL)
+
+NOT_FOUND_RESPONSE = Response(404, "Not Found", (
+    ("Content-Type", "text/plain"), ("Content-Length", "9")), b"Not Found")
+
+METHOD_NOT_ALLOWED_RESPONSE = Response(405, "Method Not Allowed", (
+    ("Allow", "GET, HEAD"), ("Content-Type", "text/plain"),
+    ("Content-Length", "18")), b"Method Not Allowed")
+
+CONSTANT_RESPONSES = (
+    PIXEL_RESPONSE, NOT_FOUND_RESPONSE, METHOD_NOT_ALLOWED_RESPONSE)
+
+
+class TrackingApp(object):
+    """Routes requests to the open and click tracking links, decodes them,
+    and returns a tracking pixel or a redirect response, like the Django
+    views.
+
+    Subclasses should override notify_* methods.
+    """
+
+    def __init__(
+            self, configuration=None, open_tracking_path=None,
+            click_tracking_path=None, trusted_proxies=None, classifier=None,
+            drop_machine_events=False, deduplicator=None, **kwargs):
+        """
+        :param configuration: An optional Configuration instance. The app
+            uses a frozen copy.
+        :param open_tracking_path: The path prefix of the open tracking
+            links. Default to the path of base_open_tracking_url.
+        :param click_tracking_path: The path prefix of the click tracking
+            links. Default to the path of base_click_tracking_url.
+        :param trusted_proxies: An optional list of the IP addresses or
+            networks (e.g., "10.0.0.0/8") of the proxies whose
+            X-Forwarded-For header is trusted.
+        :param classifier: An optional
+            pytracking.classifier.EventClassifier instance classifying the
+            tracking results.
+        :param drop_machine_events: If True, the events classified as made
+            by a machine are not notified.
+        :param deduplicator: An optional
+            pytracking.dedupe.EventDeduplicator instance. The events repeated
+            within its window are not notified.
+        :param kwargs: Optional configuration parameters. If provided with a
+            Configuration instance, the kwargs parameters will override the
+            Configuration parameters.
+        """
+        self.configuration = get_configuration(configuration, kwargs).freeze()
+
+        routes = []
+        if open_tracking_path is None and\
+                self.configuration.base_open_tracking_url:
+            open_tracking_path = urlsplit(
+                self.configuration.base_open_tracking_url).path
+        if open_tracking_path:
+            routes.append((open_tracking_path, True))
+        if click_tracking_path is None and\
+                self.configuration.base_click_tracking_url:
+            click_tracking_path = urlsplit(
+                self.configuration.base_click_tracking_url).path
+        if click_tracking_path:
+            routes.append((click_tracking_path, False))
+        if not routes:
+            raise ValueError(
+                "Provide the tracking paths or the base tracking URLs.")
+        # The longest prefix first, e.g., /tracking/open/ before /tracking/
+        routes.sort(key=lambda route: len(route[0]), reverse=True)
+        self.routes = routes
+
+        self.trusted_proxies = [
+            ipaddress.ip_network(proxy, strict=False)
+            for proxy in trusted_proxies or ()]
+        self.classifier = classifier
+        self.drop_machine_events = drop_machine_events
+        self.deduplicator = deduplicator
+
+    def notify_tracking_event(self, tracking_result):
+        """Called once the tracking link has been decoded, and before
+        responding with a redirect or a tracking pixel.
+
+        :param tracking_result: An instance of TrackingResult.
+        """
+        pass
+
+    def notify_decoding_error(self, exception, request):
+        """Called when a decoding error occurs, and before
+        responding with a 404.
+
+        :param exception: The exception that was raised when trying to decode a
+            tracking link.
+        :param request: The WSGI environ or the ASGI scope of the request.
+        """
+        pass
+
+    def route(self, path):
+        """Returns a tuple (is_open, encoded_url_path) or None if path is not
+        a tracking link.
+        """
+        for (prefix, is_open) in self.routes:
+            if path.startswith(prefix):
+                encoded_url_path = path[len(prefix):]
+                if encoded_url_path and "/" not in encoded_url_path.rstrip(
+                        "/"):
+                    return (is_open, encoded_url_path.rstrip("/"))
+        return None
+
+    def is_trusted_proxy(self, address):
+        """Returns True if address is one of the trusted proxies.
+        """
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        for network in self.trusted_proxies:
+            if ip in network:
+                return True
+        return False
+
+    def get_client_ip(self, remote_addr, forwarded_for):
+        """Returns the IP of the client: the right-most address of the
+        X-Forwarded-For header that is not a trusted proxy, if the request
+        comes from a trusted proxy.
+
+        :param remote_addr: The address of the peer of the connection.
+        :param forwarded_for: The value of the X-Forwarded-For header or None.
+        """
+        if not forwarded_for or not self.trusted_proxies or\
+                not self.is_trusted_proxy(remote_addr):
+            return remote_addr
+        client_ip = remote_addr
+        for address in reversed(forwarded_for.split(",")):
+            address = address.strip()
+            try:
+                ipaddress.ip_address(address)
+            except ValueError:
+                break
+            client_ip = address
+            if not self.is_trusted_proxy(address):
+                break
+        return client_ip
+
+    def get_request_data(self, remote_addr, forwarded_for, user_agent):
+        """Returns the request data of the tracking result, with the same keys
+        as the Django views.
+        """
+        return {
+            "user_agent": user_agent,
+            "user_ip": self.get_client_ip(remote_addr, forwarded_for),
+        }
+
+    def process_request(self, method, path, request_data_function):
+        """Decodes a request.
+
+        :param method: The HTTP method.
+        :param path: The path of the request.
+        :param request_data_function: A callable returning the request data.
+        :return: A tuple (Response, tracking result to notify or None,
+            decoding error to notify or None).
+        """
+        if method != "GET" and method != "HEAD":
+            return (METHOD_NOT_ALLOWED_RESPONSE, None, None)
+
+        route = self.route(path)
+        if route is None:
+            return (NOT_FOUND_RESPONSE, None, None)
+        (is_open, encoded_url_path) = route
+
+        try:
+            tracking_result = self.configuration.get_tracking_result(
+                encoded_url_path, request_data_function(), is_open)
+        except Exception as error:
+            return (NOT_FOUND_RESPONSE, None, error)
+
+        if not is_open:
+            tracked_url = tracking_result.tracked_url
+            if not tracked_url or\
+                    urlsplit(tracked_url).scheme not in REDIRECT_SCHEMES:
+                return (NOT_FOUND_RESPONSE, None, None)
+
+        if self.classifier is not None:
+            classification = self.classifier.classify_tracking_result(
+                tracking_result)
+            if self.drop_machine_events and classification.is_machine:
+                REGISTRY.inc(DROPPED_EVENTS_TOTAL, (("reason", "machine"),))
+                tracking_result = None
+        if tracking_result is not None and self.deduplicator is not None and\
+                self.deduplicator.is_duplicate(tracking_result):
+            REGISTRY.inc(DROPPED_EVENTS_TOTAL, (("reason", "duplicate"),))
+            tracking_result = None
+
+        if is_open:
+            return (PIXEL_RESPONSE, tracking_result, None)
+        return (get_redirect_response(tracked_url), tracking_result, None)
+
+
+def get_redirect_response(url):
+    """Returns a 302 Response redirecting to url.
+    """
+    return Response(302, "Found", (
+        ("Location", quote(url, safe=LOCATION_SAFE_CHARACTERS)),
+        ("Content-Length", "0")), b"")
@@ -0,0 +1,93 @@
+"""ASGI app serving the open and click tracking links without a web framework.
+
+::
+
+    # tracking_app.py, served with e.g. uvicorn tracking_app:application
+    from pytracking.asgi import ASGITrackingApp
+
+    class TrackingApp(ASGITrackingApp):
+        async def notify_tracking_event(self, tracking_result):
+            ...
+
+    application = TrackingApp(
+        base_open_tracking_url="https://trackingdomain.com/open/",
+        base_click_tracking_url="https://trackingdomain.com/click/",
+        trusted_proxies=["10.0.0.0/8"])
+"""
+import inspect
+
+from pytracking.app import CONSTANT_RESPONSES, TrackingApp
+
+
+class ASGITrackingApp(TrackingApp):
+    """ASGI application returning a tracking pixel for open tracking links and
+    a 302 redirect for click tracking links. See TrackingApp.
+
+    The notify_* methods can be coroutine functions.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The headers of the constant responses are encoded once.
+        self.encoded_headers = {
+            response: _encode_headers(response)
+            for response in CONSTANT_RESPONSES}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.handle_lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise ValueError(
+                "Unsupported scope type: {0}".format(scope["type"]))
+
+        (response, tracking_result, error) = self.process_request(
+            scope["method"], scope["path"],
+            lambda: self.get_scope_request_data(scope))
+
+        if error is not None:
+            result = self.notify_decoding_error(error, scope)
+        elif tracking_result is not None:
+            result = self.notify_tracking_event(tracking_result)
+        else:
+            result = None
+        if inspect.isawaitable(result):
+            await result
+
+        await send({
+            "type": "http.response.start",
+            "status": response.status,
+            "headers": self.encoded_headers.get(response) or
+            _encode_headers(response),
+        })
+        await send({
+            "type": "http.response.body",
+            "body": b"" if scope["method"] == "HEAD" else response.body,
+        })
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def get_scope_request_data(self, scope):
+        forwarded_for = None
+        user_agent = None
+        for (name, value) in scope["headers"]:
+            if name == b"x-forwarded-for":
+                forwarded_for = value.decode("latin-1")
+            elif name == b"user-agent":
+                user_agent = value.decode("latin-1")
+        client = scope.get("client")
+        return self.get_request_data(
+            client[0] if client else None, forwarded_for, user_agent)
+
+
+def _encode_headers(response):
+    return [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for (name, value) in response.headers]
@@ -0,0 +1,156 @@
+import asyncio
+
+import aiohttp
+
+from pytracking.tracking import get_configuration
+
+
+DEFAULT_MAX_CONCURRENCY = 100
+
+DEFAULT_LIMIT_PER_HOST = 20
+
+
+async def async_send_webhook(
+        tracking_result, configuration=None, session=None, **kwargs):
+    """Sends a POST request to the webhook URL specified in tracking_result
+    without blocking the event loop. See pytracking.webhook.send_webhook for
+    the content of the request.
+
+    Use an AsyncWebhookSender to reuse connections and bound the number of
+    concurrent requests when sending many webhooks.
+
+    :param tracking_result: The TrackingResult instance to post to a webhook.
+    :param configuration: An optional Configuration instance.
+    :param session: An optional aiohttp.ClientSession instance. If not
+        provided, a session is created for this request only.
+    :param kwargs: Optional configuration parameters. If provided with a
+        Configuration instance, the kwargs parameters will override the
+        Configuration parameters.
+    :return: The aiohttp.ClientResponse instance, with its body read.
+    """
+    configuration = get_configuration(configuration, kwargs)
+
+    if session is not None:
+        return await _post_webhook(session, tracking_result, configuration)
+
+    async with aiohttp.ClientSession() as session:
+        return await _post_webhook(session, tracking_result, configuration)
+
+
+class AsyncWebhookSender(object):
+    """Sends webhook requests concurrently from an asyncio event loop.
+
+    The number of requests in flight is bounded by a semaphore and the
+    connections to each webhook host are kept alive and reused.
+
+    ::
+
+        async with AsyncWebhookSender(configuration) as sender:
+            sender.submit(tracking_result)
+            ...
+        # All submitted requests have completed here.
+    """
+
+    def __init__(
+            self, configuration=None,
+            max_concurrency=DEFAULT_MAX_CONCURRENCY,
+            limit_per_host=DEFAULT_LIMIT_PER_HOST, session=None, **kwargs):
+        """
+        :param configuration: An optional Configuration instance.
+        :param max_concurrency: The maximum number of requests in flight.
+        :param limit_per_host: The maximum number of connections opened to a
+            single webhook host.
+        :param session: An optional aiohttp.ClientSession instance. If
+            provided, the sender does not close it.
+        :param kwargs: Optional configuration parameters. If provided with a
+            Configuration instance, the kwargs parameters will override the
+            Configuration parameters.
+        """
+        self.configuration = get_configuration(configuration, kwargs)
+        self.max_concurrency = max_concurrency
+        self.limit_per_host = limit_per_host
+        self.session = session
+        self.owns_session = session is None
+        self.semaphore = None
+        self.tasks = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.close()
+        else:
+            await self.cancel()
+            await self.close()
+
+    async def send(self, tracking_result):
+        """Sends the webhook request of tracking_result once fewer than
+        max_concurrency requests are in flight.
+
+        :param tracking_result: The TrackingResult instance to post to a
+            webhook.
+        :return: The aiohttp.ClientResponse instance, with its body read.
+        """
+        # Created lazily to be bound to the running event loop.
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_concurrency,
+                    limit_per_host=self.limit_per_host))
+
+        async with self.semaphore:
+            return await _post_webhook(
+                self.session, tracking_result, self.configuration)
+
+    def submit(self, tracking_result):
+        """Schedules the webhook request of tracking_result and returns
+        immediately. Must be called from the event loop.
+
+        :param tracking_result: The TrackingResult instance to post to a
+            webhook.
+        :return: The asyncio.Task sending the request.
+        """
+        task = asyncio.ensure_future(self.send(tracking_result))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def join(self):
+        """Waits until all submitted requests have completed.
+
+        :return: The list of responses or exceptions of the requests that
+            were in flight.
+        """
+        if not self.tasks:
+            return []
+        return await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def cancel(self):
+        """Cancels all submitted requests that have not completed yet.
+        """
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def close(self):
+        """Waits for the submitted requests and closes the connections.
+        """
+        await self.join()
+        if self.owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+async def _post_webhook(session, tracking_result, configuration):
+    timeout = aiohttp.ClientTimeout(
+        total=configuration.webhook_timeout_seconds)
+    async with session.post(
+            tracking_result.webhook_url,
+            json=tracking_result.to_webhook_payload(),
+            timeout=timeout) as response:
+        await response.read()
+        return response
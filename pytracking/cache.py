@@ -0,0 +1,180 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+DEFAULT_CACHE_SIZE = 128
+
+DEFAULT_DECODE_CACHE_SIZE = 4096
+
+DEFAULT_DECODE_CACHE_TTL_SECONDS = 60
+
+
+def make_hashable(value):
+    """Returns a hashable equivalent of a JSON-like value (e.g., metadata)
+    that can be used as a cache key.
+    """
+    if isinstance(value, dict):
+        return (dict, frozenset(
+            (key, make_hashable(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(make_hashable(item) for item in value))
+    if isinstance(value, set):
+        return (set, frozenset(value))
+    return value
+
+
+class LRUCache(object):
+    """A thread-safe mapping that holds at most maxsize entries and evicts the
+    least recently used entry when full.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        """
+        :param maxsize: The maximum number of entries kept in the cache.
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getstate__(self):
+        # Locks cannot be pickled and the entries are only a cache: a
+        # cache shipped to another process starts empty.
+        return {"maxsize": self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(state["maxsize"])
+
+    def get(self, key, default=None):
+        """Returns the value associated with key, or default if the key is not
+        in the cache.
+        """
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        """Associates value with key, evicting the least recently used entry
+        if the cache is full.
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Removes all entries from the cache.
+        """
+        with self._lock:
+            self._data.clear()
+
+
+class DecodeCache(object):
+    """A thread-safe LRU cache whose entries expire after ttl_seconds, used to
+    remember decoded tracking links.
+
+    get_or_compute is single-flight: when several threads ask for a key that
+    is not cached, only one computes the value and the others wait for it.
+    Errors are not cached.
+    """
+
+    def __init__(
+            self, maxsize=DEFAULT_DECODE_CACHE_SIZE,
+            ttl_seconds=DEFAULT_DECODE_CACHE_TTL_SECONDS):
+        """
+        :param maxsize: The maximum number of entries kept in the cache.
+        :param ttl_seconds: The number of seconds an entry is kept.
+        """
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getstate__(self):
+        return {"maxsize": self.maxsize, "ttl_seconds": self.ttl_seconds}
+
+    def __setstate__(self, state):
+        self.__init__(state["maxsize"], state["ttl_seconds"])
+
+    def get_stats(self):
+        """Returns a dict with the number of hits, misses and entries.
+        Requests that waited for another thread computing the value count as
+        hits.
+        """
+        return {
+            "hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+    def get_or_compute(self, key, function):
+        """Returns the value associated with key, calling function() to
+        compute it if the key is not cached or expired.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+            flight = self._in_flight.get(key)
+            if flight is None:
+                flight = self._in_flight[key] = _Flight()
+                self.misses += 1
+                is_leader = True
+            else:
+                self.hits += 1
+                is_leader = False
+
+        if not is_leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = function()
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if flight.error is None:
+                    self._data[key] = (
+                        time.monotonic() + self.ttl_seconds, flight.value)
+                    while len(self._data) > self.maxsize:
+                        self._data.popitem(last=False)
+            flight.event.set()
+        return flight.value
+
+    def clear(self):
+        """Removes all entries from the cache and resets the counters.
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class _Flight(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
@@ -0,0 +1,209 @@
+"""Classification of the tracking events made by machines (security scanners,
+link prefetchers, bots) rather than by the recipients of an email.
+
+An event is classified from the user agent and the IP of the request (see the
+request_data of TrackingResult)::
+
+    from pytracking.classifier import EventClassifier
+
+    classifier = EventClassifier(ip_networks=["192.0.2.0/24"])
+    classification = classifier.classify_tracking_result(tracking_result)
+    if classification.is_machine:
+        ...
+"""
+from bisect import bisect_right
+from collections import deque, namedtuple
+import ipaddress
+import re
+import socket
+import time
+
+from pytracking.cache import LRUCache, DEFAULT_CACHE_SIZE
+
+
+REASON_USER_AGENT = "user_agent"
+
+REASON_IP = "ip"
+
+REASON_BURST = "burst"
+
+REASON_TOO_EARLY = "too_early"
+
+# Case-insensitive regular expressions matched anywhere in the user agent.
+# "bot" is anchored to not match device names such as "Cubot".
+DEFAULT_USER_AGENT_PATTERNS = (
+    r"\bbot\b", r"bot/", r"slackbot", r"crawler", r"spider", r"slurp", r"scanner", r"preview",
+    r"facebookexternalhit", r"proofpoint", r"mimecast", r"barracuda",
+    r"symantec", r"messagelabs", r"forcepoint", r"trendmicro", r"fireeye",
+    r"sophos", r"headlesschrome", r"phantomjs", r"python-requests",
+    r"python-urllib", r"aiohttp", r"go-http-client", r"java/", r"okhttp",
+    r"libwww-perl", r"curl/", r"wget",
+)
+
+DEFAULT_BURST_COUNT = 5
+
+DEFAULT_BURST_WINDOW_SECONDS = 1.0
+
+Classification = namedtuple("Classification", ["is_machine", "reason"])
+
+HUMAN = Classification(False, None)
+
+
+class IPRanges(object):
+    """A set of IP networks, held as sorted, merged integer ranges and
+    searched with a binary search.
+    """
+
+    def __init__(self, networks):
+        """
+        :param networks: A list of IP addresses or networks, e.g.,
+            "10.0.0.0/8".
+        """
+        # address family -> ([range starts], [range ends])
+        self.ranges = {socket.AF_INET: ([], []), socket.AF_INET6: ([], [])}
+        parsed = sorted(
+            (network.version, int(network.network_address),
+             int(network.broadcast_address))
+            for network in (
+                ipaddress.ip_network(network, strict=False)
+                for network in networks))
+        for (version, start, end) in parsed:
+            (starts, ends) = self.ranges[
+                socket.AF_INET if version == 4 else socket.AF_INET6]
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+
+    def __len__(self):
+        return sum(len(starts) for (starts, _) in self.ranges.values())
+
+    def __contains__(self, address):
+        # inet_pton is several times faster than ipaddress.ip_address
+        family = socket.AF_INET6 if ":" in address else socket.AF_INET
+        try:
+            packed = socket.inet_pton(family, address)
+        except (OSError, ValueError):
+            return False
+        (starts, ends) = self.ranges[family]
+        value = int.from_bytes(packed, "big")
+        index = bisect_right(starts, value) - 1
+        return index >= 0 and value <= ends[index]
+
+
+class EventClassifier(object):
+    """Flags the tracking events that are likely made by a machine:
+
+    - the user agent matches one of the user_agent_patterns,
+    - the IP is in one of the ip_networks,
+    - the IP made burst_count requests within burst_window_seconds,
+    - the event happened less than min_delay_seconds after the email was
+      sent, if sent_at_key is provided.
+
+    The burst state is kept in memory and is not shared between processes.
+    """
+
+    def __init__(
+            self, user_agent_patterns=DEFAULT_USER_AGENT_PATTERNS,
+            ip_networks=(), burst_count=DEFAULT_BURST_COUNT,
+            burst_window_seconds=DEFAULT_BURST_WINDOW_SECONDS,
+            sent_at_key=None, min_delay_seconds=0,
+            flag_missing_user_agent=False, cache_size=DEFAULT_CACHE_SIZE,
+            clock=time.monotonic):
+        """
+        :param user_agent_patterns: A list of case-insensitive regular
+            expressions.
+        :param ip_networks: A list of IP addresses or networks.
+        :param burst_count: The number of requests from one IP within
+            burst_window_seconds that makes a burst. 0 disables the burst
+            detection.
+        :param burst_window_seconds: See burst_count.
+        :param sent_at_key: An optional metadata key holding the time (seconds
+            since epoch) when the email was sent.
+        :param min_delay_seconds: See sent_at_key.
+        :param flag_missing_user_agent: If True, requests without a user
+            agent are flagged.
+        :param cache_size: The maximum number of user agents and of IPs whose
+            state is remembered.
+        :param clock: A callable returning the time used by the burst
+            detection, in seconds.
+        """
+        self.user_agent_re = re.compile(
+            "|".join(user_agent_patterns), re.IGNORECASE)\
+            if user_agent_patterns else None
+        self.ip_ranges = IPRanges(ip_networks)
+        self.burst_count = burst_count
+        self.burst_window_seconds = burst_window_seconds
+        self.sent_at_key = sent_at_key
+        self.min_delay_seconds = min_delay_seconds
+        self.flag_missing_user_agent = flag_missing_user_agent
+        self.clock = clock
+        # user agent -> True if it matches
+        self.user_agent_cache = LRUCache(cache_size)
+        # ip -> deque of the times of its last burst_count requests
+        self.ip_requests = LRUCache(cache_size)
+
+    def classify(self, request_data, metadata=None):
+        """Returns a Classification.
+
+        :param request_data: A dict with the user_agent and user_ip keys.
+        :param metadata: The optional metadata of the tracking link.
+        """
+        request_data = request_data or {}
+        user_agent = request_data.get("user_agent")
+        user_ip = request_data.get("user_ip")
+
+        # The burst detection must see every request of an IP.
+        is_burst = self.record_request(user_ip)
+
+        if self.is_machine_user_agent(user_agent):
+            return Classification(True, REASON_USER_AGENT)
+        if user_ip and self.ip_ranges and user_ip in self.ip_ranges:
+            return Classification(True, REASON_IP)
+        if is_burst:
+            return Classification(True, REASON_BURST)
+        if self.sent_at_key and metadata:
+            sent_at = metadata.get(self.sent_at_key)
+            if sent_at is not None and\
+                    time.time() - sent_at < self.min_delay_seconds:
+                return Classification(True, REASON_TOO_EARLY)
+        return HUMAN
+
+    def classify_tracking_result(self, tracking_result):
+        """Classifies a TrackingResult, sets its classification attribute
+        and returns the Classification.
+        """
+        classification = self.classify(
+            tracking_result.request_data, tracking_result.metadata)
+        tracking_result.classification = classification
+        return classification
+
+    def is_machine_user_agent(self, user_agent):
+        """Returns True if user_agent matches a pattern or is missing and
+        flag_missing_user_agent is True.
+        """
+        if not user_agent:
+            return self.flag_missing_user_agent
+        if self.user_agent_re is None:
+            return False
+        is_machine = self.user_agent_cache.get(user_agent)
+        if is_machine is None:
+            is_machine = self.user_agent_re.search(user_agent) is not None
+            self.user_agent_cache.set(user_agent, is_machine)
+        return is_machine
+
+    def record_request(self, user_ip):
+        """Records a request of user_ip and returns True if it is part of a
+        burst.
+        """
+        if not user_ip or self.burst_count <= 0:
+            return False
+        now = self.clock()
+        request_times = self.ip_requests.get(user_ip)
+        if request_times is None:
+            request_times = deque(maxlen=self.burst_count)
+            self.ip_requests.set(user_ip, request_times)
+        request_times.append(now)
+        return len(request_times) == self.burst_count and\
+            now - request_times[0] <= self.burst_window_seconds
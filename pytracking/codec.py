@@ -0,0 +1,442 @@
+"""Codecs that serialize the data embedded in tracking links to bytes.
+
+The first byte of the encoded data identifies the codec, so the data of links
+encoded with any codec can be decoded whatever the configured codec is:
+
+- "{" (0x7b): JSON, the original format of pytracking.
+- 0x01: the compact binary format.
+- 0x02: data compressed with zlib (raw deflate), optionally with a preset
+  dictionary. The decompressed data starts with one of the above bytes.
+"""
+import json
+import struct
+import zlib
+
+
+JSON_VERSION = 0x7b
+
+COMPACT_VERSION = 0x01
+
+COMPRESSED_VERSION = 0x02
+
+DEFAULT_MAX_DECOMPRESSED_SIZE = 64 * 1024
+
+# Maximum size of a zlib preset dictionary (the size of the deflate window).
+MAX_COMPRESSION_DICTIONARY_SIZE = 32 * 1024
+
+# Raw deflate streams, without the zlib header and checksum.
+_COMPRESSION_WBITS = -15
+
+# Tracking data is tiny: the smallest memory level is much faster to set up
+# and compresses as well.
+_COMPRESSION_MEMORY_LEVEL = 1
+
+# Flags of the compact format: which fields of the embedded data follow.
+_URL_FLAG = 0x01
+_METADATA_FLAG = 0x02
+_WEBHOOK_FLAG = 0x04
+_OTHER_FLAG = 0x08
+
+# Tags of the values of the compact format.
+_NONE = 0x00
+_FALSE = 0x01
+_TRUE = 0x02
+_INT = 0x03
+_NEGATIVE_INT = 0x04
+_FLOAT = 0x05
+_STR = 0x06
+_LIST = 0x07
+_DICT = 0x08
+
+_FLOAT_STRUCT = struct.Struct(">d")
+
+
+class Codec(object):
+    """Base class of the codecs.
+
+    version is the first byte of the encoded data and identifies the codec
+    when decoding.
+    """
+
+    name = None
+
+    version = None
+
+    def encode(self, data, encoding="utf-8"):
+        """Returns the bytes representing data.
+
+        :param data: The dict to embed in a tracking link.
+        :param encoding: The encoding of the strings.
+        """
+        raise NotImplementedError
+
+    def decode(self, byte_str, encoding="utf-8"):
+        """Returns the dict represented by byte_str.
+
+        :param byte_str: Bytes returned by encode.
+        :param encoding: The encoding of the strings.
+        """
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    """Encodes the data in JSON. Links encoded with this codec are compatible
+    with all versions of pytracking.
+    """
+
+    name = "json"
+
+    version = JSON_VERSION
+
+    def encode(self, data, encoding="utf-8"):
+        return json.dumps(data).encode(encoding)
+
+    def decode(self, byte_str, encoding="utf-8"):
+        return json.loads(byte_str.decode(encoding))
+
+
+class CompactCodec(Codec):
+    """Encodes the data in a compact binary format:
+
+    - the version byte (0x01) and a byte of flags telling which of the url,
+      metadata and webhook fields are present,
+    - the url string, the metadata items and the webhook string,
+    - a tagged dict with any other field.
+
+    Strings are prefixed with their length as a varint and values are
+    prefixed with a one-byte tag. It supports the same values as JSON.
+    """
+
+    name = "compact"
+
+    version = COMPACT_VERSION
+
+    def encode(self, data, encoding="utf-8"):
+        output = bytearray((COMPACT_VERSION, 0))
+        flags = 0
+        other = None
+
+        for key, value in data.items():
+            if key == "url" and type(value) is str:
+                flags |= _URL_FLAG
+            elif key == "metadata" and type(value) is dict:
+                flags |= _METADATA_FLAG
+            elif key == "webhook" and type(value) is str:
+                flags |= _WEBHOOK_FLAG
+            else:
+                if other is None:
+                    other = {}
+                other[key] = value
+
+        if flags & _URL_FLAG:
+            _write_str(data["url"], output, encoding)
+        if flags & _METADATA_FLAG:
+            _write_dict_items(data["metadata"], output, encoding)
+        if flags & _WEBHOOK_FLAG:
+            _write_str(data["webhook"], output, encoding)
+        if other:
+            flags |= _OTHER_FLAG
+            _write_value(other, output, encoding)
+
+        output[1] = flags
+        return bytes(output)
+
+    def decode(self, byte_str, encoding="utf-8"):
+        if len(byte_str) < 2 or byte_str[0] != COMPACT_VERSION:
+            raise ValueError("Not a compact payload")
+        flags = byte_str[1]
+        position = 2
+        data = {}
+        try:
+            if flags & _URL_FLAG:
+                data["url"], position = _read_str(
+                    byte_str, position, encoding)
+            if flags & _METADATA_FLAG:
+                data["metadata"], position = _read_dict_items(
+                    byte_str, position, encoding)
+            if flags & _WEBHOOK_FLAG:
+                data["webhook"], position = _read_str(
+                    byte_str, position, encoding)
+            if flags & _OTHER_FLAG:
+                other, position = _read_value(byte_str, position, encoding)
+                data.update(other)
+        except (IndexError, struct.error):
+            raise ValueError("Truncated compact payload")
+        if position != len(byte_str):
+            raise ValueError("Unexpected data after the compact payload")
+        return data
+
+
+JSON_CODEC = JSONCodec()
+
+COMPACT_CODEC = CompactCodec()
+
+CODECS = {
+    JSON_CODEC.name: JSON_CODEC,
+    COMPACT_CODEC.name: COMPACT_CODEC,
+}
+
+CODECS_BY_VERSION = {
+    JSON_CODEC.version: JSON_CODEC,
+    COMPACT_CODEC.version: COMPACT_CODEC,
+}
+
+
+def get_codec(codec):
+    """Returns the Codec instance for codec, which can be None (the JSON
+    codec), the name of a codec or a Codec instance.
+    """
+    if codec is None:
+        return JSON_CODEC
+    if isinstance(codec, str):
+        try:
+            return CODECS[codec]
+        except KeyError:
+            raise ValueError("Unknown codec: {0}".format(codec))
+    return codec
+
+
+def decode_data(
+        byte_str, codec=None, encoding="utf-8", compression_dictionary=None,
+        max_decompressed_size=DEFAULT_MAX_DECOMPRESSED_SIZE):
+    """Decodes the data encoded by any known codec or by codec, and
+    compressed or not by compress_data.
+
+    :param byte_str: The encoded data.
+    :param codec: The configured codec (e.g., a custom Codec instance).
+    :param encoding: The encoding of the strings.
+    :param compression_dictionary: The preset dictionary given to
+        compress_data.
+    :param max_decompressed_size: The maximum size of decompressed data.
+    """
+    if byte_str and byte_str[0] == COMPRESSED_VERSION:
+        byte_str = decompress_data(
+            byte_str, compression_dictionary, max_decompressed_size)
+        if byte_str and byte_str[0] == COMPRESSED_VERSION:
+            raise ValueError("Nested compressed payload")
+    if not byte_str:
+        raise ValueError("Empty payload")
+    version = byte_str[0]
+    codec = get_codec(codec)
+    if version != codec.version:
+        try:
+            codec = CODECS_BY_VERSION[version]
+        except KeyError:
+            raise ValueError("Unknown payload version: {0}".format(version))
+    return codec.decode(byte_str, encoding)
+
+
+def compress_data(byte_str, compression_dictionary=None):
+    """Returns byte_str compressed with zlib and prefixed with the compressed
+    version byte.
+
+    :param byte_str: The data encoded by a codec.
+    :param compression_dictionary: An optional preset dictionary (bytes): a
+        sequence of strings that are likely to appear in the data, the most
+        common ones at the end.
+    """
+    if compression_dictionary:
+        compressor = zlib.compressobj(
+            zlib.Z_BEST_COMPRESSION, zlib.DEFLATED, _COMPRESSION_WBITS,
+            _COMPRESSION_MEMORY_LEVEL, zlib.Z_DEFAULT_STRATEGY,
+            compression_dictionary)
+    else:
+        compressor = zlib.compressobj(
+            zlib.Z_BEST_COMPRESSION, zlib.DEFLATED, _COMPRESSION_WBITS,
+            _COMPRESSION_MEMORY_LEVEL)
+    return bytes((COMPRESSED_VERSION,)) + compressor.compress(byte_str) +\
+        compressor.flush()
+
+
+def decompress_data(
+        byte_str, compression_dictionary=None,
+        max_decompressed_size=DEFAULT_MAX_DECOMPRESSED_SIZE):
+    """Returns the data compressed by compress_data.
+
+    Raises ValueError if the data is invalid or if the decompressed data
+    would be larger than max_decompressed_size (e.g., a decompression bomb).
+    """
+    if not byte_str or byte_str[0] != COMPRESSED_VERSION:
+        raise ValueError("Not a compressed payload")
+    try:
+        if compression_dictionary:
+            decompressor = zlib.decompressobj(
+                _COMPRESSION_WBITS, compression_dictionary)
+        else:
+            decompressor = zlib.decompressobj(_COMPRESSION_WBITS)
+        decompressed = decompressor.decompress(
+            byte_str[1:], max_decompressed_size)
+    except zlib.error as error:
+        raise ValueError("Invalid compressed payload: {0}".format(error))
+    if decompressor.unconsumed_tail:
+        raise ValueError(
+            "Decompressed payload larger than {0} bytes".format(
+                max_decompressed_size))
+    if not decompressor.eof or decompressor.unused_data:
+        raise ValueError("Invalid compressed payload")
+    return decompressed
+
+
+def get_compression_dictionary(
+        data_samples, codec=None, encoding="utf-8",
+        max_size=MAX_COMPRESSION_DICTIONARY_SIZE):
+    """Returns a preset dictionary for compress_data made of the encoded
+    samples, e.g., the data embedded in the links of a past campaign.
+
+    The dictionary must not change once links compressed with it are sent:
+    keep it in your settings or source code.
+
+    :param data_samples: An iterable of dicts like the ones passed to
+        Codec.encode.
+    :param codec: The codec that will encode the data.
+    :param encoding: The encoding of the strings.
+    :param max_size: The maximum size of the dictionary.
+    """
+    codec = get_codec(codec)
+    encoded_samples = []
+    size = 0
+    for data in data_samples:
+        encoded = codec.encode(data, encoding)
+        if size + len(encoded) > max_size:
+            break
+        encoded_samples.append(encoded)
+        size += len(encoded)
+    return b"".join(encoded_samples)
+
+
+def _write_varint(value, output):
+    while value >= 0x80:
+        output.append((value & 0x7f) | 0x80)
+        value >>= 7
+    output.append(value)
+
+
+def _read_varint(byte_str, position):
+    byte = byte_str[position]
+    if byte < 0x80:
+        return byte, position + 1
+    value = 0
+    shift = 0
+    while True:
+        byte = byte_str[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def _write_str(value, output, encoding):
+    byte_str = value.encode(encoding)
+    length = len(byte_str)
+    if length < 0x80:
+        output.append(length)
+    else:
+        _write_varint(length, output)
+    output += byte_str
+
+
+def _read_str(byte_str, position, encoding):
+    length = byte_str[position]
+    if length < 0x80:
+        position += 1
+    else:
+        length, position = _read_varint(byte_str, position)
+    end = position + length
+    if end > len(byte_str):
+        raise IndexError(end)
+    return byte_str[position:end].decode(encoding), end
+
+
+def _write_dict_items(value, output, encoding):
+    _write_varint(len(value), output)
+    for key, item in value.items():
+        if type(key) is not str:
+            if key is None or isinstance(key, (int, float)):
+                # Same conversion as JSON
+                key = json.dumps(key)
+            elif not isinstance(key, str):
+                raise TypeError(
+                    "keys must be str, int, float, bool or None, not {0}"
+                    .format(type(key).__name__))
+        _write_str(key, output, encoding)
+        _write_value(item, output, encoding)
+
+
+def _read_dict_items(byte_str, position, encoding):
+    length, position = _read_varint(byte_str, position)
+    value = {}
+    for _ in range(length):
+        key, position = _read_str(byte_str, position, encoding)
+        value[key], position = _read_value(byte_str, position, encoding)
+    return value, position
+
+
+def _write_value(value, output, encoding):
+    value_type = type(value)
+    if value_type is str:
+        output.append(_STR)
+        _write_str(value, output, encoding)
+    elif value_type is int:
+        if value >= 0:
+            output.append(_INT)
+            _write_varint(value, output)
+        else:
+            output.append(_NEGATIVE_INT)
+            _write_varint(-value, output)
+    elif value is None:
+        output.append(_NONE)
+    elif value is True:
+        output.append(_TRUE)
+    elif value is False:
+        output.append(_FALSE)
+    elif isinstance(value, str):
+        output.append(_STR)
+        _write_str(value, output, encoding)
+    elif isinstance(value, int):
+        _write_value(int(value), output, encoding)
+    elif isinstance(value, float):
+        output.append(_FLOAT)
+        output += _FLOAT_STRUCT.pack(value)
+    elif isinstance(value, dict):
+        output.append(_DICT)
+        _write_dict_items(value, output, encoding)
+    elif isinstance(value, (list, tuple)):
+        output.append(_LIST)
+        _write_varint(len(value), output)
+        for item in value:
+            _write_value(item, output, encoding)
+    else:
+        raise TypeError(
+            "Object of type {0} is not serializable".format(
+                value_type.__name__))
+
+
+def _read_value(byte_str, position, encoding):
+    tag = byte_str[position]
+    position += 1
+    if tag == _STR:
+        return _read_str(byte_str, position, encoding)
+    if tag == _INT:
+        return _read_varint(byte_str, position)
+    if tag == _NONE:
+        return None, position
+    if tag == _TRUE:
+        return True, position
+    if tag == _FALSE:
+        return False, position
+    if tag == _NEGATIVE_INT:
+        value, position = _read_varint(byte_str, position)
+        return -value, position
+    if tag == _FLOAT:
+        return _FLOAT_STRUCT.unpack_from(byte_str, position)[0], position + 8
+    if tag == _DICT:
+        return _read_dict_items(byte_str, position, encoding)
+    if tag == _LIST:
+        length, position = _read_varint(byte_str, position)
+        value = []
+        for _ in range(length):
+            item, position = _read_value(byte_str, position, encoding)
+            value.append(item)
+        return value, position
+    raise ValueError("Unknown tag: {0}".format(tag))
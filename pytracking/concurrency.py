@@ -0,0 +1,260 @@
+from collections import deque
+from itertools import islice
+import logging
+import os
+import queue
+import threading
+import time
+
+from pytracking.metrics import EXECUTOR_DROPPED_TASKS_TOTAL, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_BLOCK = "block"
+
+BACKPRESSURE_DROP = "drop"
+
+BACKPRESSURE_DROP_OLDEST = "drop_oldest"
+
+BACKPRESSURE_CALLER_RUNS = "caller_runs"
+
+BACKPRESSURE_POLICIES = (
+    BACKPRESSURE_BLOCK, BACKPRESSURE_DROP, BACKPRESSURE_DROP_OLDEST,
+    BACKPRESSURE_CALLER_RUNS)
+
+DEFAULT_EXECUTOR_MAX_WORKERS = 4
+
+DEFAULT_EXECUTOR_QUEUE_SIZE = 10000
+
+DEFAULT_DROP_LOG_INTERVAL_SECONDS = 60
+
+
+def imap_bounded(executor, function, iterable, max_pending):
+    """Applies function to each item of iterable using executor and yields
+    the results in order.
+
+    Unlike Executor.map, the iterable is consumed lazily: at most max_pending
+    items are submitted ahead of the consumer, so memory stays bounded when
+    the iterable is very large (e.g., millions of recipients).
+
+    Pending tasks are cancelled if the generator is closed before being
+    exhausted.
+
+    :param executor: A concurrent.futures.Executor instance.
+    :param function: The callable to apply to each item.
+    :param iterable: The items to process.
+    :param max_pending: The maximum number of submitted tasks whose result
+        has not been yielded yet.
+    """
+    iterator = iter(iterable)
+    pending = deque(
+        executor.submit(function, item)
+        for item in islice(iterator, max(max_pending, 1)))
+    try:
+        while pending:
+            future = pending.popleft()
+            for item in islice(iterator, 1):
+                pending.append(executor.submit(function, item))
+            yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def pool_imap_bounded(pool, function, iterable, max_pending):
+    """Same as imap_bounded, for a multiprocessing.Pool instance.
+
+    Pool.imap consumes the whole iterable ahead of the consumer, so use this
+    function when the iterable is very large.
+
+    :param pool: A multiprocessing.Pool instance.
+    :param function: The picklable callable to apply to each item.
+    :param iterable: The items to process.
+    :param max_pending: The maximum number of submitted tasks whose result
+        has not been yielded yet.
+    """
+    iterator = iter(iterable)
+    pending = deque(
+        pool.apply_async(function, (item,))
+        for item in islice(iterator, max(max_pending, 1)))
+    while pending:
+        async_result = pending.popleft()
+        for item in islice(iterator, 1):
+            pending.append(pool.apply_async(function, (item,)))
+        yield async_result.get()
+
+
+def iter_chunks(iterable, chunksize):
+    """Yields lists of at most chunksize items from iterable.
+    """
+    iterator = iter(iterable)
+    chunksize = max(chunksize, 1)
+    while True:
+        chunk = list(islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+class BoundedExecutor(object):
+    """Runs functions in a pool of daemon threads, fed by a bounded queue.
+
+    Unlike concurrent.futures.ThreadPoolExecutor, the queue has a maximum
+    size, and a backpressure policy decides what submit does when it is full:
+
+    - "block": waits for a free slot, at most block_timeout seconds, and then
+      drops the task.
+    - "drop": drops the task.
+    - "drop_oldest": drops the oldest queued task to make room for the task.
+    - "caller_runs": runs the task in the calling thread.
+
+    The exceptions raised by the tasks are logged. The dropped tasks are
+    counted in the pytracking_executor_dropped_tasks_total metric and logged
+    at most once per drop_log_interval_seconds. The threads are started on
+    the first submit, and started again in a forked process.
+    """
+
+    def __init__(
+            self, max_workers=DEFAULT_EXECUTOR_MAX_WORKERS,
+            max_queue_size=DEFAULT_EXECUTOR_QUEUE_SIZE,
+            backpressure=BACKPRESSURE_BLOCK, block_timeout=None,
+            thread_name_prefix="pytracking-executor",
+            drop_log_interval_seconds=DEFAULT_DROP_LOG_INTERVAL_SECONDS):
+        """
+        :param max_workers: The number of threads running the tasks.
+        :param max_queue_size: The maximum number of tasks waiting for a
+            thread.
+        :param backpressure: One of BACKPRESSURE_POLICIES.
+        :param block_timeout: The maximum number of seconds submit waits for a
+            free slot with the "block" policy. None waits forever.
+        :param thread_name_prefix: The prefix of the names of the threads.
+        :param drop_log_interval_seconds: The minimum number of seconds
+            between two warnings about dropped tasks.
+        """
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(
+                "Unknown backpressure policy: {0}".format(backpressure))
+        self.max_workers = max(max_workers, 1)
+        self.max_queue_size = max_queue_size
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self.thread_name_prefix = thread_name_prefix
+        self.drop_log_interval_seconds = drop_log_interval_seconds
+        self.dropped = 0
+        self.dropped_since_log = 0
+        self.last_drop_log = None
+        self.lock = threading.Lock()
+        self.pid = None
+        self.queue = None
+        self.threads = []
+
+    def submit(self, function, *args, **kwargs):
+        """Queues function(*args, **kwargs). Returns False if the task was
+        dropped because the queue was full.
+        """
+        if self.pid != os.getpid():
+            self._start()
+        task = (function, args, kwargs)
+        task_queue = self.queue
+        try:
+            if self.backpressure == BACKPRESSURE_BLOCK:
+                task_queue.put(task, timeout=self.block_timeout)
+            else:
+                task_queue.put_nowait(task)
+            return True
+        except queue.Full:
+            pass
+
+        if self.backpressure == BACKPRESSURE_CALLER_RUNS:
+            self._run(task)
+            return True
+        if self.backpressure == BACKPRESSURE_DROP_OLDEST:
+            while True:
+                try:
+                    task_queue.get_nowait()
+                    task_queue.task_done()
+                    self._record_dropped()
+                except queue.Empty:
+                    pass
+                try:
+                    task_queue.put_nowait(task)
+                    return True
+                except queue.Full:
+                    pass
+        self._record_dropped()
+        return False
+
+    def join(self):
+        """Blocks until all the queued tasks are done.
+        """
+        if self.pid == os.getpid():
+            self.queue.join()
+
+    def shutdown(self, wait=True):
+        """Stops the threads once the queued tasks are done.
+
+        :param wait: If True, blocks until the threads have stopped.
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            threads = self.threads
+            for _ in threads:
+                self.queue.put(None)
+            self.pid = None
+            self.threads = []
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.max_queue_size)
+            self.threads = [
+                threading.Thread(
+                    target=self._work, args=(self.queue,),
+                    name="{0}-{1}".format(self.thread_name_prefix, index),
+                    daemon=True)
+                for index in range(self.max_workers)]
+            for thread in self.threads:
+                thread.start()
+            self.pid = os.getpid()
+
+    def _work(self, task_queue):
+        while True:
+            task = task_queue.get()
+            try:
+                if task is None:
+                    return
+                self._run(task)
+            finally:
+                task_queue.task_done()
+
+    def _run(self, task):
+        (function, args, kwargs) = task
+        try:
+            function(*args, **kwargs)
+        except Exception:
+            logger.exception("Error in a background task")
+
+    def _record_dropped(self):
+        REGISTRY.inc(
+            EXECUTOR_DROPPED_TASKS_TOTAL,
+            (("executor", self.thread_name_prefix),))
+        now = time.monotonic()
+        with self.lock:
+            self.dropped += 1
+            self.dropped_since_log += 1
+            if (self.last_drop_log is not None and
+                    now - self.last_drop_log <
+                    self.drop_log_interval_seconds):
+                return
+            self.last_drop_log = now
+            dropped_since_log = self.dropped_since_log
+            dropped = self.dropped
+            self.dropped_since_log = 0
+        logger.warning(
+            "The queue of the executor is full, %d tasks dropped "
+            "(%d in total)", dropped_since_log, dropped)
@@ -0,0 +1,113 @@
+"""Deduplication of the tracking events repeated within a time window, e.g., a
+recipient opening an email several times or a proxy fetching the pixel again.
+
+An event is identified by its type (open or click) and the values of some
+metadata keys::
+
+    from pytracking.dedupe import EventDeduplicator
+
+    deduplicator = EventDeduplicator(["campaign_id", "recipient_id"])
+    if not deduplicator.is_duplicate(tracking_result):
+        send_webhook(tracking_result)
+"""
+import threading
+import time
+
+from pytracking.cache import make_hashable
+from pytracking.stats import TRACKED_URL_KEY
+
+
+DEFAULT_DEDUPE_WINDOW_SECONDS = 3600
+
+DEFAULT_DEDUPE_MAX_KEYS = 1000000
+
+
+class EventDeduplicator(object):
+    """Remembers the events seen in the last window_seconds in two rotating
+    generations of hashes: an event is a duplicate if its hash is in the
+    current or in the previous generation. The current generation becomes
+    the previous one every window_seconds, or earlier when it holds half of
+    max_keys, so the memory stays bounded.
+
+    An event is thus remembered for window_seconds at least, and for less if
+    there are more than max_keys / 2 distinct events in a window. The state
+    is kept in memory and is not shared between processes.
+    """
+
+    def __init__(
+            self, key_fields, window_seconds=DEFAULT_DEDUPE_WINDOW_SECONDS,
+            max_keys=DEFAULT_DEDUPE_MAX_KEYS, clock=time.monotonic):
+        """
+        :param key_fields: The metadata keys identifying an event, in
+            addition to its type. TRACKED_URL_KEY identifies the tracked URL
+            of a click.
+        :param window_seconds: The minimum time an event is remembered.
+        :param max_keys: The maximum number of event hashes kept in memory.
+        :param clock: A callable returning the current time in seconds.
+        """
+        self.key_fields = tuple(key_fields)
+        self.window_seconds = window_seconds
+        self.max_generation_size = max(max_keys // 2, 1)
+        self.clock = clock
+        self.current = set()
+        self.previous = set()
+        self.rotated_at = clock()
+        self.duplicates = 0
+        self.unique = 0
+        self.lock = threading.Lock()
+
+    def get_key(self, tracking_result):
+        """Returns the hash identifying tracking_result, or None if it has
+        none of the key fields.
+        """
+        metadata = tracking_result.metadata or {}
+        values = tuple(
+            tracking_result.tracked_url if name == TRACKED_URL_KEY
+            else make_hashable(metadata.get(name))
+            for name in self.key_fields)
+        if not any(value is not None for value in values):
+            return None
+        return hash((tracking_result.is_open_tracking,) + values)
+
+    def is_duplicate(self, tracking_result):
+        """Returns True if the same event was seen in the window. Otherwise,
+        remembers the event and returns False.
+
+        :param tracking_result: An instance of TrackingResult.
+        """
+        key = self.get_key(tracking_result)
+        if key is None:
+            # Unrelated events without key fields are never duplicates.
+            with self.lock:
+                self.unique += 1
+            return False
+        now = self.clock()
+        with self.lock:
+            elapsed = now - self.rotated_at
+            if elapsed >= 2 * self.window_seconds:
+                # Both generations are older than the window.
+                self.previous = set()
+                self.current = set()
+                self.rotated_at = now
+            elif elapsed >= self.window_seconds or\
+                    len(self.current) >= self.max_generation_size:
+                self.previous = self.current
+                self.current = set()
+                self.rotated_at = now
+            if key in self.current or key in self.previous:
+                self.duplicates += 1
+                return True
+            self.current.add(key)
+            self.unique += 1
+            return False
+
+    def get_stats(self):
+        """Returns a dict with the number of duplicate and unique events and
+        the number of remembered events.
+        """
+        with self.lock:
+            return {
+                "duplicates": self.duplicates,
+                "unique": self.unique,
+                "size": len(self.current) + len(self.previous),
+            }
@@ -1,18 +1,54 @@
+import asyncio
+import functools
+import threading
+
+import django
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
 from django.http import (
     HttpResponseRedirect, Http404, HttpResponse)
 from django.views.generic import View
 from ipware import get_client_ip
+from pytracking.concurrency import (
+    BoundedExecutor, BACKPRESSURE_DROP, DEFAULT_EXECUTOR_MAX_WORKERS,
+    DEFAULT_EXECUTOR_QUEUE_SIZE)
+from pytracking.metrics import CONTENT_TYPE, DROPPED_EVENTS_TOTAL, REGISTRY
 from pytracking.tracking import (
     get_configuration, TRACKING_PIXEL, PNG_MIME_TYPE)
 
+try:
+    # Optional Import: asgiref is a dependency of Django >= 3.0
+    from asgiref.sync import sync_to_async
+except ImportError:
+    pass
+
+
+_executor_lock = threading.Lock()
+
+# {settings_name: (settings value, FrozenConfiguration)}
+_settings_configurations = {}
+
 
 class TrackingView(View):
     """Base Tracking View.
 
     Subclasses should override notify_* methods.
+
+    Set classifier to a pytracking.classifier.EventClassifier instance to
+    classify the tracking results, and drop_machine_events to True to not
+    notify the events classified as made by a machine.
+
+    Set deduplicator to a pytracking.dedupe.EventDeduplicator instance to not
+    notify the events repeated within its window.
     """
 
+    classifier = None
+
+    drop_machine_events = False
+
+    deduplicator = None
+
     def notify_tracking_event(self, tracking_result):
         """Called once the tracking link has been decoded, and before
         responding with a redirect or a tracking pixel.
@@ -30,14 +66,31 @@ class TrackingView(View):
         """
         pass
 
+    def should_notify(self, tracking_result):
+        """Classifies tracking_result with the classifier, if any. Returns
+        False if the event must not be notified: a dropped machine event or a
+        duplicate.
+        """
+        if self.classifier is not None:
+            classification = self.classifier.classify_tracking_result(
+                tracking_result)
+            if self.drop_machine_events and classification.is_machine:
+                REGISTRY.inc(DROPPED_EVENTS_TOTAL, (("reason", "machine"),))
+                return False
+        if self.deduplicator is not None and\
+                self.deduplicator.is_duplicate(tracking_result):
+            REGISTRY.inc(DROPPED_EVENTS_TOTAL, (("reason", "duplicate"),))
+            return False
+        return True
+
     def get_configuration(self):
-        """Returns a Configuration instance built from
+        """Returns a FrozenConfiguration instance built from
         settings.PYTRACKING_CONFIGURATION.
 
         Override this method if you want to build your own Configuration
         instance.
         """
-        return get_configuration_from_settings()
+        return get_frozen_configuration_from_settings()
 
 
 class ClickTrackingView(TrackingView):
@@ -67,7 +120,8 @@ class ClickTrackingView(TrackingView):
         if not tracking_result.tracked_url:
             raise Http404
 
-        self.notify_tracking_event(tracking_result)
+        if self.should_notify(tracking_result):
+            self.notify_tracking_event(tracking_result)
 
         return HttpResponseRedirect(tracking_result.tracked_url)
 
@@ -94,11 +148,132 @@ class OpenTrackingView(TrackingView):
             self.notify_decoding_error(e, request)
             raise Http404
 
-        self.notify_tracking_event(tracking_result)
+        if self.should_notify(tracking_result):
+            self.notify_tracking_event(tracking_result)
 
         return HttpResponse(TRACKING_PIXEL, content_type=PNG_MIME_TYPE)
 
 
+class AsyncTrackingView(TrackingView):
+    """Base Tracking View for ASGI servers. Requires Django 3.1 or later.
+
+    The tracking link is decoded in a thread, so decryption and token store
+    queries do not block the event loop. The response is returned without
+    waiting for the notify_* methods: they are called in the threads of a
+    BoundedExecutor shared by the instances of the view class. Subclasses
+    can change the executor with the notification_* class attributes or by
+    overriding get_notification_executor.
+    """
+
+    notification_max_workers = DEFAULT_EXECUTOR_MAX_WORKERS
+
+    notification_queue_size = DEFAULT_EXECUTOR_QUEUE_SIZE
+
+    # One of pytracking.concurrency.BACKPRESSURE_POLICIES. The "block" and
+    # "caller_runs" policies block the event loop while the queue is full.
+    notification_backpressure = BACKPRESSURE_DROP
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        if django.VERSION < (3, 1):
+            raise ImproperlyConfigured(
+                "{0} requires Django 3.1 or later.".format(cls.__name__))
+        view = super().as_view(**initkwargs)
+        if asyncio.iscoroutinefunction(view):
+            return view
+
+        # Django < 4.1 does not detect async class-based views: wrap the
+        # view in a coroutine function.
+        async def async_view(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+
+        return functools.update_wrapper(async_view, view)
+
+    async def get_tracking_result(self, request, path, is_open):
+        """Decodes the tracking link in a thread and returns its
+        TrackingResult.
+        """
+        return await sync_to_async(
+            get_tracking_result, thread_sensitive=False)(
+                request, path, is_open, self.get_configuration())
+
+    @classmethod
+    def get_notification_executor(cls):
+        """Returns the BoundedExecutor calling the notify_* methods. It is
+        created on the first call.
+        """
+        executor = cls.__dict__.get("_notification_executor")
+        if executor is None:
+            with _executor_lock:
+                executor = cls.__dict__.get("_notification_executor")
+                if executor is None:
+                    executor = BoundedExecutor(
+                        cls.notification_max_workers,
+                        cls.notification_queue_size,
+                        cls.notification_backpressure,
+                        thread_name_prefix="pytracking-notify")
+                    cls._notification_executor = executor
+        return executor
+
+    def dispatch_notification(self, function, *args):
+        """Calls function(*args) in the notification executor.
+        """
+        self.get_notification_executor().submit(function, *args)
+
+
+class AsyncClickTrackingView(AsyncTrackingView):
+    """Same as ClickTrackingView, but the redirect is returned without
+    waiting for notify_tracking_event. See AsyncTrackingView.
+    """
+
+    async def get(self, request, path):
+        try:
+            tracking_result = await self.get_tracking_result(
+                request, path, False)
+        except Exception as e:
+            self.dispatch_notification(self.notify_decoding_error, e, request)
+            raise Http404
+
+        if not tracking_result.tracked_url:
+            raise Http404
+
+        if self.should_notify(tracking_result):
+            self.dispatch_notification(
+                self.notify_tracking_event, tracking_result)
+
+        return HttpResponseRedirect(tracking_result.tracked_url)
+
+
+class AsyncOpenTrackingView(AsyncTrackingView):
+    """Same as OpenTrackingView, but the tracking pixel is returned without
+    waiting for notify_tracking_event. See AsyncTrackingView.
+    """
+
+    async def get(self, request, path):
+        try:
+            tracking_result = await self.get_tracking_result(
+                request, path, True)
+        except Exception as e:
+            self.dispatch_notification(self.notify_decoding_error, e, request)
+            raise Http404
+
+        if self.should_notify(tracking_result):
+            self.dispatch_notification(
+                self.notify_tracking_event, tracking_result)
+
+        return HttpResponse(TRACKING_PIXEL, content_type=PNG_MIME_TYPE)
+
+
+def metrics_view(request):
+    """Returns the measurements of pytracking.metrics.REGISTRY in the
+    Prometheus text exposition format.
+    """
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
 def get_request_data(request):
     """Retrieves the user agent and the ip of the client from the Django
     request.
@@ -122,6 +297,40 @@ def get_configuration_from_settings(settings_name="PYTRACKING_CONFIGURATION"):
     return get_configuration(None, kwargs)
 
 
+def get_frozen_configuration_from_settings(
+        settings_name="PYTRACKING_CONFIGURATION"):
+    """Returns a FrozenConfiguration built from the parameters in
+    settings.PYTRACKING_CONFIGURATION. It is shared: it cannot be modified.
+
+    The configuration is built once per process and built again if the
+    setting is replaced or changed with override_settings.
+    """
+    kwargs = getattr(settings, settings_name)
+    cached = _settings_configurations.get(settings_name)
+    if cached is not None and cached[0] is kwargs:
+        return cached[1]
+    configuration = get_configuration(None, kwargs).freeze()
+    _settings_configurations[settings_name] = (kwargs, configuration)
+    return configuration
+
+
+def clear_configuration_cache(setting=None, **kwargs):
+    """Forgets the configurations built by
+    get_frozen_configuration_from_settings.
+    Connected to the setting_changed signal.
+
+    :param setting: The name of the setting to forget. All the settings if
+        None.
+    """
+    if setting is None:
+        _settings_configurations.clear()
+    else:
+        _settings_configurations.pop(setting, None)
+
+
+setting_changed.connect(clear_configuration_cache)
+
+
 def get_tracking_result(request, path, is_open, configuration=None, **kwargs):
     """Builds a tracking result from a Django request.
 
@@ -134,7 +343,8 @@ def get_tracking_result(request, path, is_open, configuration=None, **kwargs):
         Configuration instance, the kwargs parameters will override the
         Configuration parameters.
     """
-    configuration = get_configuration(configuration, kwargs)
+    if configuration is None or kwargs:
+        configuration = get_configuration(configuration, kwargs)
     request_data = get_request_data(request)
     return configuration.get_tracking_result(
         path, request_data, is_open)
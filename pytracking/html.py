@@ -1,7 +1,19 @@
-from lxml import html
+from collections import namedtuple
+from functools import lru_cache
+import hashlib
+import multiprocessing
+import os
+import re
+import uuid
 
+from lxml import etree, html
+
+from pytracking.cache import LRUCache
+from pytracking.concurrency import iter_chunks, pool_imap_bounded
+from pytracking.metrics import REGISTRY, ADAPT_HTML_SECONDS, PhaseProfiler
 from pytracking.tracking import (
-    get_configuration, get_open_tracking_url, get_click_tracking_url)
+    get_configuration, get_open_tracking_url, get_click_tracking_url,
+    DEFAULT_CHUNKSIZE)
 
 
 DEFAULT_ATTRIBUTES = {
@@ -13,10 +25,43 @@ DEFAULT_ATTRIBUTES = {
 
 DOCTYPE = "<!DOCTYPE html>"
 
+DEFAULT_TEMPLATE_CACHE_SIZE = 64
+
+DEFAULT_READ_SIZE = 64 * 1024
+
+# Compiled templates, keyed by template hash and tracking options.
+template_cache = LRUCache(DEFAULT_TEMPLATE_CACHE_SIZE)
+
+# Attribute values made of these characters are serialized verbatim between
+# double quotes by lxml.
+SAFE_ATTRIBUTE_VALUE_RE = re.compile(r"^[A-Za-z0-9_\-=/:.%~+?#,;@!$*]*$")
+
+# Text made of these characters is serialized verbatim by lxml.
+SAFE_TEXT_RE = re.compile(r"^[\x20-\x25\x27-\x3b\x3d\x3f-\x7e\t\n]*$")
+
+# Start of the HTML that lxml.html.fromstring parses as a complete document
+# instead of a fragment.
+FULL_HTML_STARTS = ("<html", "<!doctype")
+
+TemplateStructure = namedtuple(
+    "TemplateStructure", ["segments", "slots", "links"])
+
+HTMLProfile = namedtuple(
+    "HTMLProfile", ["phases", "links_rewritten", "unique_urls"])
+HTMLProfile.__doc__ = """Profile of an adapt_html call.
+
+phases is a list of pytracking.metrics.PhaseProfile (parse, links, pixel,
+serialize), links_rewritten the number of tracked links and unique_urls the
+number of distinct URLs among them.
+"""
+
+# Template compiled once per render_campaign worker process.
+_campaign_template = None
+
 
 def adapt_html(
         html_text, extra_metadata, click_tracking=True, open_tracking=True,
-        configuration=None, **kwargs):
+        configuration=None, profile_callback=None, **kwargs):
     """Changes an HTML string by replacing links (<a href...>) with tracking
     links and by adding a 1x1 transparent pixel just before the closing body
     tag.
@@ -28,32 +73,522 @@ def adapt_html(
     :param open_tracking: If a transparent pixel must be added before the
         closing body tag.
     :param configuration: An optional Configuration instance.
+    :param profile_callback: An optional callable receiving an HTMLProfile
+        once the HTML is changed.
     :param kwargs: Optional configuration parameters. If provided with a
         Configuration instance, the kwargs parameters will override the
         Configuration parameters.
     """
     configuration = get_configuration(configuration, kwargs)
+    timer = REGISTRY.get_phase_timer(ADAPT_HTML_SECONDS)
+    if profile_callback is not None:
+        timer = PhaseProfiler(timer)
 
     tree = html.fromstring(html_text)
+    timer.mark("parse")
 
+    links = ()
     if click_tracking:
-        _replace_links(tree, extra_metadata, configuration)
+        links = _replace_links(tree, extra_metadata, configuration)
+        timer.mark("links")
 
     if open_tracking:
         _add_tracking_pixel(tree, extra_metadata, configuration)
+        timer.mark("pixel")
 
     new_html_text = html.tostring(
         tree, include_meta_content_type=True, doctype=DOCTYPE)
+    timer.mark("serialize")
+
+    if profile_callback is not None:
+        profile_callback(HTMLProfile(timer.phases, len(links), len(set(
+            links))))
 
     return new_html_text.decode("utf-8")
 
 
+def compile_template(
+        html_text, configuration=None, click_tracking=True,
+        open_tracking=True, **kwargs):
+    """Parses an HTML string once and returns a CompiledTemplate that can
+    render the tracked HTML of many recipients without parsing it again.
+
+    CompiledTemplate.render(extra_metadata) returns the same string as
+    adapt_html(html_text, extra_metadata, ...).
+
+    The parsed structure is kept in template_cache, keyed by the hash of
+    html_text, so compiling the same template again (e.g., a resend) is cheap.
+
+    :param html_text: The HTML to change (unicode or bytestring).
+    :param configuration: An optional Configuration instance.
+    :param click_tracking: If links (<a href...>) must be changed.
+    :param open_tracking: If a transparent pixel must be added before the
+        closing body tag.
+    :param kwargs: Optional configuration parameters. If provided with a
+        Configuration instance, the kwargs parameters will override the
+        Configuration parameters.
+    :rtype: CompiledTemplate
+    """
+    configuration = get_configuration(configuration, kwargs)
+
+    if isinstance(html_text, str):
+        digest = hashlib.sha256(
+            html_text.encode("utf-8", "surrogatepass")).digest()
+    else:
+        digest = hashlib.sha256(html_text).digest()
+    cache_key = (
+        type(html_text), digest, bool(click_tracking), bool(open_tracking))
+
+    structure = template_cache.get(cache_key)
+    if structure is None:
+        structure = _compile_template_structure(
+            html_text, click_tracking, open_tracking)
+        template_cache.set(cache_key, structure)
+
+    return CompiledTemplate(structure, configuration, open_tracking)
+
+
+class CompiledTemplate(object):
+    """HTML template whose tracking links are rendered by joining precomputed
+    string segments with freshly encoded tracking URLs.
+
+    Use compile_template to get an instance.
+    """
+
+    def __init__(self, structure, configuration, open_tracking):
+        """
+        :param structure: The TemplateStructure of the template.
+        :param configuration: The Configuration used to encode tracking URLs.
+        :param open_tracking: If the template has a tracking pixel slot.
+        """
+        self.structure = structure
+        self.configuration = configuration
+        self.open_tracking = open_tracking
+
+    def render(self, extra_metadata):
+        """Returns the HTML with tracking links encoding extra_metadata.
+
+        :param extra_metadata: A dict that can be json-encoded and that will
+            be encoded in the tracking links.
+        """
+        configuration = self.configuration
+        links = self.structure.links
+        data_to_embed_list = [
+            configuration.get_data_to_embed(link, extra_metadata)
+            for link in links]
+        if self.open_tracking:
+            data_to_embed_list.append(
+                configuration.get_data_to_embed(None, extra_metadata))
+        data_strs = configuration.get_url_encoded_data_strs(
+            data_to_embed_list)
+
+        urls = [
+            _quote_attribute_value(
+                configuration.get_click_tracking_url_from_data_str(data_str))
+            for data_str in data_strs[:len(links)]]
+        if self.open_tracking:
+            urls.append(_quote_attribute_value(
+                configuration.get_open_tracking_url_from_data_str(
+                    data_strs[-1])))
+
+        segments = self.structure.segments
+        parts = [segments[0]]
+        for slot, segment in zip(self.structure.slots, segments[1:]):
+            parts.append(urls[slot])
+            parts.append(segment)
+        return "".join(parts)
+
+
+def render_campaign(
+        html_text, metadata_iterable, workers=None,
+        chunksize=DEFAULT_CHUNKSIZE, click_tracking=True, open_tracking=True,
+        configuration=None, **kwargs):
+    """Yields the adapted HTML of each metadata dict of metadata_iterable
+    (e.g., one per recipient of a campaign), in order.
+
+    The recipients are rendered by a pool of processes. The HTML template and
+    the configuration are sent once to each process, which compiles the
+    template (see compile_template) and then only receives chunks of
+    metadata. metadata_iterable is consumed lazily so memory stays bounded.
+
+    :param html_text: The HTML to change (unicode or bytestring).
+    :param metadata_iterable: An iterable of dicts that can be json-encoded
+        and that will be encoded in the tracking links.
+    :param workers: The number of processes. Default to the number of CPUs.
+        If 1, the recipients are rendered in the current process.
+    :param chunksize: The number of metadata dicts sent to a process in a
+        single task.
+    :param click_tracking: If links (<a href...>) must be changed.
+    :param open_tracking: If a transparent pixel must be added before the
+        closing body tag.
+    :param configuration: An optional Configuration instance.
+    :param kwargs: Optional configuration parameters. If provided with a
+        Configuration instance, the kwargs parameters will override the
+        Configuration parameters.
+    """
+    configuration = get_configuration(configuration, kwargs)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        template = compile_template(
+            html_text, configuration, click_tracking, open_tracking)
+        for extra_metadata in metadata_iterable:
+            yield template.render(extra_metadata)
+        return
+
+    pool = multiprocessing.Pool(
+        workers, initializer=_init_campaign_worker,
+        initargs=(html_text, configuration, click_tracking, open_tracking))
+    with pool:
+        for rendered_chunk in pool_imap_bounded(
+                pool, _render_campaign_chunk,
+                iter_chunks(metadata_iterable, chunksize), workers * 2):
+            yield from rendered_chunk
+
+
+def _init_campaign_worker(
+        html_text, configuration, click_tracking, open_tracking):
+    global _campaign_template
+    _campaign_template = compile_template(
+        html_text, configuration, click_tracking, open_tracking)
+
+
+def _render_campaign_chunk(metadata_chunk):
+    return [
+        _campaign_template.render(extra_metadata)
+        for extra_metadata in metadata_chunk]
+
+
+def adapt_html_stream(
+        html_chunks, extra_metadata, click_tracking=True, open_tracking=True,
+        configuration=None, read_size=DEFAULT_READ_SIZE, **kwargs):
+    """Streaming version of adapt_html for very large HTML documents.
+
+    The document is parsed incrementally and every element is serialized and
+    discarded as soon as it is complete, so memory is bounded by the size of
+    the largest tag or text run instead of the size of the document.
+
+    Yields chunks of unicode text whose concatenation is the string that
+    adapt_html returns for the same complete HTML document.
+
+    Unlike adapt_html, which changes an HTML fragment (e.g., "<p>...</p>")
+    without adding a pixel, adapt_html_stream raises ValueError if the HTML
+    is a fragment, i.e., if it does not start with <html> or <!DOCTYPE> and
+    has no <head>.
+
+    :param html_chunks: A file-like object opened in text or binary mode, or
+        an iterable of unicode strings or bytestrings.
+    :param extra_metadata: A dict that can be json-encoded and that will
+        be encoded in the tracking link.
+    :param click_tracking: If links (<a href...>) must be changed.
+    :param open_tracking: If a transparent pixel must be added before the
+        closing body tag.
+    :param configuration: An optional Configuration instance.
+    :param read_size: The size of the chunks read from a file-like object.
+    :param kwargs: Optional configuration parameters. If provided with a
+        Configuration instance, the kwargs parameters will override the
+        Configuration parameters.
+    """
+    configuration = get_configuration(configuration, kwargs)
+
+    if hasattr(html_chunks, "read"):
+        html_chunks = _read_chunks(html_chunks, read_size)
+
+    rewriter = HTMLStreamRewriter(
+        extra_metadata, click_tracking, open_tracking, configuration)
+
+    for chunk in html_chunks:
+        output = rewriter.feed(chunk)
+        if output:
+            yield output
+
+    output = rewriter.close()
+    if output:
+        yield output
+
+
+class HTMLStreamRewriter(object):
+    """Incremental HTML serializer used by adapt_html_stream.
+
+    Elements are written as the parser reports them: the start tag when an
+    element starts, and the text preceding an element once its next sibling
+    starts or its parent ends. Completed elements are then removed from the
+    tree.
+    """
+
+    def __init__(
+            self, extra_metadata, click_tracking, open_tracking,
+            configuration):
+        """
+        :param extra_metadata: A dict that can be json-encoded and that will
+            be encoded in the tracking link.
+        :param click_tracking: If links (<a href...>) must be changed.
+        :param open_tracking: If a transparent pixel must be added before the
+            closing body tag.
+        :param configuration: A Configuration instance.
+        """
+        self.extra_metadata = extra_metadata
+        self.click_tracking = click_tracking
+        self.open_tracking = open_tracking
+        self.configuration = configuration
+        self.parser = etree.HTMLPullParser(
+            events=("start", "end", "comment", "pi"))
+        self.output = []
+        self.root = None
+        self.root_ended = False
+        # One [element, has_children] item per element that has started but
+        # not ended yet.
+        self.open_elements = []
+        self.body_ended = False
+        # The first non-whitespace characters of the document, until they
+        # tell whether it is a complete document or a fragment.
+        self.document_start = ""
+        self.is_full_html = None
+        self.has_head = False
+
+    def feed(self, data):
+        """Parses a chunk of HTML and returns the HTML text that can be
+        written so far.
+        """
+        if self.is_full_html is None:
+            self._check_document_start(data)
+        self.parser.feed(data)
+        return self._process_events()
+
+    def close(self):
+        """Terminates the parsing and returns the remaining HTML text.
+        """
+        root = self.parser.close()
+        if root is None:
+            raise etree.ParserError("Document is empty")
+        return self._process_events()
+
+    def _process_events(self):
+        for (event, element) in self.parser.read_events():
+            if self.root_ended:
+                # Like html.tostring, ignore the content that libxml2 puts
+                # outside of the root element.
+                break
+            if event == "start":
+                self._start(element)
+            elif event == "end":
+                self._end(element)
+            elif element.getparent() is not None:
+                self.open_elements[-1][1] = True
+                self._write_preceding_text(element)
+                self.output.append(_tostring(element, with_tail=False))
+
+        output = "".join(self.output)
+        self.output = []
+        return output
+
+    def _check_document_start(self, data):
+        if isinstance(data, bytes):
+            data = data.decode("latin-1")
+        max_length = max(len(start) for start in FULL_HTML_STARTS)
+        self.document_start = (
+            self.document_start + data).lstrip()[:max_length].lower()
+        if self.document_start.startswith(FULL_HTML_STARTS):
+            self.is_full_html = True
+        elif self.document_start and not any(
+                start.startswith(self.document_start)
+                for start in FULL_HTML_STARTS):
+            self.is_full_html = False
+
+    def _start(self, element):
+        if element.tag == "head":
+            self.has_head = True
+        elif element.tag == "body" and not self.is_full_html and\
+                not self.has_head:
+            raise ValueError(
+                "HTML fragments are not supported by adapt_html_stream.")
+
+        if element.getparent() is None:
+            self.root = element
+            self.output.append(DOCTYPE + "\n")
+        else:
+            self.open_elements[-1][1] = True
+            self._write_preceding_text(element)
+        self.open_elements.append([element, False])
+
+        if self.click_tracking and element.tag == "a":
+            link = element.get("href")
+            if link is not None and _valid_link(link):
+                element.attrib["href"] = get_click_tracking_url(
+                    link, self.extra_metadata, self.configuration)
+
+        self.output.append(_get_start_tag(element))
+
+    def _end(self, element):
+        has_children = self.open_elements.pop()[1]
+        has_content = has_children or bool(element.text)
+        if len(element):
+            last_child = element[-1]
+            self._write_text(element, last_child.tail)
+            element.remove(last_child)
+        else:
+            self._write_text(element, element.text)
+
+        if self.open_tracking and element.tag == "body" and\
+                not self.body_ended:
+            url = get_open_tracking_url(
+                self.extra_metadata, self.configuration)
+            self.output.append(
+                "<img src=" + _quote_attribute_value(url) + ">")
+            self.body_ended = True
+            has_content = True
+
+        (start_tag, empty_end_tag, end_tag) = _get_element_tags(element.tag)
+        self.output.append(end_tag if has_content else empty_end_tag)
+
+        if element is self.root:
+            self.root_ended = True
+
+    def _write_preceding_text(self, element):
+        parent = element.getparent()
+        previous = element.getprevious()
+        if previous is None:
+            self._write_text(parent, parent.text)
+        else:
+            self._write_text(parent, previous.tail)
+            parent.remove(previous)
+
+    def _write_text(self, parent, text):
+        if text:
+            self.output.append(_serialize_text(parent.tag, text))
+
+
+def _read_chunks(file_object, read_size):
+    while True:
+        chunk = file_object.read(read_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _tostring(element, with_tail=True):
+    return html.tostring(
+        element, include_meta_content_type=True,
+        with_tail=with_tail).decode("utf-8")
+
+
+@lru_cache(maxsize=256)
+def _get_element_tags(tag):
+    """Returns the start tag of an element without attributes, its end tag
+    when it has no content and its end tag when it has content.
+
+    libxml2 omits the end tag of void elements (e.g., <br>) and of some
+    empty elements (e.g., <li>).
+    """
+    try:
+        element = html.Element(tag)
+    except ValueError:
+        # Tags that cannot be created through the API (e.g., Outlook's o:p)
+        # are unknown to libxml2 and always have an end tag.
+        return ("<" + tag + ">", "</" + tag + ">", "</" + tag + ">")
+    end_tag = "</" + tag + ">"
+    empty_serialized = _tostring(element)
+    if empty_serialized.endswith(end_tag):
+        start_tag = empty_serialized[:-len(end_tag)]
+        empty_end_tag = end_tag
+    else:
+        start_tag = empty_serialized
+        empty_end_tag = ""
+    element.text = "x"
+    if not _tostring(element).endswith(end_tag):
+        # Void element
+        end_tag = ""
+    return (start_tag, empty_end_tag, end_tag)
+
+
+def _get_start_tag(element):
+    (start_tag, empty_end_tag, end_tag) = _get_element_tags(element.tag)
+    if not len(element.attrib):
+        return start_tag
+    try:
+        shallow_element = html.Element(element.tag, element.attrib)
+    except ValueError:
+        # Attribute values are escaped so the start tag ends at the first >.
+        serialized = _tostring(element, with_tail=False)
+        return serialized[:serialized.index(">") + 1]
+    serialized = _tostring(shallow_element)
+    return serialized[:len(serialized) - len(empty_end_tag)]
+
+
+def _serialize_text(tag, text):
+    """Returns text escaped as lxml serializes the content of an element with
+    the given tag (e.g., the content of <script> is not escaped).
+    """
+    try:
+        element = html.Element(tag)
+    except ValueError:
+        element = html.Element("span")
+    if SAFE_TEXT_RE.match(text):
+        return text
+    (start_tag, empty_end_tag, end_tag) = _get_element_tags(element.tag)
+    element.text = text
+    serialized = _tostring(element)
+    return serialized[len(start_tag):len(serialized) - len(end_tag)]
+
+
+def _compile_template_structure(html_text, click_tracking, open_tracking):
+    marker = "pytracking-{0}-".format(uuid.uuid4().hex)
+    links = []
+
+    tree = html.fromstring(html_text)
+
+    if click_tracking:
+        for (element, attribute, link, pos) in tree.iterlinks():
+            if element.tag == "a" and attribute == "href" and\
+                    _valid_link(link):
+                element.attrib["href"] = marker + str(len(links))
+                links.append(link)
+
+    if open_tracking:
+        pixel = html.Element("img", {"src": marker + str(len(links))})
+        tree.body.append(pixel)
+
+    html_template = html.tostring(
+        tree, include_meta_content_type=True, doctype=DOCTYPE).decode("utf-8")
+
+    parts = re.split(
+        "\"{0}([0-9]+)\"".format(re.escape(marker)), html_template)
+    segments = parts[0::2]
+    slots = [int(slot) for slot in parts[1::2]]
+
+    return TemplateStructure(segments, slots, links)
+
+
+def _quote_attribute_value(value):
+    """Returns value quoted and escaped as lxml serializes an href or src
+    attribute value.
+    """
+    if SAFE_ATTRIBUTE_VALUE_RE.match(value):
+        return '"' + value + '"'
+    element = html.tostring(html.Element("img", {"src": value}))
+    return element.decode("utf-8")[len("<img src="):-len(">")]
+
+
 def _replace_links(tree, extra_metadata, configuration):
+    """Replaces the links of tree with click tracking links and returns the
+    list of the replaced links.
+    """
+    elements = []
+    links = []
+    data_to_embed_list = []
     for (element, attribute, link, pos) in tree.iterlinks():
         if element.tag == "a" and attribute == "href" and _valid_link(link):
-            new_link = get_click_tracking_url(
-                link, extra_metadata, configuration)
-            element.attrib["href"] = new_link
+            elements.append(element)
+            links.append(link)
+            data_to_embed_list.append(
+                configuration.get_data_to_embed(link, extra_metadata))
+
+    # Encoded at once so that a token store receives a single bulk insert.
+    data_strs = configuration.get_url_encoded_data_strs(data_to_embed_list)
+    for element, data_str in zip(elements, data_strs):
+        element.attrib["href"] =\
+            configuration.get_click_tracking_url_from_data_str(data_str)
+    return links
 
 
 def _add_tracking_pixel(tree, extra_metadata, configuration):
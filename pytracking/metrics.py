@@ -0,0 +1,326 @@
+"""Counters and latency histograms of pytracking, rendered in the Prometheus
+text exposition format.
+
+The registry is disabled by default: the instrumented functions then only
+check a boolean. When it is enabled, each thread accumulates its
+measurements in its own dicts, without locks, and render() merges them::
+
+    from pytracking.metrics import REGISTRY, make_wsgi_app
+
+    REGISTRY.enable()
+    metrics_app = make_wsgi_app()  # or pytracking.django.metrics_view
+"""
+from bisect import bisect_left
+from collections import namedtuple
+import sys
+import threading
+import time
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds (seconds) of the buckets of the latency histograms.
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ENCODE_SECONDS = "pytracking_encode_seconds"
+
+DECODE_SECONDS = "pytracking_decode_seconds"
+
+DECODING_ERRORS_TOTAL = "pytracking_decoding_errors_total"
+
+TRACKING_RESULTS_TOTAL = "pytracking_tracking_results_total"
+
+ADAPT_HTML_SECONDS = "pytracking_adapt_html_seconds"
+
+WEBHOOK_SECONDS = "pytracking_webhook_seconds"
+
+DROPPED_EVENTS_TOTAL = "pytracking_dropped_events_total"
+
+EXECUTOR_DROPPED_TASKS_TOTAL = "pytracking_executor_dropped_tasks_total"
+
+METRIC_DESCRIPTIONS = {
+    ENCODE_SECONDS: "Time to encode the data of a tracking link.",
+    DECODE_SECONDS:
+        "Time to decode a tracking link, by phase (decrypt, deserialize).",
+    DECODING_ERRORS_TOTAL: "Tracking links that could not be decoded.",
+    TRACKING_RESULTS_TOTAL: "Decoded tracking links, by type.",
+    ADAPT_HTML_SECONDS: "Time of the phases of adapt_html.",
+    WEBHOOK_SECONDS: "Time to send a webhook, by outcome.",
+    DROPPED_EVENTS_TOTAL: "Tracking events that were not notified.",
+    EXECUTOR_DROPPED_TASKS_TOTAL:
+        "Background tasks dropped because the queue was full, by executor.",
+}
+
+
+class ThreadMetrics(object):
+    """The measurements of one thread.
+    """
+
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        # (name, labels) -> value
+        self.counters = {}
+        # (name, labels) -> [count of each bucket..., count above, sum]
+        self.histograms = {}
+
+    def merge(self, other):
+        """Adds the measurements of other to this instance.
+        """
+        for (key, value) in list(other.counters.items()):
+            self.counters[key] = self.counters.get(key, 0) + value
+        for (key, histogram) in list(other.histograms.items()):
+            merged = self.histograms.get(key)
+            if merged is None:
+                self.histograms[key] = list(histogram)
+            else:
+                for (index, value) in enumerate(histogram):
+                    merged[index] += value
+
+
+class MetricsRegistry(object):
+    """Collects counters and histograms identified by a name and a tuple of
+    (label name, label value) pairs.
+    """
+
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        """
+        :param enabled: If False, inc and observe do nothing.
+        :param buckets: The upper bounds of the buckets of the histograms.
+        """
+        self.enabled = enabled
+        self.buckets = tuple(sorted(buckets))
+        self.descriptions = dict(METRIC_DESCRIPTIONS)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # [(thread, ThreadMetrics)] of the threads that made measurements
+        self.thread_metrics = []
+        # Measurements of the threads that have exited
+        self.retired_metrics = ThreadMetrics()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def get_thread_metrics(self):
+        """Returns the ThreadMetrics of the current thread.
+        """
+        try:
+            return self.local.metrics
+        except AttributeError:
+            metrics = ThreadMetrics()
+            with self.lock:
+                self.thread_metrics.append(
+                    (threading.current_thread(), metrics))
+            self.local.metrics = metrics
+            return metrics
+
+    def inc(self, name, labels=(), value=1):
+        """Increments a counter.
+
+        :param name: The name of the counter, e.g., "pytracking_x_total".
+        :param labels: A tuple of (label name, label value) pairs.
+        :param value: The increment.
+        """
+        if not self.enabled:
+            return
+        counters = self.get_thread_metrics().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        """Records a value (e.g., a duration in seconds) in a histogram.
+        """
+        if not self.enabled:
+            return
+        histograms = self.get_thread_metrics().histograms
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = [0] * (len(self.buckets) + 2)
+            histograms[key] = histogram
+        histogram[bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def get_phase_timer(self, name, labels=()):
+        """Returns a PhaseTimer recording in the histogram name, or a timer
+        doing nothing if the registry is disabled.
+        """
+        if not self.enabled:
+            return NULL_PHASE_TIMER
+        return PhaseTimer(self, name, labels)
+
+    def collect(self):
+        """Returns a ThreadMetrics merging the measurements of all threads.
+        """
+        collected = ThreadMetrics()
+        with self.lock:
+            alive = []
+            for (thread, metrics) in self.thread_metrics:
+                if thread.is_alive():
+                    alive.append((thread, metrics))
+                else:
+                    self.retired_metrics.merge(metrics)
+            self.thread_metrics = alive
+            collected.merge(self.retired_metrics)
+        for (_, metrics) in alive:
+            collected.merge(metrics)
+        return collected
+
+    def reset(self):
+        """Forgets all measurements.
+        """
+        with self.lock:
+            for (_, metrics) in self.thread_metrics:
+                metrics.counters.clear()
+                metrics.histograms.clear()
+            self.retired_metrics = ThreadMetrics()
+
+    def render(self):
+        """Returns the measurements in the Prometheus text exposition format.
+        """
+        collected = self.collect()
+        lines = []
+        self._render_family(
+            lines, "counter", collected.counters, self._render_counter)
+        self._render_family(
+            lines, "histogram", collected.histograms,
+            self._render_histogram)
+        return "".join(line + "\n" for line in lines)
+
+    def _render_family(self, lines, metric_type, values, render_function):
+        by_name = {}
+        for ((name, labels), value) in values.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for name in sorted(by_name):
+            description = self.descriptions.get(name)
+            if description:
+                lines.append("# HELP {0} {1}".format(
+                    name, description.replace("\\", "\\\\")))
+            lines.append("# TYPE {0} {1}".format(name, metric_type))
+            for (labels, value) in sorted(by_name[name], key=_sort_key):
+                render_function(lines, name, labels, value)
+
+    def _render_counter(self, lines, name, labels, value):
+        lines.append("{0}{1} {2}".format(
+            name, _format_labels(labels), _format_value(value)))
+
+    def _render_histogram(self, lines, name, labels, histogram):
+        cumulative = 0
+        for (bound, count) in zip(
+                self.buckets + (float("inf"),), histogram):
+            cumulative += count
+            lines.append("{0}_bucket{1} {2}".format(
+                name, _format_labels(labels + (
+                    ("le", "+Inf" if bound == float("inf") else repr(
+                        bound)),)), cumulative))
+        lines.append("{0}_sum{1} {2}".format(
+            name, _format_labels(labels), _format_value(histogram[-1])))
+        lines.append("{0}_count{1} {2}".format(
+            name, _format_labels(labels), cumulative))
+
+
+class PhaseTimer(object):
+    """Records the time elapsed since the previous mark (or since the
+    creation of the timer) in a histogram, with a phase label.
+    """
+
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry, name, labels=()):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = time.perf_counter()
+
+    def mark(self, phase):
+        """Records the duration of phase, which ends now.
+        """
+        now = time.perf_counter()
+        self.registry.observe(
+            self.name, now - self.start, self.labels + (("phase", phase),))
+        self.start = now
+
+
+class NullPhaseTimer(object):
+
+    __slots__ = ()
+
+    def mark(self, phase):
+        pass
+
+
+NULL_PHASE_TIMER = NullPhaseTimer()
+
+PhaseProfile = namedtuple(
+    "PhaseProfile", ["name", "seconds", "allocated_blocks"])
+PhaseProfile.__doc__ = """Wall time of a phase and net change of the number
+of memory blocks allocated by Python during the phase.
+"""
+
+
+class PhaseProfiler(object):
+    """Same interface as PhaseTimer: records the wall time and the change of
+    sys.getallocatedblocks() of each phase, and forwards the marks to a
+    timer.
+    """
+
+    __slots__ = ("timer", "phases", "start", "start_blocks")
+
+    def __init__(self, timer=NULL_PHASE_TIMER):
+        """
+        :param timer: A PhaseTimer also receiving the marks.
+        """
+        self.timer = timer
+        self.phases = []
+        self.start_blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+
+    def mark(self, phase):
+        """Records phase, which ends now.
+        """
+        now = time.perf_counter()
+        blocks = sys.getallocatedblocks()
+        self.phases.append(PhaseProfile(
+            phase, now - self.start, blocks - self.start_blocks))
+        self.timer.mark(phase)
+        self.start_blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+
+
+REGISTRY = MetricsRegistry()
+
+
+def make_wsgi_app(registry=REGISTRY):
+    """Returns a WSGI application rendering the measurements of registry.
+    """
+    def metrics_app(environ, start_response):
+        body = registry.render().encode("utf-8")
+        start_response("200 OK", [
+            ("Content-Type", CONTENT_TYPE),
+            ("Content-Length", str(len(body)))])
+        return [body]
+    return metrics_app
+
+
+def _sort_key(item):
+    return tuple((name, str(value)) for (name, value) in item[0])
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        '{0}="{1}"'.format(name, str(value).replace("\\", "\\\\").replace(
+            '"', '\\"').replace("\n", "\\n"))
+        for (name, value) in labels) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
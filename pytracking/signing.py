@@ -0,0 +1,65 @@
+"""Truncated HMAC-SHA256 signatures of the data embedded in tracking links.
+
+A signed link is not encrypted, anyone can read its data, but the data cannot
+be modified without the signing key:
+
+    "h" + urlsafe base64(payload + truncated HMAC-SHA256 of the payload)
+"""
+import base64
+import hashlib
+import hmac
+
+
+SIGNED_TOKEN_PREFIX = "h"
+
+SIGNATURE_SIZE = 8
+
+
+def sign(byte_str, signing_key, context=b""):
+    """Returns the truncated HMAC-SHA256 signature of byte_str.
+
+    :param byte_str: The signed bytes.
+    :param signing_key: The secret key (bytes).
+    :param context: Bytes prepended to byte_str so that a signature made for
+        one kind of token is not valid for another kind.
+    """
+    return hmac.new(
+        signing_key, context + byte_str, hashlib.sha256).digest()[
+            :SIGNATURE_SIZE]
+
+
+def verify(byte_str, signature, signing_key, context=b""):
+    """Returns True if signature is the signature of byte_str. The comparison
+    takes a constant time.
+    """
+    return hmac.compare_digest(
+        sign(byte_str, signing_key, context), signature)
+
+
+def encode_signed_token(payload, signing_key, prefix=SIGNED_TOKEN_PREFIX):
+    """Returns the string embedded in tracking links for a signed payload.
+
+    :param payload: The encoded data (bytes).
+    :param signing_key: The secret key (bytes).
+    :param prefix: The prefix identifying the kind of token.
+    """
+    signature = sign(payload, signing_key, prefix.encode("ascii"))
+    return prefix + base64.urlsafe_b64encode(
+        payload + signature).decode("ascii").rstrip("=")
+
+
+def decode_signed_token(token, signing_key, prefix=SIGNED_TOKEN_PREFIX):
+    """Returns the payload of a string returned by encode_signed_token.
+    Raises ValueError if the string is invalid or was not signed with
+    signing_key.
+    """
+    if not token.startswith(prefix):
+        raise ValueError("Not a signed token")
+    encoded = token[len(prefix):].encode("ascii")
+    byte_str = base64.urlsafe_b64decode(encoded + b"=" * (-len(encoded) % 4))
+    payload = byte_str[:-SIGNATURE_SIZE]
+    if not payload or not verify(
+            payload, byte_str[-SIGNATURE_SIZE:], signing_key,
+            prefix.encode("ascii")):
+        raise ValueError("Invalid signature")
+    return payload
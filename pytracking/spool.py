@@ -0,0 +1,460 @@
+"""Durable on-disk spool of tracking results waiting to be sent to webhooks.
+
+Tracking views append tracking results to a WebhookSpool, which only writes a
+line to a file, and a separate SpoolDrainer process sends them to the webhooks
+at a controlled rate. The latency of tracking views thus does not depend on
+the health of the webhook receiver.
+
+The spool directory contains segment files, one JSON record per line. Each
+WebhookSpool instance (i.e., each process) writes to its own segments, so
+several processes can share a spool directory. There must be a single drainer
+per directory.
+
+Command line usage::
+
+    python -m pytracking.spool drain /var/spool/pytracking --rate 100
+    python -m pytracking.spool replay /var/spool/pytracking \\
+        --start 1389177318 --end 1389263718
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+from pytracking.tracking import TrackingResult, get_configuration
+
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".spool"
+
+CHECKPOINT_FILE_NAME = "checkpoint.json"
+
+DEFAULT_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+
+DEFAULT_SEGMENT_MAX_SECONDS = 3600
+
+DEFAULT_FSYNC_INTERVAL_SECONDS = 1.0
+
+DEFAULT_FSYNC_MAX_RECORDS = 1000
+
+DEFAULT_POLL_INTERVAL_SECONDS = 1.0
+
+DEFAULT_BATCH_SIZE = 100
+
+
+class WebhookSpool(object):
+    """Append-only writer of tracking results.
+
+    append() only writes a line to the current segment file. The segment is
+    flushed to disk (fsync) by a background thread every
+    fsync_interval_seconds, or as soon as fsync_max_records records are
+    waiting. A new segment is started when the current one is larger than
+    segment_max_bytes or older than segment_max_seconds.
+    """
+
+    def __init__(
+            self, directory, segment_max_bytes=DEFAULT_SEGMENT_MAX_BYTES,
+            segment_max_seconds=DEFAULT_SEGMENT_MAX_SECONDS,
+            fsync_interval_seconds=DEFAULT_FSYNC_INTERVAL_SECONDS,
+            fsync_max_records=DEFAULT_FSYNC_MAX_RECORDS):
+        """
+        :param directory: The spool directory. Created if it does not exist.
+        :param segment_max_bytes: The size after which a new segment is
+            started.
+        :param segment_max_seconds: The age after which a new segment is
+            started.
+        :param fsync_interval_seconds: The maximum time between two fsync
+            calls when records are waiting.
+        :param fsync_max_records: The number of waiting records that triggers
+            an fsync call.
+        """
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_seconds = segment_max_seconds
+        self.fsync_interval_seconds = fsync_interval_seconds
+        self.fsync_max_records = fsync_max_records
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.fd = None
+        self.pid = None
+        self.segment_size = 0
+        self.segment_created_at = 0
+        self.segment_count = 0
+        self.unsynced_count = 0
+        # File descriptors of the previous segments, closed after their
+        # last fsync.
+        self.retired_fds = []
+        self.closed = False
+
+        self._start_sync_thread()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, tracking_result):
+        """Writes tracking_result at the end of the spool.
+
+        :param tracking_result: The TrackingResult instance to send to its
+            webhook URL.
+        """
+        line = json.dumps({
+            "spooled_at": time.time(),
+            "tracking_result": tracking_result.to_json_dict()._asdict(),
+        }).encode("utf-8") + b"\n"
+
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The spool is closed.")
+            if self._must_start_segment(len(line)):
+                self._start_segment()
+            os.write(self.fd, line)
+            self.segment_size += len(line)
+            self.unsynced_count += 1
+            if self.unsynced_count >= self.fsync_max_records:
+                self.sync_event.set()
+
+    def sync(self):
+        """Flushes the written records to disk.
+        """
+        with self.sync_lock:
+            with self.lock:
+                fds = self.retired_fds
+                self.retired_fds = []
+                current_fd = self.fd
+                self.unsynced_count = 0
+            for fd in fds:
+                os.fsync(fd)
+                os.close(fd)
+            if current_fd is not None:
+                os.fsync(current_fd)
+
+    def close(self):
+        """Flushes the written records to disk and closes the spool.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.sync_event.set()
+        self.sync_thread.join()
+        self.sync()
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+    def _must_start_segment(self, size):
+        if self.fd is None or self.pid != os.getpid():
+            return True
+        if self.segment_size and\
+                self.segment_size + size > self.segment_max_bytes:
+            return True
+        return time.time() - self.segment_created_at >=\
+            self.segment_max_seconds
+
+    def _start_segment(self):
+        if self.fd is not None:
+            if self.pid == os.getpid():
+                self.retired_fds.append(self.fd)
+            else:
+                # Forked process: the file belongs to the parent process.
+                self.retired_fds = []
+        if self.sync_pid != os.getpid():
+            # Forked process: the sync thread was not copied.
+            self._start_sync_thread()
+        self.pid = os.getpid()
+        self.segment_created_at = time.time()
+        self.segment_count += 1
+        name = "{0:016d}-{1}-{2}{3}".format(
+            int(self.segment_created_at * 1000000), self.pid,
+            self.segment_count, SEGMENT_SUFFIX)
+        self.fd = os.open(
+            os.path.join(self.directory, name),
+            os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.segment_size = 0
+
+    def _start_sync_thread(self):
+        self.sync_pid = os.getpid()
+        self.sync_event = threading.Event()
+        self.sync_thread = threading.Thread(
+            target=self._run_sync, name="pytracking-spool-sync")
+        self.sync_thread.daemon = True
+        self.sync_thread.start()
+
+    def _run_sync(self):
+        while not self.closed:
+            self.sync_event.wait(self.fsync_interval_seconds)
+            self.sync_event.clear()
+            if self.unsynced_count or self.retired_fds:
+                self.sync()
+
+
+class SpoolDrainer(object):
+    """Sends the tracking results of a spool directory to their webhook, in
+    the order of the segments, and remembers what was sent in a checkpoint
+    file.
+
+    Delivery is at-least-once: when sending a record fails, draining stops and
+    the record is sent again by the next call to drain().
+    """
+
+    def __init__(
+            self, directory, send=None, max_rate=None,
+            batch_size=DEFAULT_BATCH_SIZE, configuration=None, **kwargs):
+        """
+        :param directory: The spool directory.
+        :param send: An optional callable that takes a TrackingResult
+            instance. Default to pytracking.webhook.send_webhook with the
+            configuration.
+        :param max_rate: The optional maximum number of records sent per
+            second.
+        :param batch_size: The number of records sent between two writes of
+            the checkpoint file.
+        :param configuration: An optional Configuration instance.
+        :param kwargs: Optional configuration parameters. If provided with a
+            Configuration instance, the kwargs parameters will override the
+            Configuration parameters.
+        """
+        self.directory = directory
+        self.configuration = get_configuration(configuration, kwargs)
+        self.send = send or _get_default_send(self.configuration)
+        self.max_rate = max_rate
+        self.batch_size = batch_size
+        self.checkpoint_path = os.path.join(directory, CHECKPOINT_FILE_NAME)
+        self.last_send_time = 0
+
+    def get_checkpoint(self):
+        """Returns a dict mapping segment names to the offset of the first
+        record that was not sent.
+        """
+        try:
+            with open(self.checkpoint_path, "r") as checkpoint_file:
+                return json.load(checkpoint_file)
+        except FileNotFoundError:
+            return {}
+
+    def drain(self):
+        """Sends all the records written to the spool so far.
+
+        :return: The number of records sent.
+        """
+        checkpoint = self.get_checkpoint()
+        segment_names = get_segment_names(self.directory)
+        # Forget the segments that were removed.
+        checkpoint = {
+            name: offset for name, offset in checkpoint.items()
+            if name in segment_names}
+
+        sent_count = 0
+        try:
+            for name in segment_names:
+                unsaved_count = 0
+                for (record, offset) in iter_segment_records(
+                        self.directory, name, checkpoint.get(name, 0)):
+                    self._wait_for_rate()
+                    self.send(_get_tracking_result(record))
+                    checkpoint[name] = offset
+                    sent_count += 1
+                    unsaved_count += 1
+                    if unsaved_count >= self.batch_size:
+                        self._save_checkpoint(checkpoint)
+                        unsaved_count = 0
+        finally:
+            self._save_checkpoint(checkpoint)
+
+        return sent_count
+
+    def run(self, poll_interval_seconds=DEFAULT_POLL_INTERVAL_SECONDS,
+            stop_event=None):
+        """Drains the spool until stop_event is set. Errors raised when
+        sending a record are retried after poll_interval_seconds.
+
+        :param poll_interval_seconds: The time to wait before checking for
+            new records.
+        :param stop_event: An optional threading.Event instance.
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                self.drain()
+            except Exception:
+                logger.exception("Could not drain the spool")
+            stop_event.wait(poll_interval_seconds)
+
+    def purge(self, older_than_seconds=DEFAULT_SEGMENT_MAX_SECONDS * 2):
+        """Removes the segments that were completely sent and that were
+        started more than older_than_seconds ago. older_than_seconds must be
+        greater than the segment_max_seconds of the spool writers.
+
+        :return: The list of removed segment names.
+        """
+        checkpoint = self.get_checkpoint()
+        limit = time.time() - older_than_seconds
+        removed_names = []
+        for name in get_segment_names(self.directory):
+            path = os.path.join(self.directory, name)
+            if _get_segment_timestamp(name) < limit and\
+                    checkpoint.get(name, 0) >= os.path.getsize(path):
+                os.remove(path)
+                removed_names.append(name)
+        return removed_names
+
+    def _wait_for_rate(self):
+        if self.max_rate:
+            delay = self.last_send_time + 1.0 / self.max_rate -\
+                time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.last_send_time = time.monotonic()
+
+    def _save_checkpoint(self, checkpoint):
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+
+def replay(
+        directory, start, end, send=None, max_rate=None, configuration=None,
+        **kwargs):
+    """Sends again the spooled tracking results whose timestamp is between
+    start (inclusive) and end (exclusive). The checkpoint of the drainer is
+    not modified.
+
+    :param directory: The spool directory.
+    :param start: The start of the time range, in seconds since epoch.
+    :param end: The end of the time range, in seconds since epoch.
+    :param send: An optional callable that takes a TrackingResult instance.
+        Default to pytracking.webhook.send_webhook with the configuration.
+    :param max_rate: The optional maximum number of records sent per second.
+    :param configuration: An optional Configuration instance.
+    :param kwargs: Optional configuration parameters. If provided with a
+        Configuration instance, the kwargs parameters will override the
+        Configuration parameters.
+    :return: The number of records sent.
+    """
+    drainer = SpoolDrainer(
+        directory, send=send, max_rate=max_rate, configuration=configuration,
+        **kwargs)
+
+    sent_count = 0
+    for name in get_segment_names(directory):
+        for (record, offset) in iter_segment_records(directory, name, 0):
+            tracking_result = _get_tracking_result(record)
+            timestamp = tracking_result.timestamp
+            if timestamp is None:
+                timestamp = record["spooled_at"]
+            if start <= timestamp < end:
+                drainer._wait_for_rate()
+                drainer.send(tracking_result)
+                sent_count += 1
+    return sent_count
+
+
+def get_segment_names(directory):
+    """Returns the names of the segments of a spool directory, oldest first.
+    """
+    return sorted(
+        name for name in os.listdir(directory)
+        if name.endswith(SEGMENT_SUFFIX))
+
+
+def iter_segment_records(directory, name, offset):
+    """Yields (record, offset after the record) for each complete record of a
+    segment, starting at offset.
+    """
+    with open(os.path.join(directory, name), "rb") as segment_file:
+        segment_file.seek(offset)
+        for line in segment_file:
+            if not line.endswith(b"\n"):
+                # The record is being written.
+                return
+            offset += len(line)
+            yield (json.loads(line.decode("utf-8")), offset)
+
+
+def _get_segment_timestamp(name):
+    return int(name.split("-", 1)[0]) / 1000000
+
+
+def _get_tracking_result(record):
+    return TrackingResult(**record["tracking_result"])
+
+
+def _get_default_send(configuration):
+    def send(tracking_result):
+        # Imported here because requests is only needed by the default sender
+        from pytracking.webhook import send_webhook
+        response = send_webhook(tracking_result, configuration)
+        response.raise_for_status()
+        return response
+    return send
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pytracking.spool",
+        description="Sends spooled tracking results to their webhook.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    drain_parser = subparsers.add_parser(
+        "drain", help="Send the records that were not sent yet.")
+    drain_parser.add_argument("directory")
+    drain_parser.add_argument(
+        "--once", action="store_true",
+        help="Exit once the records written so far are sent.")
+    drain_parser.add_argument(
+        "--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL_SECONDS)
+
+    replay_parser = subparsers.add_parser(
+        "replay", help="Send again the records of a time range.")
+    replay_parser.add_argument("directory")
+    replay_parser.add_argument(
+        "--start", type=float, required=True,
+        help="Seconds since epoch (inclusive).")
+    replay_parser.add_argument(
+        "--end", type=float, required=True,
+        help="Seconds since epoch (exclusive).")
+
+    for subparser in (drain_parser, replay_parser):
+        subparser.add_argument(
+            "--rate", type=float, default=None,
+            help="Maximum number of records sent per second.")
+        subparser.add_argument(
+            "--timeout", type=float, default=None,
+            help="Webhook timeout in seconds.")
+
+    options = parser.parse_args(args)
+
+    kwargs = {}
+    if options.timeout is not None:
+        kwargs["webhook_timeout_seconds"] = options.timeout
+
+    if options.command == "replay":
+        sent_count = replay(
+            options.directory, options.start, options.end,
+            max_rate=options.rate, **kwargs)
+        print("Sent {0} records".format(sent_count))
+        return
+
+    drainer = SpoolDrainer(options.directory, max_rate=options.rate, **kwargs)
+    if options.once:
+        print("Sent {0} records".format(drainer.drain()))
+    else:
+        drainer.run(options.poll_interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""Live counts of opens and clicks in time buckets (e.g., per minute), grouped
+by metadata keys (e.g., per campaign and per link).
+
+The counts of a group are kept in a ring buffer of window_buckets buckets, so
+the memory depends on the number of groups and on the length of the window,
+not on the number of events::
+
+    from pytracking.stats import StatsAggregator
+
+    aggregator = StatsAggregator(
+        [("campaign_id",), ("campaign_id", "link_id")], sink=save_rollups,
+        flush_interval_seconds=10)
+    aggregator.add(tracking_result)
+"""
+from array import array
+from collections import namedtuple
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKET_SECONDS = 60
+
+DEFAULT_WINDOW_BUCKETS = 60
+
+# Special grouping key: the tracked URL of click tracking results.
+TRACKED_URL_KEY = "tracked_url"
+
+Rollup = namedtuple(
+    "Rollup", ["grouping", "key", "bucket_start", "opens", "clicks"])
+Rollup.__doc__ = """Counts of a group in a bucket.
+
+grouping is the tuple of the grouping keys, key is the tuple of their values
+and bucket_start is the timestamp of the start of the bucket.
+"""
+
+
+class RingCounter(object):
+    """Counts of opens and clicks in the last window_buckets buckets.
+    """
+
+    __slots__ = ("bucket_ids", "opens", "clicks", "last_bucket_id")
+
+    def __init__(self, window_buckets):
+        self.bucket_ids = array("q", [-1]) * window_buckets
+        self.opens = array("Q", [0]) * window_buckets
+        self.clicks = array("Q", [0]) * window_buckets
+        self.last_bucket_id = -1
+
+    def increment(self, bucket_id, is_open):
+        """Counts an event. Returns False if the bucket is older than the
+        window.
+        """
+        window_buckets = len(self.bucket_ids)
+        if bucket_id <= self.last_bucket_id - window_buckets:
+            return False
+        index = bucket_id % window_buckets
+        if self.bucket_ids[index] != bucket_id:
+            self.bucket_ids[index] = bucket_id
+            self.opens[index] = 0
+            self.clicks[index] = 0
+        if is_open:
+            self.opens[index] += 1
+        else:
+            self.clicks[index] += 1
+        if bucket_id > self.last_bucket_id:
+            self.last_bucket_id = bucket_id
+        return True
+
+    def get(self, bucket_id):
+        """Returns a tuple (opens, clicks) or None if the bucket is not in the
+        ring.
+        """
+        index = bucket_id % len(self.bucket_ids)
+        if self.bucket_ids[index] != bucket_id:
+            return None
+        return (self.opens[index], self.clicks[index])
+
+    def iter_buckets(self, min_bucket_id):
+        """Yields tuples (bucket_id, opens, clicks) in bucket order.
+        """
+        buckets = sorted(
+            (bucket_id, index) for (index, bucket_id)
+            in enumerate(self.bucket_ids) if bucket_id >= min_bucket_id)
+        for (bucket_id, index) in buckets:
+            yield (bucket_id, self.opens[index], self.clicks[index])
+
+
+class StatsAggregator(object):
+    """Counts tracking results per bucket and per group, and periodically
+    passes the counts that changed to a sink.
+
+    The sink is a callable receiving a list of Rollup. A Rollup holds the
+    total counts of its bucket so far: the sink should replace (upsert) the
+    counts it stored for the same bucket.
+
+    Errors raised by the sink are passed to error_callback, or logged if no
+    callback is provided, and the rollups are dropped. Call close() (or use
+    the aggregator as a context manager) to flush the last counts.
+    """
+
+    def __init__(
+            self, groupings, sink=None,
+            bucket_seconds=DEFAULT_BUCKET_SECONDS,
+            window_buckets=DEFAULT_WINDOW_BUCKETS,
+            flush_interval_seconds=None, error_callback=None,
+            clock=time.time):
+        """
+        :param groupings: A list of tuples of metadata keys. The counts are
+            grouped by the values of each tuple. TRACKED_URL_KEY groups by the
+            tracked URL.
+        :param sink: An optional callable receiving a list of Rollup.
+        :param bucket_seconds: The duration of a bucket.
+        :param window_buckets: The number of buckets kept per group. Older
+            events are ignored and groups without events in the window are
+            forgotten.
+        :param flush_interval_seconds: If provided with a sink, a background
+            thread flushes the counts at this interval.
+        :param error_callback: An optional callable called with the exception
+            raised by the sink.
+        :param clock: A callable returning the current time (seconds since
+            epoch), used when a tracking result has no timestamp.
+        """
+        self.groupings = [tuple(grouping) for grouping in groupings]
+        self.sink = sink
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_buckets
+        self.error_callback = error_callback
+        self.clock = clock
+
+        # (grouping, key) -> RingCounter
+        self.counters = {}
+        # (grouping, key, bucket_id) changed since the last flush
+        self.dirty = set()
+        self.late_events = 0
+        self.lock = threading.Lock()
+
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = None
+        if sink is not None and flush_interval_seconds:
+            self.flush_interval_seconds = flush_interval_seconds
+            self.thread = threading.Thread(
+                target=self._run, name="pytracking-stats")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, tracking_result):
+        """Counts a tracking result in each grouping. Results whose
+        grouping keys are all missing are not counted in that grouping.
+
+        :param tracking_result: An instance of TrackingResult.
+        """
+        timestamp = tracking_result.timestamp
+        if timestamp is None:
+            timestamp = self.clock()
+        bucket_id = int(timestamp // self.bucket_seconds)
+        is_open = tracking_result.is_open_tracking
+        metadata = tracking_result.metadata or {}
+
+        with self.lock:
+            for grouping in self.groupings:
+                key = tuple(
+                    tracking_result.tracked_url if name == TRACKED_URL_KEY
+                    else metadata.get(name) for name in grouping)
+                if not any(value is not None for value in key):
+                    continue
+                counter = self.counters.get((grouping, key))
+                if counter is None:
+                    counter = RingCounter(self.window_buckets)
+                    self.counters[(grouping, key)] = counter
+                if counter.increment(bucket_id, is_open):
+                    self.dirty.add((grouping, key, bucket_id))
+                else:
+                    self.late_events += 1
+
+    def get_rollups(self, grouping, key):
+        """Returns the list of Rollup of a group in the window, oldest first.
+
+        :param grouping: A tuple of grouping keys.
+        :param key: The tuple of their values.
+        """
+        grouping = tuple(grouping)
+        key = tuple(key)
+        min_bucket_id = self._get_min_bucket_id()
+        with self.lock:
+            counter = self.counters.get((grouping, key))
+            if counter is None:
+                return []
+            return [
+                Rollup(
+                    grouping, key, bucket_id * self.bucket_seconds, opens,
+                    clicks)
+                for (bucket_id, opens, clicks)
+                in counter.iter_buckets(min_bucket_id)]
+
+    def flush(self):
+        """Passes the counts that changed since the last flush to the sink,
+        forgets the groups without events in the window and returns the
+        list of Rollup.
+        """
+        min_bucket_id = self._get_min_bucket_id()
+        rollups = []
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = set()
+            for (grouping, key, bucket_id) in dirty:
+                counts = self.counters[(grouping, key)].get(bucket_id)
+                if counts is not None:
+                    rollups.append(Rollup(
+                        grouping, key, bucket_id * self.bucket_seconds,
+                        counts[0], counts[1]))
+            expired = [
+                counter_key for (counter_key, counter)
+                in self.counters.items()
+                if counter.last_bucket_id < min_bucket_id]
+            for counter_key in expired:
+                del self.counters[counter_key]
+
+        rollups.sort(key=lambda rollup: rollup.bucket_start)
+        if rollups and self.sink is not None:
+            try:
+                self.sink(rollups)
+            except Exception as e:
+                if self.error_callback:
+                    self.error_callback(e)
+                else:
+                    logger.exception(
+                        "Could not flush %d rollups", len(rollups))
+        return rollups
+
+    def close(self):
+        """Stops the background thread and flushes the counts.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def _get_min_bucket_id(self):
+        return int(self.clock() // self.bucket_seconds) -\
+            self.window_buckets + 1
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.closed:
+                    self.condition.wait(self.flush_interval_seconds)
+                if self.closed:
+                    return
+            self.flush()
@@ -0,0 +1,195 @@
+"""Server-side storage of the data embedded in tracking links.
+
+When a token store is configured, the data of a tracking link is written to
+the store and the link only contains a short signed ID:
+
+    "s" + urlsafe base64(ID + truncated HMAC-SHA256 of the ID)
+
+See pytracking.signing for the signature.
+"""
+import itertools
+import os
+import threading
+
+from pytracking.cache import LRUCache, DEFAULT_CACHE_SIZE
+from pytracking.signing import decode_signed_token, encode_signed_token
+
+
+TOKEN_ID_PREFIX = "s"
+
+DEFAULT_TABLE_NAME = "pytracking_tokens"
+
+DEFAULT_SQLITE_TIMEOUT_SECONDS = 5.0
+
+
+class TokenStore(object):
+    """Base class of the token stores.
+
+    Subclasses implement insert_many and select. get reads through a bounded
+    LRU cache of payloads.
+    """
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :param cache_size: The maximum number of payloads kept in memory.
+        """
+        self.cache = LRUCache(cache_size)
+
+    def put(self, payload):
+        """Stores a payload and returns its ID.
+
+        :param payload: The encoded data of a tracking link (bytes).
+        """
+        return self.put_many([payload])[0]
+
+    def put_many(self, payloads):
+        """Stores payloads in bulk and returns their IDs, in the same order.
+
+        :param payloads: A list of encoded data of tracking links (bytes).
+        """
+        if not payloads:
+            return []
+        return self.insert_many(payloads)
+
+    def get(self, token_id):
+        """Returns the payload of an ID. Raises KeyError if the ID is
+        unknown.
+        """
+        payload = self.cache.get(token_id)
+        if payload is None:
+            payload = self.select(token_id)
+            if payload is None:
+                raise KeyError(token_id)
+            self.cache.set(token_id, payload)
+        return payload
+
+    def insert_many(self, payloads):
+        """Stores payloads and returns their IDs (positive integers).
+        """
+        raise NotImplementedError
+
+    def select(self, token_id):
+        """Returns the payload of an ID or None.
+        """
+        raise NotImplementedError
+
+
+class MemoryTokenStore(TokenStore):
+    """Token store keeping the payloads in a dict. For tests and single
+    process applications: the payloads are lost when the process exits.
+    """
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        super().__init__(cache_size)
+        self.payloads = {}
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        raise TypeError(
+            "A MemoryTokenStore cannot be shared with other processes.")
+
+    def insert_many(self, payloads):
+        with self.lock:
+            token_ids = [next(self.counter) for _ in payloads]
+            self.payloads.update(zip(token_ids, payloads))
+        return token_ids
+
+    def select(self, token_id):
+        return self.payloads.get(token_id)
+
+
+class SQLiteTokenStore(TokenStore):
+    """Token store keeping the payloads in a SQLite database file.
+
+    Each thread and process opens its own connection, so the store can be
+    shared by the workers of a web server or of render_campaign. A bulk
+    insert is a single transaction.
+    """
+
+    def __init__(
+            self, path, cache_size=DEFAULT_CACHE_SIZE,
+            table_name=DEFAULT_TABLE_NAME,
+            timeout=DEFAULT_SQLITE_TIMEOUT_SECONDS):
+        """
+        :param path: The path of the database file. It is created if it does
+            not exist.
+        :param cache_size: The maximum number of payloads kept in memory.
+        :param table_name: The name of the table storing the payloads.
+        :param timeout: The number of seconds to wait for a lock held by
+            another connection.
+        """
+        super().__init__(cache_size)
+        self.path = path
+        self.table_name = table_name
+        self.timeout = timeout
+        self.local = threading.local()
+
+        connection = self.get_connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS {0} "
+            "(id INTEGER PRIMARY KEY, payload BLOB NOT NULL)".format(
+                self.table_name))
+
+    def __getstate__(self):
+        return {
+            "path": self.path, "cache_size": self.cache.maxsize,
+            "table_name": self.table_name, "timeout": self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get_connection(self):
+        """Returns the connection of the current thread.
+        """
+        local = self.local
+        if getattr(local, "pid", None) != os.getpid():
+            import sqlite3
+            local.connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None)
+            local.pid = os.getpid()
+        return local.connection
+
+    def insert_many(self, payloads):
+        connection = self.get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            (last_id,) = connection.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM {0}".format(
+                    self.table_name)).fetchone()
+            token_ids = list(range(last_id + 1, last_id + len(payloads) + 1))
+            connection.executemany(
+                "INSERT INTO {0} (id, payload) VALUES (?, ?)".format(
+                    self.table_name), zip(token_ids, payloads))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return token_ids
+
+    def select(self, token_id):
+        row = self.get_connection().execute(
+            "SELECT payload FROM {0} WHERE id = ?".format(self.table_name),
+            (token_id,)).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0])
+
+
+def encode_token_id(token_id, signing_key):
+    """Returns the signed string embedded in tracking links for an ID.
+
+    :param token_id: The ID returned by a TokenStore.
+    :param signing_key: The secret key (bytes) signing the ID.
+    """
+    id_bytes = token_id.to_bytes((token_id.bit_length() + 7) // 8, "big")
+    return encode_signed_token(id_bytes, signing_key, TOKEN_ID_PREFIX)
+
+
+def decode_token_id(token, signing_key):
+    """Returns the ID of a string returned by encode_token_id. Raises
+    ValueError if the string is invalid or was not signed with signing_key.
+    """
+    id_bytes = decode_signed_token(token, signing_key, TOKEN_ID_PREFIX)
+    return int.from_bytes(id_bytes, "big")
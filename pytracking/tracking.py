@@ -1,15 +1,21 @@
 import base64
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from copy import deepcopy
-import json
+import re
 import time
 from urllib.parse import urljoin
 
-try:
-    # Optional Import
-    from cryptography.fernet import Fernet
-except ImportError:
-    pass
+from pytracking.cache import LRUCache, DEFAULT_CACHE_SIZE, make_hashable
+from pytracking.codec import (
+    DEFAULT_MAX_DECOMPRESSED_SIZE, JSON_CODEC, compress_data, decode_data,
+    get_codec)
+from pytracking.signing import (
+    SIGNED_TOKEN_PREFIX, decode_signed_token, encode_signed_token)
+from pytracking.store import TOKEN_ID_PREFIX, decode_token_id, encode_token_id
+from pytracking.concurrency import imap_bounded, iter_chunks
+from pytracking.metrics import (
+    REGISTRY, DECODE_SECONDS, DECODING_ERRORS_TOTAL, ENCODE_SECONDS,
+    TRACKING_RESULTS_TOTAL)
 
 
 TRACKING_PIXEL = base64.b64decode(
@@ -19,16 +25,38 @@ PNG_MIME_TYPE = "image/png"
 
 DEFAULT_TIMEOUT_SECONDS = 5
 
+DEFAULT_CHUNKSIZE = 64
+
+# Links encrypted with a key of the key ring: "k" + key ID + "_" + token.
+KEY_ID_PREFIX = "k"
+
+KEY_ID_SEPARATOR = "_"
+
+KEY_ID_RE = re.compile(r"^[A-Za-z0-9]+$")
+
 
 class Configuration(object):
 
+    # Attributes that are shared, instead of deep copied, by the copies of a
+    # configuration (e.g., objects holding connections).
+    SHARED_ATTRIBUTES = frozenset((
+        "webhook_client", "codec", "token_store", "decode_cache"))
+
+    # Attributes computed by cache_encryption_key.
+    ENCRYPTION_KEY_ATTRIBUTES = frozenset((
+        "encryption_key", "encryption_keys"))
+
     def __init__(
             self, webhook_url=None,
             webhook_timeout_seconds=DEFAULT_TIMEOUT_SECONDS,
             include_webhook_url=False, base_open_tracking_url=None,
             base_click_tracking_url=None, default_metadata=None,
             include_default_metadata=False, encryption_bytestring_key=None,
-            encoding="utf-8", append_slash=False, **kwargs):
+            encoding="utf-8", append_slash=False, webhook_client=None,
+            codec=None, compress=False, compression_dictionary=None,
+            max_decompressed_size=DEFAULT_MAX_DECOMPRESSED_SIZE,
+            token_store=None, signing_key=None, sign_links=False,
+            decode_cache=None, encryption_key_ring=None, **kwargs):
         """
 
         :param webhook_url: The webhook to notify when a click or open is
@@ -48,6 +76,40 @@ class Configuration(object):
         :param encryption_bytestring_key: The encryption key given by Fernet.
         :param encoding: The encoding to use to encode and decode the tracking
             link. Default to utf-8.
+        :param webhook_client: An optional pytracking.webhook.WebhookClient
+            instance used by send_webhook. It is shared by the copies of the
+            configuration.
+        :param codec: The codec serializing the data embedded in tracking
+            links: "json" (default), "compact" or a
+            pytracking.codec.Codec instance. Links are decoded whatever
+            codec encoded them.
+        :param compress: If True, the encoded data is compressed with zlib
+            when it makes the link shorter. Default to False.
+        :param compression_dictionary: An optional zlib preset dictionary
+            (bytes) used to compress and decompress the encoded data. See
+            pytracking.codec.get_compression_dictionary.
+        :param max_decompressed_size: The maximum size in bytes of
+            decompressed data. Protects against decompression bombs.
+        :param token_store: An optional pytracking.store.TokenStore instance.
+            If provided, the encoded data is written to the store and links
+            only contain a short signed ID. It is shared by the copies of the
+            configuration.
+        :param signing_key: The secret key (bytes) signing the IDs of the
+            token store and the signed links.
+        :param sign_links: If True, the encoded data is signed with a
+            truncated HMAC-SHA256 instead of being encrypted: the data is
+            readable but cannot be modified. Links that are neither signed nor
+            encrypted are then rejected. Default to False.
+        :param decode_cache: An optional pytracking.cache.DecodeCache
+            instance remembering the data decoded from links, e.g., when an
+            image proxy fetches the same open tracking link many times. It is
+            shared by the copies of the configuration.
+        :param encryption_key_ring: An optional list of (key ID, Fernet key)
+            tuples. Links are encrypted with the first key and their key ID
+            is prepended to the link, so they are decrypted with the right
+            key whatever the size of the ring. Key IDs are short
+            alphanumeric strings. Links without a key ID are decrypted with
+            encryption_bytestring_key.
         :param kwargs: Other args
         """
         self.webhook_url = webhook_url
@@ -59,8 +121,19 @@ class Configuration(object):
         self.include_default_metadata = include_default_metadata
         self.encryption_bytestring_key = encryption_bytestring_key
         self.encoding = encoding
+        self.webhook_client = webhook_client
+        self.codec = codec
+        self.compress = compress
+        self.compression_dictionary = compression_dictionary
+        self.max_decompressed_size = max_decompressed_size
+        self.token_store = token_store
+        self.signing_key = signing_key
+        self.sign_links = sign_links
+        self.decode_cache = decode_cache
+        self.encryption_key_ring = encryption_key_ring
         self.kwargs = kwargs
         self.encryption_key = None
+        self.encryption_keys = None
         self.append_slash = False
 
         self.cache_encryption_key()
@@ -76,11 +149,19 @@ class Configuration(object):
     def __deepcopy__(self, memo):
         new_config = Configuration()
         for key, value in self.__dict__.items():
-            if key != "encryption_key":
-                new_config.__dict__[key] = deepcopy(value)
+            if key not in self.ENCRYPTION_KEY_ATTRIBUTES:
+                new_config.__dict__[key] = self.copy_value(key, value)
 
         return new_config
 
+    def copy_value(self, key, value):
+        """Returns a deep copy of the value of an attribute, or the value
+        itself if the attribute is in SHARED_ATTRIBUTES.
+        """
+        if key in self.SHARED_ATTRIBUTES:
+            return value
+        return deepcopy(value)
+
     def merge_with_kwargs(self, kwargs):
         """
 
@@ -96,14 +177,46 @@ class Configuration(object):
 
         return new_configuration
 
+    def freeze(self, merge_cache_size=DEFAULT_CACHE_SIZE):
+        """Returns an immutable copy of this configuration.
+
+        :param merge_cache_size: The maximum number of configurations derived
+            with merge_with_kwargs that the frozen configuration remembers.
+        :rtype: FrozenConfiguration
+        """
+        frozen_configuration = FrozenConfiguration.__new__(
+            FrozenConfiguration)
+        for key, value in self.__dict__.items():
+            if key not in self.ENCRYPTION_KEY_ATTRIBUTES:
+                frozen_configuration.__dict__[key] = self.copy_value(
+                    key, value)
+        frozen_configuration.precompute(merge_cache_size)
+        return frozen_configuration
+
     def cache_encryption_key(self):
         """TODO
         """
+        if self.encryption_bytestring_key or self.encryption_key_ring:
+            # Optional dependency, imported on first use because it is slow
+            # to import and not needed without encryption.
+            from cryptography.fernet import Fernet
+
         if self.encryption_bytestring_key:
             self.encryption_key = Fernet(self.encryption_bytestring_key)
         else:
             self.encryption_key = None
 
+        if self.encryption_key_ring:
+            encryption_keys = OrderedDict()
+            for key_id, key in self.encryption_key_ring:
+                if not KEY_ID_RE.match(key_id) or key_id in encryption_keys:
+                    raise ValueError(
+                        "Invalid or duplicate key ID: {0}".format(key_id))
+                encryption_keys[key_id] = Fernet(key)
+            self.encryption_keys = encryption_keys
+        else:
+            self.encryption_keys = None
+
     def get_data_to_embed(self, url_to_track, extra_metadata):
         """TODO
 
@@ -128,17 +241,85 @@ class Configuration(object):
 
         return data
 
+    def get_signing_key(self):
+        """Returns the signing key as bytes.
+        """
+        if not self.signing_key:
+            raise ValueError("A signing_key is required to sign the links.")
+        if isinstance(self.signing_key, str):
+            return self.signing_key.encode(self.encoding)
+        return self.signing_key
+
+    def get_payload(self, data_to_embed):
+        """Returns a tuple with the data encoded by the codec and compressed
+        if configured, and whether the payload is the legacy JSON.
+        """
+        codec = get_codec(self.codec)
+        byte_str = codec.encode(data_to_embed, self.encoding)
+        is_legacy = codec is JSON_CODEC
+
+        if self.compress:
+            compressed_byte_str = compress_data(
+                byte_str, self.compression_dictionary)
+            if len(compressed_byte_str) < len(byte_str):
+                byte_str = compressed_byte_str
+                is_legacy = False
+
+        return (byte_str, is_legacy)
+
+    def get_url_encoded_data_strs(self, data_to_embed_list):
+        """Returns the encoded data strings of a list of data to embed.
+
+        With a token store, the data is written in bulk instead of once per
+        link.
+        """
+        if self.token_store is None:
+            return [
+                self.get_url_encoded_data_str(data_to_embed)
+                for data_to_embed in data_to_embed_list]
+
+        signing_key = self.get_signing_key()
+        token_ids = self.token_store.put_many([
+            self.get_payload(data_to_embed)[0]
+            for data_to_embed in data_to_embed_list])
+        return [
+            encode_token_id(token_id, signing_key) for token_id in token_ids]
+
     def get_url_encoded_data_str(self, data_to_embed):
         """TODO
         """
-        json_byte_str = json.dumps(data_to_embed).encode(self.encoding)
+        if not REGISTRY.enabled:
+            return self._get_url_encoded_data_str(data_to_embed)
+        start = time.perf_counter()
+        data_str = self._get_url_encoded_data_str(data_to_embed)
+        REGISTRY.observe(ENCODE_SECONDS, time.perf_counter() - start)
+        return data_str
+
+    def _get_url_encoded_data_str(self, data_to_embed):
+        if self.token_store is not None:
+            return self.get_url_encoded_data_strs([data_to_embed])[0]
+
+        (byte_str, is_legacy) = self.get_payload(data_to_embed)
+
+        if self.sign_links:
+            return encode_signed_token(byte_str, self.get_signing_key())
+
+        if self.encryption_keys:
+            (key_id, key) = next(iter(self.encryption_keys.items()))
+            return KEY_ID_PREFIX + key_id + KEY_ID_SEPARATOR +\
+                key.encrypt(byte_str).decode(self.encoding).rstrip("=")
 
         if self.encryption_key:
             data_str = self.encryption_key.encrypt(
-                json_byte_str).decode(self.encoding)
+                byte_str).decode(self.encoding)
         else:
             data_str = base64.urlsafe_b64encode(
-                json_byte_str).decode(self.encoding)
+                byte_str).decode(self.encoding)
+
+        if not is_legacy:
+            # The padding is restored when decoding. It is kept for JSON so
+            # that links are the same as with previous versions.
+            data_str = data_str.rstrip("=")
 
         return data_str
 
@@ -178,15 +359,21 @@ class Configuration(object):
         if encoded_url_path.startswith("/"):
             encoded_url_path = encoded_url_path[1:]
 
-        if self.encryption_key:
-            payload = self.encryption_key.decrypt(
-                encoded_url_path.encode(self.encoding)).decode(
-                    self.encoding)
-        else:
-            payload = base64.urlsafe_b64decode(
-                encoded_url_path.encode(self.encoding)).decode(
-                    self.encoding)
-        data = json.loads(payload)
+        try:
+            if self.decode_cache is None:
+                data = self.get_embedded_data(encoded_url_path)
+            else:
+                # The cached data is shared by all hits: copy it.
+                data = _copy_data(self.decode_cache.get_or_compute(
+                    self.get_decode_cache_key(encoded_url_path),
+                    lambda: self.get_embedded_data(encoded_url_path)))
+        except Exception as e:
+            REGISTRY.inc(
+                DECODING_ERRORS_TOTAL, (("exception", type(e).__name__),))
+            raise
+        REGISTRY.inc(
+            TRACKING_RESULTS_TOTAL,
+            (("type", "open" if is_open else "click"),))
 
         metadata = {}
         if not self.include_default_metadata and self.default_metadata:
@@ -208,6 +395,63 @@ class Configuration(object):
             timestamp=timestamp,
         )
 
+    def get_embedded_data(self, encoded_url_path):
+        """Returns the data embedded in a tracking link.
+        """
+        timer = REGISTRY.get_phase_timer(DECODE_SECONDS)
+        payload = self.get_embedded_payload(encoded_url_path)
+        timer.mark("decrypt")
+        data = decode_data(
+            payload, self.codec, self.encoding, self.compression_dictionary,
+            self.max_decompressed_size)
+        timer.mark("deserialize")
+        return data
+
+    def get_embedded_payload(self, encoded_url_path):
+        """Returns the payload of a tracking link: the data encoded by the
+        codec, once decrypted or verified.
+        """
+        if self.token_store is not None and\
+                encoded_url_path.startswith(TOKEN_ID_PREFIX):
+            payload = self.token_store.get(decode_token_id(
+                encoded_url_path, self.get_signing_key()))
+        elif encoded_url_path.startswith(SIGNED_TOKEN_PREFIX):
+            payload = decode_signed_token(
+                encoded_url_path, self.get_signing_key())
+        elif self.encryption_keys and\
+                encoded_url_path.startswith(KEY_ID_PREFIX):
+            (key_id, _, token) = encoded_url_path[
+                len(KEY_ID_PREFIX):].partition(KEY_ID_SEPARATOR)
+            try:
+                key = self.encryption_keys[key_id]
+            except KeyError:
+                raise ValueError("Unknown key ID: {0}".format(key_id))
+            payload = key.decrypt(
+                _add_base64_padding(token.encode(self.encoding)))
+        else:
+            encoded_byte_str = _add_base64_padding(
+                encoded_url_path.encode(self.encoding))
+            if self.encryption_key:
+                payload = self.encryption_key.decrypt(encoded_byte_str)
+            elif self.encryption_keys:
+                raise ValueError("The link is not encrypted.")
+            elif self.sign_links:
+                raise ValueError("The link is not signed.")
+            else:
+                payload = base64.urlsafe_b64decode(encoded_byte_str)
+        return payload
+
+    def get_decode_cache_key(self, encoded_url_path):
+        """Returns the key of a link in the decode cache: the link and the
+        parameters that change how it is decoded.
+        """
+        return (
+            encoded_url_path, self.encryption_bytestring_key,
+            make_hashable(self.encryption_key_ring), self.signing_key,
+            self.sign_links, self.token_store, self.codec,
+            self.compression_dictionary, self.max_decompressed_size,
+            self.encoding)
+
     def get_click_tracking_url_path(self, url):
         """TODO
         """
@@ -219,12 +463,140 @@ class Configuration(object):
         return url[len(self.base_open_tracking_url):]
 
 
+class FrozenConfiguration(Configuration):
+    """Immutable Configuration that is cheap to use on hot paths.
+
+    The Fernet instance and the tracking URL prefixes are computed once.
+    merge_with_kwargs returns the configuration itself when there is nothing
+    to override and otherwise returns a derived FrozenConfiguration that is
+    memoized in a bounded LRU cache keyed on the overrides.
+
+    Build one with ``FrozenConfiguration(**parameters)`` or
+    ``Configuration.freeze()``. Mutable parameters such as default_metadata
+    must not be modified once frozen.
+    """
+
+    DERIVED_ATTRIBUTES = frozenset((
+        "encryption_key", "encryption_keys", "open_tracking_url_prefix",
+        "click_tracking_url_prefix", "merge_cache", "frozen"))
+
+    def __init__(self, merge_cache_size=DEFAULT_CACHE_SIZE, **kwargs):
+        """
+        :param merge_cache_size: The maximum number of configurations derived
+            with merge_with_kwargs that are remembered.
+        :param kwargs: The parameters accepted by Configuration.
+        """
+        super().__init__(**kwargs)
+        self.precompute(merge_cache_size)
+
+    def __setattr__(self, key, value):
+        if self.__dict__.get("frozen"):
+            raise AttributeError(
+                "FrozenConfiguration is immutable. Use merge_with_kwargs to "
+                "derive a new configuration.")
+        super().__setattr__(key, value)
+
+    def __delattr__(self, key):
+        if self.__dict__.get("frozen"):
+            raise AttributeError("FrozenConfiguration is immutable.")
+        super().__delattr__(key)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def precompute(self, merge_cache_size):
+        """Computes the derived attributes and freezes the configuration.
+        Called once, when the configuration is built.
+        """
+        self.cache_encryption_key()
+        self.open_tracking_url_prefix = _get_url_prefix(
+            self.base_open_tracking_url)
+        self.click_tracking_url_prefix = _get_url_prefix(
+            self.base_click_tracking_url)
+        self.merge_cache = LRUCache(merge_cache_size)
+        self.frozen = True
+
+    def freeze(self, merge_cache_size=DEFAULT_CACHE_SIZE):
+        return self
+
+    def merge_with_kwargs(self, kwargs):
+        """Returns a FrozenConfiguration with the parameters in kwargs
+        overriding the parameters of this configuration.
+
+        Returns self if kwargs does not override any parameter.
+        """
+        overrides = {
+            key: value for key, value in kwargs.items()
+            if key in self.__dict__ and key not in self.DERIVED_ATTRIBUTES}
+        if not overrides:
+            return self
+
+        try:
+            cache_key = make_hashable(overrides)
+            hash(cache_key)
+        except TypeError:
+            return self._derive(overrides)
+
+        new_configuration = self.merge_cache.get(cache_key)
+        if new_configuration is None:
+            new_configuration = self._derive(overrides)
+            self.merge_cache.set(cache_key, new_configuration)
+        return new_configuration
+
+    def _derive(self, overrides):
+        new_configuration = FrozenConfiguration.__new__(FrozenConfiguration)
+        for key, value in self.__dict__.items():
+            if key not in self.DERIVED_ATTRIBUTES:
+                new_configuration.__dict__[key] = value
+        for key, value in overrides.items():
+            new_configuration.__dict__[key] = self.copy_value(key, value)
+        new_configuration.precompute(self.merge_cache.maxsize)
+        return new_configuration
+
+    def get_open_tracking_url_from_data_str(self, data_str):
+        temp_url = self.open_tracking_url_prefix + data_str
+        if self.append_slash:
+            temp_url += "/"
+        return temp_url
+
+    def get_click_tracking_url_from_data_str(self, data_str):
+        temp_url = self.click_tracking_url_prefix + data_str
+        if self.append_slash:
+            temp_url += "/"
+        return temp_url
+
+
+def _get_url_prefix(base_url):
+    """Returns the string that urljoin(base_url, data_str) prepends to
+    data_str. Encoded data strings are a single relative path segment, so the
+    prefix does not depend on the data string.
+    """
+    return urljoin(base_url, "x")[:-1]
+
+
+def _add_base64_padding(byte_str):
+    return byte_str + b"=" * (-len(byte_str) % 4)
+
+
+def _copy_data(value):
+    # Faster than deepcopy for JSON values.
+    if isinstance(value, dict):
+        return {key: _copy_data(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_data(item) for item in value]
+    return value
+
+
 TrackingResultJSON = namedtuple(
     "TrackingResultJSON", [
         "is_open_tracking", "is_click_tracking", "tracked_url", "webhook_url",
         "metadata", "request_data", "timestamp"])
 
 
+TrackingURLs = namedtuple(
+    "TrackingURLs", ["open_tracking_url", "click_tracking_urls"])
+
+
 class TrackingResult(object):
 
     def __init__(self, is_open_tracking=False, is_click_tracking=False,
@@ -248,6 +620,8 @@ class TrackingResult(object):
         self.metadata = metadata
         self.request_data = request_data
         self.timestamp = timestamp
+        # Set by pytracking.classifier.EventClassifier
+        self.classification = None
 
     def to_json_dict(self):
         """Returns a version of the tracking result that can be safely encoded
@@ -259,6 +633,25 @@ class TrackingResult(object):
             self.is_open_tracking, self.is_click_tracking, self.tracked_url,
             self.webhook_url, self.metadata, self.request_data, self.timestamp)
 
+    def to_webhook_payload(self):
+        """Returns the dict that is posted as JSON to the webhook URL.
+        """
+        payload = {
+            "is_open_tracking": self.is_open_tracking,
+            "is_click_tracking": self.is_click_tracking,
+            "metadata": self.metadata,
+            "request_data": self.request_data,
+            "timestamp": self.timestamp
+        }
+
+        if self.tracked_url:
+            payload["tracked_url"] = self.tracked_url
+
+        if self.classification is not None:
+            payload["classification"] = self.classification._asdict()
+
+        return payload
+
     def __str__(self):
         return "<pytracking.TrackingResult> is_open_tracking: {0} "\
             "is_click_tracking: {1} tracked_url: {2}".format(
@@ -401,3 +794,82 @@ def get_open_tracking_url_path(
     """
     configuration = get_configuration(configuration, kwargs)
     return configuration.get_open_tracking_url_path(url)
+
+
+def generate_tracking_urls(
+        urls_to_track, metadata_iterable, configuration=None,
+        open_tracking=True, workers=None, chunksize=DEFAULT_CHUNKSIZE,
+        **kwargs):
+    """Yields a TrackingURLs instance for each metadata dict of
+    metadata_iterable (e.g., one per recipient of a campaign).
+
+    The configuration is resolved once for the whole batch instead of once per
+    link, and metadata_iterable is consumed lazily so it can be a generator
+    over millions of recipients.
+
+    :param urls_to_track: The list of URLs to track. The click_tracking_urls
+        of each TrackingURLs instance are in the same order.
+    :param metadata_iterable: An iterable of dicts that can be json-encoded
+        and that will be encoded in the tracking links.
+    :param configuration: An optional Configuration instance.
+    :param open_tracking: If False, open_tracking_url is always None.
+    :param workers: If provided and greater than 1, the URLs are generated by
+        a pool of threads of that size. Encryption releases the GIL so this is
+        mostly useful when an encryption key is provided. Results are still
+        yielded in order.
+    :param chunksize: The number of metadata dicts processed by a worker in
+        a single task.
+    :param kwargs: Optional configuration parameters. If provided with a
+        Configuration instance, the kwargs parameters will override the
+        Configuration parameters.
+    """
+    configuration = get_configuration(configuration, kwargs)
+    urls_to_track = list(urls_to_track)
+
+    def generate_chunk(metadata_chunk):
+        return _generate_chunk_tracking_urls(
+            urls_to_track, metadata_chunk, configuration, open_tracking)
+
+    chunks = iter_chunks(metadata_iterable, chunksize)
+
+    if not workers or workers <= 1:
+        for chunk in chunks:
+            yield from generate_chunk(chunk)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for results in imap_bounded(
+                executor, generate_chunk, chunks, workers * 2):
+            yield from results
+
+
+def _generate_chunk_tracking_urls(
+        urls_to_track, metadata_chunk, configuration, open_tracking):
+    # The data of the whole chunk is encoded at once so that a token store
+    # receives a single bulk insert.
+    data_to_embed_list = []
+    for metadata in metadata_chunk:
+        if open_tracking:
+            data_to_embed_list.append(
+                configuration.get_data_to_embed(None, metadata))
+        data_to_embed_list.extend(
+            configuration.get_data_to_embed(url_to_track, metadata)
+            for url_to_track in urls_to_track)
+    data_strs = iter(
+        configuration.get_url_encoded_data_strs(data_to_embed_list))
+
+    results = []
+    for _ in metadata_chunk:
+        if open_tracking:
+            open_tracking_url =\
+                configuration.get_open_tracking_url_from_data_str(
+                    next(data_strs))
+        else:
+            open_tracking_url = None
+        click_tracking_urls = [
+            configuration.get_click_tracking_url_from_data_str(
+                next(data_strs))
+            for _ in urls_to_track]
+        results.append(TrackingURLs(open_tracking_url, click_tracking_urls))
+    return results
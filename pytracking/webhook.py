@@ -1,9 +1,40 @@
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
 
+from pytracking.metrics import REGISTRY, WEBHOOK_SECONDS
 from pytracking.tracking import get_configuration
 
 
-def send_webhook(tracking_result, configuration=None, **kwargs):
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+
+DEFAULT_MAX_RETRIES = 3
+
+DEFAULT_BACKOFF_SECONDS = 0.1
+
+DEFAULT_MAX_BACKOFF_SECONDS = 5.0
+
+DEFAULT_FAILURE_THRESHOLD = 5
+
+DEFAULT_RESET_TIMEOUT_SECONDS = 30.0
+
+DEFAULT_BATCH_MAX_COUNT = 500
+
+DEFAULT_BATCH_MAX_BYTES = 1024 * 1024
+
+DEFAULT_BATCH_MAX_LATENCY_SECONDS = 1.0
+
+
+def send_webhook(tracking_result, configuration=None, client=None, **kwargs):
     """Sends a POST request to the webhook URL specified in tracking_result.
 
     The POST request will have a body of type application/json that contains a
@@ -22,25 +53,370 @@ def send_webhook(tracking_result, configuration=None, **kwargs):
 
     :param tracking_result: The TrackingResult instance to post to a webhook.
     :param configuration: An optional Configuration instance.
+    :param client: An optional WebhookClient instance used to send the
+        request. Default to the webhook_client of the configuration. If there
+        is no client, the request is sent with requests.post.
     :param kwargs: Optional configuration parameters. If provided with a
         Configuration instance, the kwargs parameters will override the
         Configuration parameters.
     """
     configuration = get_configuration(configuration, kwargs)
+    client = client or configuration.webhook_client
+    post = client.post if client else requests.post
 
-    payload = {
-        "is_open_tracking": tracking_result.is_open_tracking,
-        "is_click_tracking": tracking_result.is_click_tracking,
-        "metadata": tracking_result.metadata,
-        "request_data": tracking_result.request_data,
-        "timestamp": tracking_result.timestamp
-    }
+    payload = tracking_result.to_webhook_payload()
 
-    if tracking_result.tracked_url:
-        payload["tracked_url"] = tracking_result.tracked_url
+    if not REGISTRY.enabled:
+        return post(
+            tracking_result.webhook_url, json=payload,
+            timeout=configuration.webhook_timeout_seconds)
 
-    response = requests.post(
-        tracking_result.webhook_url, json=payload,
-        timeout=configuration.webhook_timeout_seconds)
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        response = post(
+            tracking_result.webhook_url, json=payload,
+            timeout=configuration.webhook_timeout_seconds)
+        outcome = "success" if response.ok else "http_error"
+    finally:
+        REGISTRY.observe(
+            WEBHOOK_SECONDS, time.perf_counter() - start,
+            (("outcome", outcome),))
 
     return response
+
+
+class CircuitOpenError(Exception):
+    """Raised by WebhookClient when too many requests to a webhook host
+    failed recently and the host is not contacted.
+    """
+    pass
+
+
+class WebhookClient(object):
+    """HTTP client for webhooks that keeps pooled keep-alive connections to
+    each webhook host, retries failed requests, and stops contacting a host
+    that keeps failing.
+
+    A request that times out, cannot connect, or gets a 5xx response is
+    retried up to max_retries times, after sleeping a random delay between 0
+    and backoff_seconds * 2 ** attempt (capped at max_backoff_seconds).
+
+    Once failure_threshold requests in a row to the same host have failed
+    after all their retries, the circuit of the host opens: requests raise
+    CircuitOpenError for reset_timeout_seconds. Then a single request is
+    allowed through and closes the circuit if it succeeds.
+
+    WebhookClient instances are thread-safe. A pickled instance (e.g., in
+    the configuration sent to the workers of render_campaign) is unpickled
+    with its parameters only: it has a new default session and closed
+    circuits.
+    """
+
+    def __init__(
+            self, pool_size=DEFAULT_POOL_SIZE, max_retries=DEFAULT_MAX_RETRIES,
+            backoff_seconds=DEFAULT_BACKOFF_SECONDS,
+            max_backoff_seconds=DEFAULT_MAX_BACKOFF_SECONDS,
+            failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+            reset_timeout_seconds=DEFAULT_RESET_TIMEOUT_SECONDS,
+            session=None):
+        """
+        :param pool_size: The maximum number of keep-alive connections kept
+            for each webhook host.
+        :param max_retries: The maximum number of retries of a request.
+        :param backoff_seconds: The base delay between two attempts.
+        :param max_backoff_seconds: The maximum delay between two attempts.
+        :param failure_threshold: The number of consecutive failed requests
+            to a host that opens its circuit.
+        :param reset_timeout_seconds: The time during which an open circuit
+            rejects requests.
+        :param session: An optional requests.Session instance. Default to a
+            new session.
+        """
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.pool_size = pool_size
+
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # host -> [consecutive failures, time when the circuit opened or
+        # None, True if a trial request is in flight]
+        self.circuits = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        return {
+            "pool_size": self.pool_size, "max_retries": self.max_retries,
+            "backoff_seconds": self.backoff_seconds,
+            "max_backoff_seconds": self.max_backoff_seconds,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout_seconds": self.reset_timeout_seconds}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def post(self, url, **kwargs):
+        """Sends a POST request with retries. Takes the same parameters as
+        requests.Session.post.
+
+        :return: The requests.Response instance of the last attempt.
+        :raises CircuitOpenError: If the circuit of the host is open.
+        """
+        host = urlsplit(url).netloc
+        self._acquire_circuit(host)
+
+        attempt = 0
+        while True:
+            error = None
+            response = None
+            try:
+                response = self.session.post(url, **kwargs)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                error = e
+            except Exception:
+                self._record_failure(host)
+                raise
+
+            if error is None and response.status_code < 500:
+                self._record_success(host)
+                return response
+
+            if attempt >= self.max_retries:
+                self._record_failure(host)
+                if error is not None:
+                    raise error
+                return response
+
+            time.sleep(random.uniform(0, min(
+                self.max_backoff_seconds,
+                self.backoff_seconds * 2 ** attempt)))
+            attempt += 1
+
+    def is_circuit_open(self, url):
+        """Returns True if requests to the host of url are currently
+        rejected.
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            circuit = self.circuits.get(host)
+            return circuit is not None and circuit[1] is not None and\
+                (circuit[2] or time.monotonic() - circuit[1] <
+                 self.reset_timeout_seconds)
+
+    def close(self):
+        """Closes the pooled connections.
+        """
+        self.session.close()
+
+    def _acquire_circuit(self, host):
+        with self.lock:
+            circuit = self.circuits.setdefault(host, [0, None, False])
+            if circuit[1] is None:
+                return
+            if circuit[2] or time.monotonic() - circuit[1] <\
+                    self.reset_timeout_seconds:
+                raise CircuitOpenError(
+                    "Too many failed requests to {0}".format(host))
+            # Half-open: let a single trial request through.
+            circuit[2] = True
+
+    def _record_success(self, host):
+        with self.lock:
+            self.circuits[host] = [0, None, False]
+
+    def _record_failure(self, host):
+        with self.lock:
+            circuit = self.circuits[host]
+            circuit[0] += 1
+            if circuit[2] or circuit[0] >= self.failure_threshold:
+                circuit[1] = time.monotonic()
+            circuit[2] = False
+
+
+class BatchWebhookSender(object):
+    """Buffers tracking results and posts them to their webhook URL in
+    batches, as a JSON array of the payloads that send_webhook posts.
+
+    A batch is posted by a background thread as soon as it holds max_count
+    payloads, max_bytes of JSON, or when its oldest payload has waited for
+    max_latency_seconds. Call close() (or use the sender as a context
+    manager) before the process exits to post the buffered payloads.
+
+    Errors are passed to error_callback, or logged if no callback is provided,
+    and the payloads of the failed batch are dropped.
+    """
+
+    def __init__(
+            self, configuration=None, max_count=DEFAULT_BATCH_MAX_COUNT,
+            max_bytes=DEFAULT_BATCH_MAX_BYTES,
+            max_latency_seconds=DEFAULT_BATCH_MAX_LATENCY_SECONDS,
+            compress=False, error_callback=None, client=None, **kwargs):
+        """
+        :param configuration: An optional Configuration instance.
+        :param max_count: The maximum number of payloads in a batch.
+        :param max_bytes: The maximum size of the JSON body of a batch.
+        :param max_latency_seconds: The maximum time a payload is buffered.
+        :param compress: If True, the body is compressed with gzip and sent
+            with a ``Content-Encoding: gzip`` header.
+        :param error_callback: An optional callable called with the webhook
+            URL, the number of dropped payloads and the exception when a batch
+            cannot be posted.
+        :param client: An optional WebhookClient instance used to post the
+            batches. Default to the webhook_client of the configuration.
+        :param kwargs: Optional configuration parameters. If provided with a
+            Configuration instance, the kwargs parameters will override the
+            Configuration parameters.
+        """
+        self.configuration = get_configuration(configuration, kwargs)
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_latency_seconds = max_latency_seconds
+        self.compress = compress
+        self.error_callback = error_callback
+        self.client = client or self.configuration.webhook_client
+
+        # webhook url -> [encoded payloads, size in bytes, deadline]
+        self.batches = {}
+        # (webhook url, encoded payloads) ready to be posted
+        self.ready_batches = []
+        self.sending_count = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(
+            target=self._run, name="pytracking-batch-webhook")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, tracking_result):
+        """Buffers the webhook payload of tracking_result.
+
+        :param tracking_result: The TrackingResult instance to post to its
+            webhook URL.
+        """
+        webhook_url = tracking_result.webhook_url
+        if not webhook_url:
+            raise ValueError("The tracking result has no webhook URL.")
+        encoded_payload = json.dumps(
+            tracking_result.to_webhook_payload()).encode("utf-8")
+
+        size = len(encoded_payload) + 1
+
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The sender is closed.")
+            batch = self.batches.get(webhook_url)
+            if batch is not None and batch[1] + size > self.max_bytes:
+                # Keep the body of a batch under max_bytes
+                self._move_batch_to_ready(webhook_url)
+                batch = None
+            if batch is None:
+                batch = [[], 2, time.monotonic() + self.max_latency_seconds]
+                self.batches[webhook_url] = batch
+            batch[0].append(encoded_payload)
+            batch[1] += size
+            if len(batch[0]) >= self.max_count or\
+                    batch[1] >= self.max_bytes:
+                self._move_batch_to_ready(webhook_url)
+            if len(batch[0]) == 1 or self.ready_batches:
+                # Wake up the background thread only when a deadline was
+                # added or a batch is ready.
+                self.condition.notify_all()
+
+    def flush(self):
+        """Posts all buffered payloads and waits until they have been sent.
+        """
+        with self.condition:
+            self._move_batches_to_ready(None)
+            self.condition.notify_all()
+            while self.ready_batches or self.sending_count:
+                self.condition.wait()
+
+    def close(self):
+        """Posts all buffered payloads and stops the background thread.
+        """
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def _move_batch_to_ready(self, webhook_url):
+        batch = self.batches.pop(webhook_url)
+        self.ready_batches.append((webhook_url, batch[0]))
+
+    def _move_batches_to_ready(self, now):
+        for webhook_url, batch in list(self.batches.items()):
+            if now is None or batch[2] <= now:
+                self._move_batch_to_ready(webhook_url)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    self._move_batches_to_ready(time.monotonic())
+                    if self.ready_batches or self.closed:
+                        break
+                    timeout = None
+                    if self.batches:
+                        timeout = min(
+                            batch[2] for batch in self.batches.values()) -\
+                            time.monotonic()
+                    self.condition.wait(timeout)
+                if self.closed and not self.ready_batches:
+                    return
+                ready_batches = self.ready_batches
+                self.ready_batches = []
+                self.sending_count += len(ready_batches)
+
+            for webhook_url, encoded_payloads in ready_batches:
+                try:
+                    self._post_batch(webhook_url, encoded_payloads)
+                except Exception as e:
+                    self._report_error(webhook_url, len(encoded_payloads), e)
+                finally:
+                    with self.condition:
+                        self.sending_count -= 1
+                        self.condition.notify_all()
+
+    def _report_error(self, webhook_url, count, error):
+        if self.error_callback:
+            try:
+                self.error_callback(webhook_url, count, error)
+            except Exception:
+                # The thread must keep sending the other batches.
+                logger.exception("Error callback of BatchWebhookSender")
+        else:
+            logger.exception(
+                "Could not post %d payloads to %s", count, webhook_url)
+
+    def _post_batch(self, webhook_url, encoded_payloads):
+        body = b"[" + b",".join(encoded_payloads) + b"]"
+        headers = {"Content-Type": "application/json"}
+        if self.compress:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        post = self.client.post if self.client else requests.post
+        response = post(
+            webhook_url, data=body, headers=headers,
+            timeout=self.configuration.webhook_timeout_seconds)
+        response.raise_for_status()
+        return response
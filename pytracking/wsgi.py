@@ -0,0 +1,43 @@
+"""WSGI app serving the open and click tracking links without a web framework.
+
+::
+
+    # tracking_app.py, served with e.g. gunicorn tracking_app:application
+    from pytracking.wsgi import WSGITrackingApp
+
+    class TrackingApp(WSGITrackingApp):
+        def notify_tracking_event(self, tracking_result):
+            ...
+
+    application = TrackingApp(
+        base_open_tracking_url="https://trackingdomain.com/open/",
+        base_click_tracking_url="https://trackingdomain.com/click/",
+        trusted_proxies=["10.0.0.0/8"])
+"""
+from pytracking.app import TrackingApp
+
+
+class WSGITrackingApp(TrackingApp):
+    """WSGI application returning a tracking pixel for open tracking links and
+    a 302 redirect for click tracking links. See TrackingApp.
+    """
+
+    def __call__(self, environ, start_response):
+        (response, tracking_result, error) = self.process_request(
+            environ.get("REQUEST_METHOD"), environ.get("PATH_INFO", ""),
+            lambda: self.get_request_data(
+                environ.get("REMOTE_ADDR"),
+                environ.get("HTTP_X_FORWARDED_FOR"),
+                environ.get("HTTP_USER_AGENT")))
+
+        if error is not None:
+            self.notify_decoding_error(error, environ)
+        elif tracking_result is not None:
+            self.notify_tracking_event(tracking_result)
+
+        start_response(
+            "{0} {1}".format(response.status, response.reason),
+            list(response.headers))
+        if environ.get("REQUEST_METHOD") == "HEAD":
+            return [b""]
+        return [response.body]
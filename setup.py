@@ -15,6 +15,7 @@ with open(path.join(here, 'README.rst'), encoding='utf-8') as f:
 EXTRA_REQUIRES = {
     'test': ['tox>=2.3.1', 'pytest>=2.9.2'],
     'webhook': ['requests>=2.10.0'],
+    'async': ['aiohttp>=3.6'],
     'html': ['lxml>=3.6.1'],
     'crypto': ['cryptography>=1.4'],
     'django': ['django-ipware>=2.0.0', 'django>=1.11']
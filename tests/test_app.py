@@ -0,0 +1,221 @@
+import asyncio
+from urllib.parse import urlsplit
+
+import pytest
+
+from pytracking import get_click_tracking_url, get_open_tracking_url
+from pytracking.asgi import ASGITrackingApp
+from pytracking.classifier import EventClassifier
+from pytracking.dedupe import EventDeduplicator
+from pytracking.tracking import TRACKING_PIXEL
+from pytracking.wsgi import WSGITrackingApp
+
+from .test_pytracking import (
+    DEFAULT_BASE_CLICK_TRACKING_URL, DEFAULT_BASE_OPEN_TRACKING_URL,
+    DEFAULT_METADATA, DEFAULT_URL_TO_TRACK)
+
+
+SETTINGS = {
+    "base_open_tracking_url": DEFAULT_BASE_OPEN_TRACKING_URL,
+    "base_click_tracking_url": DEFAULT_BASE_CLICK_TRACKING_URL,
+}
+
+
+class RecordingWSGIApp(WSGITrackingApp):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = []
+        self.errors = []
+
+    def notify_tracking_event(self, tracking_result):
+        self.events.append(tracking_result)
+
+    def notify_decoding_error(self, exception, request):
+        self.errors.append(exception)
+
+
+class RecordingASGIApp(ASGITrackingApp):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = []
+        self.errors = []
+
+    async def notify_tracking_event(self, tracking_result):
+        self.events.append(tracking_result)
+
+    def notify_decoding_error(self, exception, request):
+        self.errors.append(exception)
+
+
+def call_wsgi(app, path, method="GET", **environ):
+    environ.update({
+        "REQUEST_METHOD": method, "PATH_INFO": path,
+        "REMOTE_ADDR": "10.0.0.1"})
+    started = []
+
+    def start_response(status, headers):
+        started.append((status, dict(headers)))
+
+    body = b"".join(app(environ, start_response))
+    (status, headers) = started[0]
+    return (status, headers, body)
+
+
+def call_asgi(app, scope, messages=()):
+    received = list(messages)
+    sent = []
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(app(scope, receive, send))
+    finally:
+        loop.close()
+    return sent
+
+
+def get_http_scope(path, method="GET", headers=()):
+    return {
+        "type": "http", "method": method, "path": path,
+        "headers": list(headers), "client": ("10.0.0.1", 50000)}
+
+
+def test_wsgi_open():
+    app = RecordingWSGIApp(**SETTINGS)
+    path = urlsplit(get_open_tracking_url(
+        metadata=DEFAULT_METADATA, **SETTINGS)).path
+    (status, headers, body) = call_wsgi(
+        app, path, HTTP_USER_AGENT="Firefox")
+
+    assert status == "200 OK"
+    assert headers["Content-Type"] == "image/png"
+    assert body == TRACKING_PIXEL
+    assert len(app.events) == 1
+    assert app.events[0].is_open_tracking
+    assert app.events[0].metadata == DEFAULT_METADATA
+    assert app.events[0].request_data == {
+        "user_agent": "Firefox", "user_ip": "10.0.0.1"}
+
+
+def test_wsgi_click():
+    app = RecordingWSGIApp(**SETTINGS)
+    path = urlsplit(get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, **SETTINGS)).path
+    (status, headers, body) = call_wsgi(app, path)
+
+    assert status == "302 Found"
+    assert headers["Location"] ==\
+        "https://www.bob.com/hello-world/?token=value%C3%A9%C3%A9%C3%A9"
+    assert body == b""
+    assert app.events[0].is_click_tracking
+    assert app.events[0].tracked_url == DEFAULT_URL_TO_TRACK
+
+
+def test_wsgi_not_found():
+    app = RecordingWSGIApp(**SETTINGS)
+    (status, _, _) = call_wsgi(app, "/tracking/open/invalid")
+    assert status == "404 Not Found"
+    assert len(app.errors) == 1
+
+    (status, _, _) = call_wsgi(app, "/other/")
+    assert status == "404 Not Found"
+    assert len(app.errors) == 1
+    assert not app.events
+
+
+def test_wsgi_method_not_allowed_and_head():
+    app = RecordingWSGIApp(**SETTINGS)
+    path = urlsplit(get_open_tracking_url(**SETTINGS)).path
+    (status, headers, _) = call_wsgi(app, path, method="POST")
+    assert status == "405 Method Not Allowed"
+    assert headers["Allow"] == "GET, HEAD"
+
+    (status, headers, body) = call_wsgi(app, path, method="HEAD")
+    assert status == "200 OK"
+    assert headers["Content-Length"] == str(len(TRACKING_PIXEL))
+    assert body == b""
+
+
+def test_trusted_proxies():
+    app = RecordingWSGIApp(trusted_proxies=["10.0.0.0/8"], **SETTINGS)
+    path = urlsplit(get_open_tracking_url(**SETTINGS)).path
+    call_wsgi(
+        app, path, HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2, 10.1.1.1")
+    assert app.events[0].request_data["user_ip"] == "2.2.2.2"
+
+    untrusting_app = RecordingWSGIApp(**SETTINGS)
+    call_wsgi(untrusting_app, path, HTTP_X_FORWARDED_FOR="2.2.2.2")
+    assert untrusting_app.events[0].request_data["user_ip"] == "10.0.0.1"
+
+
+def test_classifier():
+    path = urlsplit(get_open_tracking_url(**SETTINGS)).path
+    app = RecordingWSGIApp(classifier=EventClassifier(), **SETTINGS)
+    call_wsgi(app, path, HTTP_USER_AGENT="Googlebot/2.1")
+    assert app.events[0].classification.is_machine
+
+    app = RecordingWSGIApp(
+        classifier=EventClassifier(), drop_machine_events=True, **SETTINGS)
+    (status, _, body) = call_wsgi(app, path, HTTP_USER_AGENT="Googlebot/2.1")
+    assert status == "200 OK"
+    assert body == TRACKING_PIXEL
+    assert not app.events
+
+
+def test_deduplicator():
+    path = urlsplit(get_open_tracking_url(
+        metadata=DEFAULT_METADATA, **SETTINGS)).path
+    deduplicator = EventDeduplicator(["param1"])
+    app = RecordingWSGIApp(deduplicator=deduplicator, **SETTINGS)
+    for _ in range(3):
+        (status, _, _) = call_wsgi(app, path)
+        assert status == "200 OK"
+    assert len(app.events) == 1
+    assert deduplicator.duplicates == 2
+
+
+def test_asgi_open_and_click():
+    app = RecordingASGIApp(**SETTINGS)
+    path = urlsplit(get_open_tracking_url(
+        metadata=DEFAULT_METADATA, **SETTINGS)).path
+    sent = call_asgi(app, get_http_scope(
+        path, headers=[(b"user-agent", b"Firefox")]))
+
+    assert sent[0]["status"] == 200
+    assert (b"content-type", b"image/png") in sent[0]["headers"]
+    assert sent[1]["body"] == TRACKING_PIXEL
+    assert app.events[0].metadata == DEFAULT_METADATA
+    assert app.events[0].request_data == {
+        "user_agent": "Firefox", "user_ip": "10.0.0.1"}
+
+    path = urlsplit(get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, **SETTINGS)).path
+    sent = call_asgi(app, get_http_scope(path, method="HEAD"))
+    assert sent[0]["status"] == 302
+    assert (b"location",
+            b"https://www.bob.com/hello-world/?token=value%C3%A9%C3%A9%C3%A9"
+            ) in sent[0]["headers"]
+    assert sent[1]["body"] == b""
+    assert len(app.events) == 2
+
+
+def test_asgi_not_found_and_lifespan():
+    app = RecordingASGIApp(**SETTINGS)
+    sent = call_asgi(app, get_http_scope("/tracking/open/invalid"))
+    assert sent[0]["status"] == 404
+    assert len(app.errors) == 1
+
+    sent = call_asgi(app, {"type": "lifespan"}, [
+        {"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+    assert [message["type"] for message in sent] == [
+        "lifespan.startup.complete", "lifespan.shutdown.complete"]
+
+    with pytest.raises(ValueError):
+        call_asgi(app, {"type": "websocket"})
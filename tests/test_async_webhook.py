@@ -0,0 +1,140 @@
+import asyncio
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+from socketserver import ThreadingMixIn
+import threading
+import time
+
+import pytest
+
+from pytracking import TrackingResult
+from .test_pytracking import DEFAULT_METADATA, DEFAULT_URL_TO_TRACK
+
+from pytracking.async_webhook import AsyncWebhookSender, async_send_webhook
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class WebhookServer(object):
+    """Local stand-in for a webhook receiver that records the requests it
+    receives.
+    """
+
+    def __init__(self, delay_seconds=0):
+        self.payloads = []
+        self.connections = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                with server.lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(
+                        server.max_in_flight, server.in_flight)
+                    server.connections.add(self.client_address)
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(delay_seconds)
+                with server.lock:
+                    server.in_flight -= 1
+                    server.payloads.append(json.loads(body.decode("utf-8")))
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{0}/webhook/".format(
+            self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def webhook_server():
+    server = WebhookServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def slow_webhook_server():
+    server = WebhookServer(delay_seconds=0.05)
+    yield server
+    server.close()
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def get_tracking_result(webhook_url, index=0):
+    return TrackingResult(
+        is_click_tracking=True, tracked_url=DEFAULT_URL_TO_TRACK,
+        webhook_url=webhook_url, metadata=dict(DEFAULT_METADATA, index=index),
+        timestamp=1389177318)
+
+
+def test_async_send_webhook(webhook_server):
+    tracking_result = get_tracking_result(webhook_server.url)
+
+    response = run(async_send_webhook(tracking_result))
+
+    assert response.status == 200
+    assert webhook_server.payloads == [tracking_result.to_webhook_payload()]
+
+
+def test_async_webhook_sender(slow_webhook_server):
+    async def send_all():
+        async with AsyncWebhookSender(
+                max_concurrency=3, limit_per_host=3) as sender:
+            for index in range(12):
+                sender.submit(
+                    get_tracking_result(slow_webhook_server.url, index))
+            responses = await sender.join()
+        return responses
+
+    responses = run(send_all())
+
+    assert [response.status for response in responses] == [200] * 12
+    assert sorted(
+        payload["metadata"]["index"]
+        for payload in slow_webhook_server.payloads) == list(range(12))
+    assert slow_webhook_server.max_in_flight <= 3
+    # Keep-alive connections are reused
+    assert len(slow_webhook_server.connections) <= 3
+
+
+def test_async_webhook_sender_cancel(slow_webhook_server):
+    async def send_and_cancel():
+        sender = AsyncWebhookSender(max_concurrency=1)
+        tasks = [
+            sender.submit(get_tracking_result(slow_webhook_server.url, index))
+            for index in range(10)]
+        await asyncio.sleep(0.01)
+        await sender.cancel()
+        await sender.close()
+        return tasks
+
+    tasks = run(send_and_cancel())
+
+    assert all(task.done() for task in tasks)
+    assert any(task.cancelled() for task in tasks)
+    assert len(slow_webhook_server.payloads) < 10
@@ -0,0 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+
+from pytracking import (
+    Configuration, get_open_tracking_result, get_open_tracking_url)
+from pytracking.cache import DecodeCache
+from .test_pytracking import (
+    DEFAULT_METADATA, DEFAULT_REQUEST_DATA, DEFAULT_SETTINGS,
+    EXPECTED_METADATA)
+
+
+def test_decode_cache():
+    cache = DecodeCache(maxsize=2, ttl_seconds=60)
+    calls = []
+
+    def compute(value):
+        def function():
+            calls.append(value)
+            return value
+        return function
+
+    assert cache.get_or_compute("a", compute(1)) == 1
+    assert cache.get_or_compute("a", compute(2)) == 1
+    cache.get_or_compute("b", compute(3))
+    cache.get_or_compute("c", compute(4))
+    assert cache.get_or_compute("a", compute(5)) == 5
+
+    assert calls == [1, 3, 4, 5]
+    assert cache.get_stats() == {"hits": 1, "misses": 4, "size": 2}
+
+
+def test_decode_cache_ttl():
+    cache = DecodeCache(ttl_seconds=0.05)
+
+    cache.get_or_compute("a", lambda: 1)
+    assert cache.get_or_compute("a", lambda: 2) == 1
+    time.sleep(0.06)
+    assert cache.get_or_compute("a", lambda: 3) == 3
+
+
+def test_decode_cache_errors():
+    cache = DecodeCache()
+
+    def fail():
+        raise ValueError("Invalid link")
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.get_or_compute("a", fail)
+    assert cache.get_stats()["misses"] == 2
+    assert len(cache) == 0
+
+
+def test_decode_cache_single_flight():
+    cache = DecodeCache()
+    calls = []
+    started = threading.Event()
+
+    def slow_compute():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return "value"
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        first = executor.submit(cache.get_or_compute, "a", slow_compute)
+        started.wait()
+        others = [
+            executor.submit(cache.get_or_compute, "a", slow_compute)
+            for _ in range(7)]
+        results = [first.result()] + [future.result() for future in others]
+
+    assert results == ["value"] * 8
+    assert calls == [1]
+    assert cache.get_stats() == {"hits": 7, "misses": 1, "size": 1}
+
+
+def test_configuration_decode_cache():
+    cache = DecodeCache()
+    configuration = Configuration(decode_cache=cache, **DEFAULT_SETTINGS)
+    url = get_open_tracking_url(DEFAULT_METADATA, configuration)
+
+    results = [
+        get_open_tracking_result(
+            url, request_data=dict(DEFAULT_REQUEST_DATA, index=index),
+            configuration=configuration)
+        for index in range(3)]
+
+    assert cache.get_stats()["misses"] == 1
+    assert cache.get_stats()["hits"] == 2
+    for index, tracking_result in enumerate(results):
+        assert tracking_result.metadata == EXPECTED_METADATA
+        assert tracking_result.request_data["index"] == index
+    # Each result has its own copy of the metadata
+    results[0].metadata["nested"]["param2"] = "changed"
+    assert results[1].metadata == EXPECTED_METADATA
+
+    # Links decoded with other parameters are cached separately
+    get_open_tracking_result(
+        url, configuration=configuration, signing_key=b"key")
+    assert cache.get_stats()["misses"] == 2
+    assert configuration.freeze().decode_cache is cache
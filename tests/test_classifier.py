@@ -0,0 +1,94 @@
+import time
+
+from pytracking import TrackingResult
+from pytracking.classifier import (
+    EventClassifier, IPRanges, HUMAN, REASON_BURST, REASON_IP,
+    REASON_TOO_EARLY, REASON_USER_AGENT)
+
+
+FIREFOX = "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Firefox/115.0"
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def get_request_data(user_agent=FIREFOX, user_ip="203.0.113.7"):
+    return {"user_agent": user_agent, "user_ip": user_ip}
+
+
+def test_ip_ranges():
+    ranges = IPRanges([
+        "10.0.0.0/9", "10.128.0.0/9", "192.0.2.1", "2001:db8::/32"])
+    # The two halves of 10.0.0.0/8 are merged.
+    assert len(ranges) == 3
+    assert "10.255.255.255" in ranges
+    assert "192.0.2.1" in ranges
+    assert "2001:db8::1" in ranges
+    assert "192.0.2.2" not in ranges
+    assert "9.255.255.255" not in ranges
+    assert "invalid" not in ranges
+
+
+def test_classify_user_agent_and_ip():
+    classifier = EventClassifier(ip_networks=["198.51.100.0/24"])
+
+    assert classifier.classify(get_request_data()) == HUMAN
+    assert classifier.classify(get_request_data(
+        "Mozilla/5.0 (compatible; Googlebot/2.1)")).reason ==\
+        REASON_USER_AGENT
+    assert classifier.classify(get_request_data(
+        "python-requests/2.31")).is_machine
+    for user_agent in (
+            "Mozilla/5.0 (compatible; bingbot/2.0)",
+            "Slackbot-LinkExpanding 1.0", "Mozilla/5.0 (compatible; bot)"):
+        assert classifier.classify(get_request_data(user_agent)).is_machine
+    for user_agent in (
+            "Mozilla/5.0 (Linux; Android 10; Cubot X30) Chrome/120.0 Mobile",
+            "Mozilla/5.0 (Linux; Android 12; CUBOT_NOTE_30) Chrome/119.0",
+            "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0) Mobile/15E148"):
+        assert not classifier.is_machine_user_agent(user_agent)
+    assert classifier.classify(get_request_data(
+        user_ip="198.51.100.20")).reason == REASON_IP
+    assert classifier.classify({}) == HUMAN
+    assert EventClassifier(flag_missing_user_agent=True).classify(
+        {}).is_machine
+
+
+def test_classify_burst():
+    clock = FakeClock()
+    classifier = EventClassifier(
+        burst_count=3, burst_window_seconds=0.5, clock=clock)
+
+    for _ in range(2):
+        assert classifier.classify(get_request_data()) == HUMAN
+        clock.now += 0.1
+    assert classifier.classify(get_request_data()).reason == REASON_BURST
+
+    # Another IP is not affected.
+    assert classifier.classify(get_request_data(user_ip="1.1.1.1")) == HUMAN
+
+    clock.now += 10
+    assert classifier.classify(get_request_data()) == HUMAN
+
+
+def test_classify_tracking_result():
+    classifier = EventClassifier(
+        sent_at_key="sent_at", min_delay_seconds=60)
+    tracking_result = TrackingResult(
+        is_open_tracking=True, metadata={"sent_at": time.time()},
+        request_data=get_request_data())
+
+    classification = classifier.classify_tracking_result(tracking_result)
+    assert classification.reason == REASON_TOO_EARLY
+    assert tracking_result.classification is classification
+    assert tracking_result.to_webhook_payload()["classification"] == {
+        "is_machine": True, "reason": REASON_TOO_EARLY}
+
+    tracking_result.metadata["sent_at"] -= 3600
+    assert classifier.classify_tracking_result(tracking_result) == HUMAN
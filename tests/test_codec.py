@@ -0,0 +1,173 @@
+import pytest
+
+from pytracking import (
+    Configuration, get_click_tracking_result, get_click_tracking_url,
+    get_open_tracking_result, get_open_tracking_url)
+from pytracking.codec import (
+    COMPACT_CODEC, JSON_CODEC, CompactCodec, compress_data, decode_data,
+    decompress_data, get_compression_dictionary)
+from .test_pytracking import (
+    DEFAULT_METADATA, DEFAULT_SETTINGS, DEFAULT_URL_TO_TRACK,
+    DEFAULT_WEBHOOK_URL, EXPECTED_METADATA)
+
+
+DEFAULT_DATA = {
+    "url": DEFAULT_URL_TO_TRACK,
+    "metadata": {
+        "str": "valèèè", "int": 300, "negative": -2 ** 70, "float": 1.5,
+        "none": None, "true": True, "false": False,
+        "list": [1, "a", [], {}], "dict": {"a": {"b": [None]}}},
+    "webhook": DEFAULT_WEBHOOK_URL,
+}
+
+
+@pytest.mark.parametrize("data", [
+    {}, DEFAULT_DATA, {"url": DEFAULT_URL_TO_TRACK},
+    {"metadata": {}}, {"url": 1, "other": ["value"]}])
+def test_compact_codec(data):
+    byte_str = COMPACT_CODEC.encode(data)
+
+    assert byte_str[0] == 0x01
+    assert COMPACT_CODEC.decode(byte_str) == data
+    assert decode_data(byte_str) == data
+    assert decode_data(JSON_CODEC.encode(data), COMPACT_CODEC) == data
+
+
+def test_compact_codec_size():
+    assert len(COMPACT_CODEC.encode(DEFAULT_DATA)) <\
+        len(JSON_CODEC.encode(DEFAULT_DATA)) * 0.75
+
+
+def test_compact_codec_keys():
+    assert COMPACT_CODEC.decode(COMPACT_CODEC.encode(
+        {"metadata": {1: "a", None: "b"}})) ==\
+        {"metadata": {"1": "a", "null": "b"}}
+
+    with pytest.raises(TypeError):
+        COMPACT_CODEC.encode({"metadata": {(1, 2): "a"}})
+    with pytest.raises(TypeError):
+        COMPACT_CODEC.encode({"metadata": {"a": object()}})
+
+
+def test_compact_codec_invalid():
+    byte_str = COMPACT_CODEC.encode(DEFAULT_DATA)
+
+    for invalid in (b"", byte_str[:-1], byte_str + b"\x00", b"\x7f"):
+        with pytest.raises(ValueError):
+            decode_data(invalid)
+
+
+def test_custom_codec():
+    class CustomCodec(CompactCodec):
+        version = 0x10
+
+        def encode(self, data, encoding="utf-8"):
+            return b"\x10" + super().encode(data, encoding)[1:]
+
+        def decode(self, byte_str, encoding="utf-8"):
+            return super().decode(b"\x01" + byte_str[1:], encoding)
+
+    codec = CustomCodec()
+    url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, codec=codec,
+        **DEFAULT_SETTINGS)
+
+    assert get_click_tracking_result(
+        url, codec=codec, **DEFAULT_SETTINGS).metadata == EXPECTED_METADATA
+    with pytest.raises(ValueError):
+        get_click_tracking_result(url, **DEFAULT_SETTINGS)
+
+
+def test_compact_tracking_urls():
+    configuration = Configuration(codec="compact", **DEFAULT_SETTINGS)
+
+    url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, configuration)
+    json_url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, **DEFAULT_SETTINGS)
+    assert len(url) < len(json_url)
+    assert not url.endswith("=")
+
+    for decoding_configuration in (configuration, Configuration(
+            **DEFAULT_SETTINGS)):
+        tracking_result = get_click_tracking_result(
+            url, configuration=decoding_configuration)
+        assert tracking_result.tracked_url == DEFAULT_URL_TO_TRACK
+        assert tracking_result.metadata == EXPECTED_METADATA
+
+    # Links encoded in JSON are still decoded
+    tracking_result = get_click_tracking_result(
+        json_url, configuration=configuration)
+    assert tracking_result.tracked_url == DEFAULT_URL_TO_TRACK
+
+    url = get_open_tracking_url(configuration=configuration)
+    assert get_open_tracking_result(
+        url, configuration=configuration).metadata ==\
+        DEFAULT_SETTINGS["default_metadata"]
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_open_tracking_url(codec="unknown", **DEFAULT_SETTINGS)
+
+
+def test_compression():
+    dictionary = get_compression_dictionary(
+        [{"url": DEFAULT_URL_TO_TRACK, "metadata": DEFAULT_METADATA}],
+        "compact")
+    byte_str = COMPACT_CODEC.encode(DEFAULT_DATA)
+
+    for compression_dictionary in (None, dictionary):
+        compressed = compress_data(byte_str, compression_dictionary)
+        assert compressed[0] == 0x02
+        assert decompress_data(compressed, compression_dictionary) ==\
+            byte_str
+        assert decode_data(
+            compressed, compression_dictionary=compression_dictionary) ==\
+            DEFAULT_DATA
+
+    assert len(compress_data(byte_str, dictionary)) <\
+        len(compress_data(byte_str))
+
+    with pytest.raises(ValueError):
+        decompress_data(compress_data(byte_str, dictionary))
+    with pytest.raises(ValueError):
+        decode_data(compress_data(byte_str)[:-2])
+    with pytest.raises(ValueError):
+        decode_data(compress_data(compress_data(byte_str)))
+
+
+def test_compression_bomb():
+    bomb = compress_data(b"{" + b" " * 10000000 + b"}")
+    assert len(bomb) < 20000
+
+    with pytest.raises(ValueError):
+        decode_data(bomb)
+    assert decode_data(bomb, max_decompressed_size=10000002) == {}
+
+
+def test_compressed_tracking_urls():
+    metadata = {"campaign_id": 1234, "recipient_id": 5678, "list_id": 9}
+    dictionary = get_compression_dictionary(
+        [{"url": DEFAULT_URL_TO_TRACK, "metadata": metadata}])
+    configuration = Configuration(
+        compress=True, compression_dictionary=dictionary, **DEFAULT_SETTINGS)
+
+    url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, dict(metadata, recipient_id=1),
+        configuration)
+    assert len(url) < len(get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, metadata, **DEFAULT_SETTINGS)) / 2
+
+    tracking_result = get_click_tracking_result(
+        url, configuration=configuration)
+    assert tracking_result.tracked_url == DEFAULT_URL_TO_TRACK
+    assert tracking_result.metadata["recipient_id"] == 1
+
+    # The dictionary is required to decompress
+    with pytest.raises(ValueError):
+        get_click_tracking_result(url, **DEFAULT_SETTINGS)
+
+    # Data that does not compress well is not compressed
+    url = get_open_tracking_url(configuration=configuration)
+    assert url == get_open_tracking_url(**DEFAULT_SETTINGS)
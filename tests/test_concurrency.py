@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+from pytracking.concurrency import (
+    BoundedExecutor, BACKPRESSURE_CALLER_RUNS, BACKPRESSURE_DROP,
+    BACKPRESSURE_DROP_OLDEST)
+from pytracking.metrics import REGISTRY
+
+
+def fill_executor(backpressure):
+    """Returns an executor whose single thread is blocked and whose queue
+    holds one task, an event releasing the thread and the list of the
+    results.
+    """
+    executor = BoundedExecutor(1, 1, backpressure)
+    release = threading.Event()
+    started = threading.Event()
+    results = []
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    executor.submit(block)
+    started.wait(5)
+    assert executor.submit(results.append, 1)
+    return (executor, release, results)
+
+
+@pytest.mark.parametrize("backpressure,accepted,expected,dropped", [
+    (BACKPRESSURE_DROP, False, [1], 1),
+    (BACKPRESSURE_DROP_OLDEST, True, [2], 1),
+    (BACKPRESSURE_CALLER_RUNS, True, [2, 1], 0),
+])
+def test_backpressure(backpressure, accepted, expected, dropped):
+    (executor, release, results) = fill_executor(backpressure)
+    assert executor.submit(results.append, 2) is accepted
+    release.set()
+    executor.join()
+    executor.shutdown()
+    assert results == expected
+    assert executor.dropped == dropped
+
+
+def test_errors_are_logged(caplog):
+    executor = BoundedExecutor()
+    executor.submit(lambda: 1 / 0)
+    executor.join()
+    executor.shutdown()
+    assert "Error in a background task" in caplog.text
+
+    with pytest.raises(ValueError):
+        BoundedExecutor(backpressure="unknown")
+
+
+def test_dropped_tasks_are_rate_limited(caplog):
+    (executor, release, results) = fill_executor(BACKPRESSURE_DROP)
+    REGISTRY.reset()
+    REGISTRY.enable()
+    try:
+        for _ in range(10):
+            assert not executor.submit(results.append, 2)
+        rendered = REGISTRY.render()
+    finally:
+        REGISTRY.disable()
+        REGISTRY.reset()
+    release.set()
+    executor.join()
+    executor.shutdown()
+    assert executor.dropped == 10
+    assert caplog.text.count("The queue of the executor is full") == 1
+    assert (
+        'pytracking_executor_dropped_tasks_total'
+        '{executor="pytracking-executor"} 10') in rendered
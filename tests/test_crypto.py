@@ -1,10 +1,12 @@
 import copy
 
+import pytest
+
 from pytracking import (
     Configuration, get_click_tracking_url, get_click_tracking_url_path,
     get_open_tracking_url_path,
     get_click_tracking_result, get_open_tracking_url,
-    get_open_tracking_result)
+    get_open_tracking_result, generate_tracking_urls)
 
 from cryptography.fernet import Fernet
 
@@ -123,3 +125,136 @@ def test_minimal_encrypted_get_click_tracking_url():
     assert tracking_result.metadata == expected_metadata
     assert tracking_result.is_click_tracking
     assert not tracking_result.is_open_tracking
+
+
+def test_encrypted_generate_tracking_urls():
+    configuration = Configuration(
+        base_open_tracking_url=DEFAULT_BASE_OPEN_TRACKING_URL,
+        base_click_tracking_url=DEFAULT_BASE_CLICK_TRACKING_URL,
+        encryption_bytestring_key=DEFAULT_ENCRYPTION_KEY)
+    metadata_list = [{"recipient_id": i} for i in range(20)]
+
+    tracking_urls = list(generate_tracking_urls(
+        [DEFAULT_URL_TO_TRACK], metadata_list, configuration, workers=3,
+        chunksize=4))
+
+    assert len(tracking_urls) == 20
+    for metadata, (open_url, click_urls) in zip(
+            metadata_list, tracking_urls):
+        open_result = get_open_tracking_result(
+            open_url, configuration=configuration)
+        click_result = get_click_tracking_result(
+            click_urls[0], configuration=configuration)
+        assert open_result.metadata == metadata
+        assert click_result.metadata == metadata
+        assert click_result.tracked_url == DEFAULT_URL_TO_TRACK
+
+
+def test_encrypted_frozen_configuration():
+    configuration = Configuration(
+        base_click_tracking_url=DEFAULT_BASE_CLICK_TRACKING_URL,
+        encryption_bytestring_key=DEFAULT_ENCRYPTION_KEY).freeze()
+    encryption_key = configuration.encryption_key
+
+    url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, configuration)
+    tracking_result = get_click_tracking_result(
+        url, configuration=configuration)
+
+    assert configuration.encryption_key is encryption_key
+    assert tracking_result.tracked_url == DEFAULT_URL_TO_TRACK
+    assert tracking_result.metadata == DEFAULT_METADATA
+
+
+def test_encrypted_compact_tracking_urls():
+    configuration = DEFAULT_CONFIGURATION.merge_with_kwargs(
+        {"encryption_bytestring_key": DEFAULT_ENCRYPTION_KEY,
+         "codec": "compact"})
+
+    url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, configuration=configuration)
+    json_url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA,
+        configuration=configuration, codec="json")
+    assert len(url) < len(json_url)
+
+    json_configuration = configuration.merge_with_kwargs({"codec": "json"})
+    for tracking_url in (url, json_url):
+        tracking_result = get_click_tracking_result(
+            tracking_url, configuration=json_configuration)
+        assert tracking_result.tracked_url == DEFAULT_URL_TO_TRACK
+        assert tracking_result.metadata["param1"] == "val1"
+
+
+def test_signed_and_encrypted_tracking_urls():
+    configuration = DEFAULT_CONFIGURATION.merge_with_kwargs(
+        {"encryption_bytestring_key": DEFAULT_ENCRYPTION_KEY,
+         "signing_key": b"signing key"})
+
+    encrypted_url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, configuration=configuration)
+    signed_url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, configuration=configuration,
+        sign_links=True)
+    assert len(signed_url) < len(encrypted_url)
+
+    # Encrypted links are still decoded once links are signed
+    configuration = configuration.merge_with_kwargs({"sign_links": True})
+    for tracking_url in (encrypted_url, signed_url):
+        tracking_result = get_click_tracking_result(
+            tracking_url, configuration=configuration)
+        assert tracking_result.tracked_url == DEFAULT_URL_TO_TRACK
+
+
+def test_encryption_key_ring():
+    old_key = Fernet.generate_key()
+    new_key = Fernet.generate_key()
+    legacy_url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA,
+        configuration=DEFAULT_CONFIGURATION,
+        encryption_bytestring_key=DEFAULT_ENCRYPTION_KEY)
+    old_url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA,
+        configuration=DEFAULT_CONFIGURATION,
+        encryption_key_ring=[("v1", old_key)])
+    assert old_url.startswith(DEFAULT_BASE_CLICK_TRACKING_URL + "kv1_g")
+
+    configuration = DEFAULT_CONFIGURATION.merge_with_kwargs({
+        "encryption_key_ring": [("v2", new_key), ("v1", old_key)],
+        "encryption_bytestring_key": DEFAULT_ENCRYPTION_KEY}).freeze()
+    new_url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, configuration=configuration)
+    assert new_url.startswith(DEFAULT_BASE_CLICK_TRACKING_URL + "kv2_g")
+
+    for tracking_url in (legacy_url, old_url, new_url):
+        tracking_result = get_click_tracking_result(
+            tracking_url, configuration=configuration)
+        assert tracking_result.tracked_url == DEFAULT_URL_TO_TRACK
+
+    # Only the key of the key ID is tried
+    for invalid_url in (
+            new_url.replace("kv2_", "kv1_"), new_url.replace("kv2_", "kv3_")):
+        with pytest.raises(Exception):
+            get_click_tracking_result(
+                invalid_url, configuration=configuration)
+
+
+def test_encryption_key_ring_rejects_plain_links():
+    configuration = DEFAULT_CONFIGURATION.merge_with_kwargs({
+        "encryption_key_ring": [("v1", Fernet.generate_key())]})
+    plain_url = get_click_tracking_url(
+        "http://evil.com", {"x": 1}, configuration=DEFAULT_CONFIGURATION)
+
+    with pytest.raises(ValueError):
+        get_click_tracking_result(plain_url, configuration=configuration)
+    with pytest.raises(ValueError):
+        get_click_tracking_result(
+            plain_url, configuration=configuration.freeze())
+
+
+def test_encryption_key_ring_invalid():
+    for key_ring in (
+            [("v_1", DEFAULT_ENCRYPTION_KEY)],
+            [("v1", DEFAULT_ENCRYPTION_KEY), ("v1", DEFAULT_ENCRYPTION_KEY)]):
+        with pytest.raises(ValueError):
+            Configuration(encryption_key_ring=key_ring)
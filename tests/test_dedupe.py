@@ -0,0 +1,81 @@
+from pytracking import TrackingResult
+from pytracking.dedupe import EventDeduplicator
+from pytracking.stats import TRACKED_URL_KEY
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def get_result(is_open=True, tracked_url=None, **metadata):
+    return TrackingResult(
+        is_open_tracking=is_open, is_click_tracking=not is_open,
+        tracked_url=tracked_url, metadata=metadata)
+
+
+def test_is_duplicate():
+    deduplicator = EventDeduplicator(["campaign", "recipient"])
+
+    assert not deduplicator.is_duplicate(get_result(campaign=1, recipient=1))
+    assert deduplicator.is_duplicate(
+        get_result(campaign=1, recipient=1, other="ignored"))
+    # The event type and each key field are part of the key.
+    assert not deduplicator.is_duplicate(
+        get_result(False, campaign=1, recipient=1))
+    assert not deduplicator.is_duplicate(get_result(campaign=1, recipient=2))
+    assert not deduplicator.is_duplicate(get_result(campaign=1))
+    # Unhashable values are supported.
+    assert not deduplicator.is_duplicate(get_result(campaign={"id": [1]}))
+    assert deduplicator.is_duplicate(get_result(campaign={"id": [1]}))
+
+    assert deduplicator.get_stats() == {
+        "duplicates": 2, "unique": 5, "size": 5}
+
+
+def test_missing_key_fields():
+    deduplicator = EventDeduplicator(["campaign", "recipient"])
+
+    assert not deduplicator.is_duplicate(get_result())
+    assert not deduplicator.is_duplicate(get_result(other=1))
+    assert deduplicator.get_stats() == {
+        "duplicates": 0, "unique": 2, "size": 0}
+
+
+def test_tracked_url_key():
+    deduplicator = EventDeduplicator(["recipient", TRACKED_URL_KEY])
+
+    assert not deduplicator.is_duplicate(
+        get_result(False, "https://a.com/", recipient=1))
+    assert not deduplicator.is_duplicate(
+        get_result(False, "https://b.com/", recipient=1))
+    assert deduplicator.is_duplicate(
+        get_result(False, "https://a.com/", recipient=1))
+
+
+def test_window_and_max_keys():
+    clock = FakeClock()
+    deduplicator = EventDeduplicator(
+        ["recipient"], window_seconds=10, clock=clock)
+
+    assert not deduplicator.is_duplicate(get_result(recipient=1))
+    clock.now = 15
+    # Remembered in the previous generation.
+    assert deduplicator.is_duplicate(get_result(recipient=1))
+    clock.now = 30
+    assert not deduplicator.is_duplicate(get_result(recipient=1))
+    # After a gap longer than two windows, both generations are forgotten.
+    clock.now = 100000
+    assert not deduplicator.is_duplicate(get_result(recipient=1))
+    assert deduplicator.get_stats()["size"] == 1
+
+    deduplicator = EventDeduplicator(["recipient"], max_keys=4, clock=clock)
+    for recipient in range(10):
+        assert not deduplicator.is_duplicate(get_result(recipient=recipient))
+    assert deduplicator.get_stats()["size"] <= 4
+    assert deduplicator.is_duplicate(get_result(recipient=9))
+    assert not deduplicator.is_duplicate(get_result(recipient=0))
@@ -1,19 +1,31 @@
+import asyncio
+import threading
+
 import pytest
 
 from pytracking import (
-    get_open_tracking_url, get_click_tracking_url, get_open_tracking_url_path,
-    get_click_tracking_url_path, TRACKING_PIXEL, PNG_MIME_TYPE)
+    FrozenConfiguration, get_open_tracking_url, get_click_tracking_url,
+    get_open_tracking_url_path, get_click_tracking_url_path, TRACKING_PIXEL,
+    PNG_MIME_TYPE)
 from .test_pytracking import (
     DEFAULT_BASE_OPEN_TRACKING_URL, DEFAULT_BASE_CLICK_TRACKING_URL,
     DEFAULT_METADATA, DEFAULT_WEBHOOK_URL, DEFAULT_DEFAULT_METADATA,
     DEFAULT_URL_TO_TRACK, EXPECTED_METADATA)
 
 # Must call configure before importing tracking_django
+import django
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.http import Http404
 settings.configure()
 
 import pytracking.django as tracking_django
+from pytracking.classifier import EventClassifier
+from pytracking.concurrency import BACKPRESSURE_BLOCK
+
+
+requires_async_views = pytest.mark.skipif(
+    django.VERSION < (3, 1), reason="Async views require Django 3.1")
 
 
 DEFAULT_ENCODED_URL_TO_TRACK =\
@@ -70,6 +82,34 @@ def test_get_tracking_result(setup_django):
     assert tracking_result.metadata == EXPECTED_METADATA
 
 
+def test_get_configuration_from_settings(setup_django):
+    configuration = tracking_django.get_configuration_from_settings()
+    assert not isinstance(configuration, FrozenConfiguration)
+    configuration.webhook_url = "https://other.com/"
+    assert tracking_django.get_configuration_from_settings().webhook_url ==\
+        DEFAULT_WEBHOOK_URL
+
+
+def test_get_frozen_configuration_from_settings(setup_django):
+    from django.test import override_settings
+
+    get_frozen_configuration =\
+        tracking_django.get_frozen_configuration_from_settings
+    configuration = get_frozen_configuration()
+    assert configuration.frozen
+    assert get_frozen_configuration() is configuration
+
+    with override_settings(PYTRACKING_CONFIGURATION=dict(
+            DEFAULT_SETTINGS, webhook_url="https://other.com/")):
+        overridden = get_frozen_configuration()
+        assert overridden.webhook_url == "https://other.com/"
+
+    settings.PYTRACKING_CONFIGURATION = dict(DEFAULT_SETTINGS)
+    replaced = get_frozen_configuration()
+    assert replaced is not configuration
+    assert replaced.webhook_url == DEFAULT_WEBHOOK_URL
+
+
 def test_valid_click_tracking_view(setup_django):
     result_metadata = {}
     request_data = {}
@@ -229,3 +269,141 @@ def test_invalid_open_tracking_view(setup_django):
     assert not result_metadata
     assert not request_data
     assert request_path[0].endswith("bbb")
+
+
+def run_async_view(view_class, request, path):
+    view = view_class.as_view()
+    assert asyncio.iscoroutinefunction(view)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(view(request, path))
+    finally:
+        loop.close()
+
+
+def test_async_tracking_view_django_version(monkeypatch):
+    monkeypatch.setattr(django, "VERSION", (2, 2, 0, "final", 0))
+    with pytest.raises(ImproperlyConfigured):
+        tracking_django.AsyncOpenTrackingView.as_view()
+
+
+@requires_async_views
+def test_async_open_tracking_view(setup_django, monkeypatch):
+    request_data = {}
+    release = threading.Event()
+    decoding_threads = []
+    original_get_tracking_result = tracking_django.get_tracking_result
+
+    def get_tracking_result(*args):
+        decoding_threads.append(threading.current_thread())
+        return original_get_tracking_result(*args)
+
+    # The link is not decoded on the event loop.
+    monkeypatch.setattr(
+        tracking_django, "get_tracking_result", get_tracking_result)
+
+    class TestOpenView(tracking_django.AsyncOpenTrackingView):
+
+        def notify_tracking_event(self, tracking_result):
+            # The response must not wait for the notification.
+            release.wait(5)
+            request_data.update(tracking_result.request_data)
+
+    configuration = tracking_django.get_configuration_from_settings()
+
+    url = get_open_tracking_url(
+        metadata=DEFAULT_METADATA, configuration=configuration)
+    path = get_open_tracking_url_path(url, configuration=configuration)
+
+    request = FakeDjangoRequest()
+    request.META["HTTP_X_REAL_IP"] = "10.10.240.22"
+    request.META["HTTP_USER_AGENT"] = "Firefox"
+
+    response = run_async_view(TestOpenView, request, path)
+    assert response.status_code == 200
+    assert response.content == TRACKING_PIXEL
+    assert not request_data
+    assert decoding_threads[0] is not threading.current_thread()
+
+    release.set()
+    TestOpenView.get_notification_executor().join()
+    assert request_data ==\
+        {"user_agent": "Firefox", "user_ip": "10.10.240.22"}
+
+
+@requires_async_views
+def test_async_click_tracking_view(setup_django):
+    results = []
+    request_path = []
+
+    class TestClickView(tracking_django.AsyncClickTrackingView):
+
+        notification_backpressure = BACKPRESSURE_BLOCK
+
+        def notify_decoding_error(self, error, request):
+            request_path.append(request.path)
+
+        def notify_tracking_event(self, tracking_result):
+            results.append(tracking_result)
+
+    configuration = tracking_django.get_configuration_from_settings()
+
+    url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, metadata=DEFAULT_METADATA,
+        configuration=configuration)
+    path = get_click_tracking_url_path(url, configuration=configuration)
+
+    response = run_async_view(TestClickView, FakeDjangoRequest(), path)
+    assert response.status_code == 302
+    assert response["Location"] == DEFAULT_ENCODED_URL_TO_TRACK
+
+    request = FakeDjangoRequest()
+    request.path = "bbb" + path
+    with pytest.raises(Http404):
+        run_async_view(TestClickView, request, "bbb" + path)
+
+    executor = TestClickView.get_notification_executor()
+    assert executor.backpressure == BACKPRESSURE_BLOCK
+    executor.join()
+    assert results[0].metadata == EXPECTED_METADATA
+    assert request_path[0].startswith("bbb")
+
+
+def test_tracking_view_drop_machine_events(setup_django):
+    results = []
+
+    class TestOpenView(tracking_django.OpenTrackingView):
+
+        classifier = EventClassifier()
+
+        drop_machine_events = True
+
+        def notify_tracking_event(self, tracking_result):
+            results.append(tracking_result)
+
+    configuration = tracking_django.get_configuration_from_settings()
+    url = get_open_tracking_url(configuration=configuration)
+    path = get_open_tracking_url_path(url, configuration=configuration)
+
+    request = FakeDjangoRequest()
+    request.META["HTTP_USER_AGENT"] = "Firefox"
+    assert TestOpenView.as_view()(request, path).status_code == 200
+    assert not results[0].classification.is_machine
+
+    request.META["HTTP_USER_AGENT"] = "curl/8.0"
+    assert TestOpenView.as_view()(request, path).status_code == 200
+    assert len(results) == 1
+
+
+def test_metrics_view():
+    from pytracking.metrics import REGISTRY
+
+    REGISTRY.enable()
+    try:
+        REGISTRY.inc("pytracking_test_total")
+        response = tracking_django.metrics_view(FakeDjangoRequest())
+    finally:
+        REGISTRY.disable()
+        REGISTRY.reset()
+    assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert b"pytracking_test_total 1" in response.content
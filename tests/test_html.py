@@ -6,8 +6,12 @@ from .test_pytracking import (
     DEFAULT_BASE_OPEN_TRACKING_URL, DEFAULT_BASE_CLICK_TRACKING_URL,
     DEFAULT_METADATA, DEFAULT_WEBHOOK_URL, DEFAULT_DEFAULT_METADATA,
     EXPECTED_METADATA)
+from .test_store import CountingStore
+
+import io
 
 from lxml import html
+import pytest
 import pytracking.html as tracking_html
 
 TEST_HTML_EMAIL = """
@@ -34,6 +38,24 @@ TEST_HTML_EMAIL = """
 </html>
 """
 
+TEST_HTML_EMAIL_OUTLOOK = """<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+"http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=UTF-8" />
+<style>a > b { color: "red"; }</style>
+<!--[if gte mso 9]><xml><o:OfficeDocumentSettings></o:OfficeDocumentSettings>
+</xml><![endif]-->
+</head>
+<body style="margin:0">
+<table width="100%"><tr><td><o:p class="x">Caf&eacute; &amp; <b>th&eacute;</b>
+</o:p></td></tr>
+<tr><td><a href="https://www.example.com/?a=1&amp;b=2" title='"quoted"'>A</a>
+<br><ul><li></li><li><!-- comment --></li></ul></td></tr></table>
+<script>if (a < b && c) { d = "</b>"; }</script>
+</body>
+</html>
+"""
 
 DEFAULT_SETTINGS = {
     "webhook_url": DEFAULT_WEBHOOK_URL,
@@ -84,6 +106,176 @@ def test_adapt_html_open_only():
     assert links[2].attrib["href"] == "http://www.domain2.com"
 
 
+def test_adapt_html_profile():
+    profiles = []
+    html_text = TEST_HTML_EMAIL.replace(
+        "</body>", '<a href="http://www.domain2.com">Again</a></body>')
+    new_html = tracking_html.adapt_html(
+        html_text, DEFAULT_METADATA, profile_callback=profiles.append,
+        **DEFAULT_SETTINGS)
+
+    assert new_html == tracking_html.adapt_html(
+        html_text, DEFAULT_METADATA, **DEFAULT_SETTINGS)
+    (profile,) = profiles
+    assert [phase.name for phase in profile.phases] == [
+        "parse", "links", "pixel", "serialize"]
+    assert all(phase.seconds >= 0 for phase in profile.phases)
+    assert all(
+        isinstance(phase.allocated_blocks, int) for phase in profile.phases)
+    assert profile.links_rewritten == 3
+    assert profile.unique_urls == 2
+
+    tracking_html.adapt_html(
+        html_text, DEFAULT_METADATA, click_tracking=False,
+        profile_callback=profiles.append, **DEFAULT_SETTINGS)
+    assert [phase.name for phase in profiles[1].phases] == [
+        "parse", "pixel", "serialize"]
+    assert profiles[1].links_rewritten == 0
+
+
+def test_compile_template():
+    compiled_template = tracking_html.compile_template(
+        TEST_HTML_EMAIL, **DEFAULT_SETTINGS)
+
+    for metadata in ({"recipient_id": 1}, {"recipient_id": 2}):
+        assert compiled_template.render(metadata) ==\
+            tracking_html.adapt_html(
+                TEST_HTML_EMAIL, metadata, **DEFAULT_SETTINGS)
+
+    new_html = compiled_template.render(DEFAULT_METADATA)
+    tree = html.fromstring(new_html)
+    _test_open_tracking(tree)
+    _test_click_tracking(tree)
+
+
+def test_compile_template_options():
+    settings = dict(
+        DEFAULT_SETTINGS,
+        base_click_tracking_url="https://a.b.com/track&click/")
+
+    for click_tracking, open_tracking in (
+            (True, False), (False, True), (False, False)):
+        compiled_template = tracking_html.compile_template(
+            TEST_HTML_EMAIL.encode("utf-8"), click_tracking=click_tracking,
+            open_tracking=open_tracking, **settings)
+        assert compiled_template.render(DEFAULT_METADATA) ==\
+            tracking_html.adapt_html(
+                TEST_HTML_EMAIL.encode("utf-8"), DEFAULT_METADATA,
+                click_tracking=click_tracking, open_tracking=open_tracking,
+                **settings)
+
+
+def test_compile_template_cache():
+    tracking_html.template_cache.clear()
+
+    first_template = tracking_html.compile_template(
+        TEST_HTML_EMAIL, **DEFAULT_SETTINGS)
+    second_template = tracking_html.compile_template(
+        TEST_HTML_EMAIL, webhook_url="http://other.com/")
+    tracking_html.compile_template(
+        TEST_HTML_EMAIL, open_tracking=False, **DEFAULT_SETTINGS)
+
+    assert first_template.structure is second_template.structure
+    assert len(tracking_html.template_cache) == 2
+
+
+def test_compile_template_token_store():
+    token_store = CountingStore()
+    settings = dict(
+        DEFAULT_SETTINGS, token_store=token_store, signing_key=b"key")
+    compiled_template = tracking_html.compile_template(
+        TEST_HTML_EMAIL, **settings)
+
+    for new_html in (
+            compiled_template.render(DEFAULT_METADATA),
+            tracking_html.adapt_html(
+                TEST_HTML_EMAIL, DEFAULT_METADATA, **settings)):
+        tree = html.fromstring(new_html)
+        links = tree.xpath("//a")
+        click_result = get_click_tracking_result(
+            links[2].attrib["href"], **settings)
+        assert click_result.tracked_url == "http://www.domain2.com"
+        open_result = get_open_tracking_result(
+            tree.xpath("//img")[-1].attrib["src"], **settings)
+        assert open_result.metadata == EXPECTED_METADATA
+
+    # One insert for the template, two for adapt_html (links and pixel)
+    assert token_store.insert_calls == 3
+
+
+def test_adapt_html_stream():
+    for html_text in (TEST_HTML_EMAIL, TEST_HTML_EMAIL_OUTLOOK):
+        expected_html = tracking_html.adapt_html(
+            html_text, DEFAULT_METADATA, **DEFAULT_SETTINGS)
+
+        for chunk_size in (1, 7, 64, 100000):
+            chunks = [
+                html_text[index:index + chunk_size]
+                for index in range(0, len(html_text), chunk_size)]
+            new_html = "".join(tracking_html.adapt_html_stream(
+                chunks, DEFAULT_METADATA, **DEFAULT_SETTINGS))
+            assert new_html == expected_html
+
+
+def test_adapt_html_stream_fragments():
+    # Documents that do not start with <html> or <!DOCTYPE>
+    for html_text in (
+            "<head><title>T</title></head><body><p>x</p></body>",
+            "<title>T</title><p>x <a href='http://x.com'>x</a></p>"):
+        expected_html = tracking_html.adapt_html(
+            html_text, DEFAULT_METADATA, **DEFAULT_SETTINGS)
+        for chunk_size in (1, 100000):
+            chunks = [
+                html_text[index:index + chunk_size]
+                for index in range(0, len(html_text), chunk_size)]
+            assert "".join(tracking_html.adapt_html_stream(
+                chunks, DEFAULT_METADATA, **DEFAULT_SETTINGS)) ==\
+                expected_html
+
+    # adapt_html returns fragments without a pixel
+    for html_text in (
+            "<p>fragment <a href='http://x.com'>x</a></p>",
+            "<p>a</p><p>b</p>", "  <body><p>x</p></body>"):
+        for chunk_size in (1, 100000):
+            chunks = [
+                html_text[index:index + chunk_size]
+                for index in range(0, len(html_text), chunk_size)]
+            with pytest.raises(ValueError):
+                "".join(tracking_html.adapt_html_stream(
+                    chunks, DEFAULT_METADATA, **DEFAULT_SETTINGS))
+
+
+def test_adapt_html_stream_file():
+    html_bytes = TEST_HTML_EMAIL_OUTLOOK.encode("utf-8")
+
+    for click_tracking, open_tracking in (
+            (True, True), (True, False), (False, True)):
+        expected_html = tracking_html.adapt_html(
+            html_bytes, DEFAULT_METADATA, click_tracking=click_tracking,
+            open_tracking=open_tracking, **DEFAULT_SETTINGS)
+        chunks = list(tracking_html.adapt_html_stream(
+            io.BytesIO(html_bytes), DEFAULT_METADATA,
+            click_tracking=click_tracking, open_tracking=open_tracking,
+            read_size=32, **DEFAULT_SETTINGS))
+
+        assert len(chunks) > 1
+        assert "".join(chunks) == expected_html
+
+
+def test_render_campaign():
+    metadata_list = [{"recipient_id": index} for index in range(25)]
+
+    for workers in (1, 2):
+        rendered_htmls = list(tracking_html.render_campaign(
+            TEST_HTML_EMAIL, iter(metadata_list), workers=workers,
+            chunksize=4, **DEFAULT_SETTINGS))
+
+        assert rendered_htmls == [
+            tracking_html.adapt_html(
+                TEST_HTML_EMAIL, metadata, **DEFAULT_SETTINGS)
+            for metadata in metadata_list]
+
+
 def _test_click_tracking(tree):
     links = tree.xpath("//a")
     first_link_url_path = get_click_tracking_url_path(
@@ -0,0 +1,121 @@
+import threading
+
+import pytest
+
+from pytracking import (
+    Configuration, get_click_tracking_result, get_click_tracking_url)
+from pytracking.html import adapt_html
+from pytracking.metrics import (
+    MetricsRegistry, REGISTRY, NULL_PHASE_TIMER, make_wsgi_app)
+from pytracking.webhook import send_webhook
+
+from .test_pytracking import (
+    DEFAULT_BASE_CLICK_TRACKING_URL, DEFAULT_URL_TO_TRACK,
+    DEFAULT_WEBHOOK_URL)
+
+
+class FakeResponse(object):
+
+    def __init__(self, ok):
+        self.ok = ok
+
+
+class FakeClient(object):
+
+    def __init__(self, ok=True):
+        self.ok = ok
+
+    def post(self, url, json, timeout):
+        if self.ok is None:
+            raise ConnectionError("refused")
+        return FakeResponse(self.ok)
+
+
+@pytest.fixture
+def registry():
+    REGISTRY.reset()
+    REGISTRY.enable()
+    yield REGISTRY
+    REGISTRY.disable()
+    REGISTRY.reset()
+
+
+def test_disabled_registry():
+    registry = MetricsRegistry()
+    registry.inc("pytracking_x_total")
+    registry.observe("pytracking_x_seconds", 0.1)
+    assert registry.get_phase_timer("pytracking_x_seconds") is\
+        NULL_PHASE_TIMER
+    assert registry.render() == ""
+
+
+def test_render():
+    registry = MetricsRegistry(enabled=True, buckets=(0.1, 1.0))
+    registry.inc("pytracking_x_total", (("type", 'a"b'),))
+    registry.inc("pytracking_x_total", (("type", 'a"b'),), 2)
+
+    def observe():
+        registry.observe("pytracking_y_seconds", 0.5)
+        registry.observe("pytracking_y_seconds", 5)
+
+    # The measurements of each thread, including exited ones, are merged.
+    thread = threading.Thread(target=observe)
+    thread.start()
+    thread.join()
+    registry.observe("pytracking_y_seconds", 0.1)
+
+    assert registry.render() == (
+        "# TYPE pytracking_x_total counter\n"
+        'pytracking_x_total{type="a\\"b"} 3\n'
+        "# TYPE pytracking_y_seconds histogram\n"
+        'pytracking_y_seconds_bucket{le="0.1"} 1\n'
+        'pytracking_y_seconds_bucket{le="1.0"} 2\n'
+        'pytracking_y_seconds_bucket{le="+Inf"} 3\n'
+        "pytracking_y_seconds_sum 5.6\n"
+        "pytracking_y_seconds_count 3\n")
+
+    registry.reset()
+    assert registry.render() == ""
+
+
+def test_instrumentation(registry):
+    configuration = Configuration(
+        base_click_tracking_url=DEFAULT_BASE_CLICK_TRACKING_URL,
+        webhook_url=DEFAULT_WEBHOOK_URL)
+    url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, configuration=configuration)
+    tracking_result = get_click_tracking_result(
+        url, configuration=configuration)
+    with pytest.raises(ValueError):
+        get_click_tracking_result(
+            DEFAULT_BASE_CLICK_TRACKING_URL + "invalid",
+            configuration=configuration)
+
+    adapt_html(
+        '<html><body><a href="https://a.com/">A</a></body></html>', {},
+        configuration=configuration)
+
+    send_webhook(tracking_result, client=FakeClient())
+    send_webhook(tracking_result, client=FakeClient(False))
+    with pytest.raises(ConnectionError):
+        send_webhook(tracking_result, client=FakeClient(None))
+
+    text = registry.render()
+    for line in (
+            "pytracking_encode_seconds_count 3",
+            'pytracking_decode_seconds_count{phase="decrypt"} 2',
+            'pytracking_decode_seconds_count{phase="deserialize"} 1',
+            'pytracking_tracking_results_total{type="click"} 1',
+            'pytracking_decoding_errors_total{exception="ValueError"} 1',
+            'pytracking_adapt_html_seconds_count{phase="parse"} 1',
+            'pytracking_adapt_html_seconds_count{phase="serialize"} 1',
+            'pytracking_webhook_seconds_count{outcome="success"} 1',
+            'pytracking_webhook_seconds_count{outcome="http_error"} 1',
+            'pytracking_webhook_seconds_count{outcome="error"} 1'):
+        assert line in text
+
+    body = []
+    app = make_wsgi_app(registry)
+    assert app({}, lambda status, headers: body.append(status)) == [
+        text.encode("utf-8")]
+    assert body == ["200 OK"]
@@ -1,8 +1,14 @@
+import pickle
+import subprocess
+import sys
+
+import pytest
+
 from pytracking import (
-    Configuration, get_click_tracking_url, get_click_tracking_url_path,
-    get_open_tracking_url_path,
+    Configuration, FrozenConfiguration, get_click_tracking_url,
+    get_click_tracking_url_path, get_open_tracking_url_path,
     get_click_tracking_result, get_open_tracking_pixel, get_open_tracking_url,
-    get_open_tracking_result)
+    get_open_tracking_result, generate_tracking_urls)
 
 
 DEFAULT_URL_TO_TRACK = "https://www.bob.com/hello-world/?token=valueééé"
@@ -42,6 +48,13 @@ DEFAULT_CONFIGURATION = Configuration(
     base_click_tracking_url=DEFAULT_BASE_CLICK_TRACKING_URL,
     default_metadata=DEFAULT_DEFAULT_METADATA)
 
+DEFAULT_SETTINGS = {
+    "webhook_url": DEFAULT_WEBHOOK_URL,
+    "base_open_tracking_url": DEFAULT_BASE_OPEN_TRACKING_URL,
+    "base_click_tracking_url": DEFAULT_BASE_CLICK_TRACKING_URL,
+    "default_metadata": DEFAULT_DEFAULT_METADATA
+}
+
 
 def test_get_open_tracking_pixel():
     (pixel, mime) = get_open_tracking_pixel()
@@ -212,3 +225,124 @@ def test_embedded_click_tracking_url():
     assert tracking_result.metadata == EXPECTED_METADATA
     assert tracking_result.is_click_tracking
     assert not tracking_result.is_open_tracking
+
+
+def test_generate_tracking_urls():
+    urls_to_track = [DEFAULT_URL_TO_TRACK, "http://www.example.com/"]
+    metadata_list = [{"recipient_id": i} for i in range(5)]
+
+    tracking_urls = list(generate_tracking_urls(
+        urls_to_track, iter(metadata_list),
+        configuration=DEFAULT_CONFIGURATION, chunksize=2))
+
+    assert len(tracking_urls) == 5
+    for metadata, (open_url, click_urls) in zip(
+            metadata_list, tracking_urls):
+        assert open_url == get_open_tracking_url(
+            metadata, configuration=DEFAULT_CONFIGURATION)
+        assert click_urls == [
+            get_click_tracking_url(
+                url, metadata, configuration=DEFAULT_CONFIGURATION)
+            for url in urls_to_track]
+
+
+def test_generate_tracking_urls_workers():
+    metadata_list = [{"recipient_id": i} for i in range(50)]
+
+    tracking_urls = list(generate_tracking_urls(
+        [DEFAULT_URL_TO_TRACK], metadata_list, open_tracking=False,
+        workers=4, chunksize=3, **DEFAULT_SETTINGS))
+
+    assert len(tracking_urls) == 50
+    for metadata, (open_url, click_urls) in zip(
+            metadata_list, tracking_urls):
+        assert open_url is None
+        tracking_result = get_click_tracking_result(
+            click_urls[0], **DEFAULT_SETTINGS)
+        assert tracking_result.tracked_url == DEFAULT_URL_TO_TRACK
+        assert tracking_result.metadata["recipient_id"] ==\
+            metadata["recipient_id"]
+
+
+def test_frozen_configuration():
+    configuration = DEFAULT_CONFIGURATION.freeze()
+
+    assert isinstance(configuration, FrozenConfiguration)
+    assert configuration.merge_with_kwargs({}) is configuration
+    assert configuration.merge_with_kwargs({"unknown": 1}) is configuration
+
+    with pytest.raises(AttributeError):
+        configuration.webhook_url = "http://other.com/"
+
+    url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, configuration)
+    assert url == get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, DEFAULT_CONFIGURATION)
+
+    tracking_result = get_click_tracking_result(
+        url, configuration=configuration)
+    assert tracking_result.tracked_url == DEFAULT_URL_TO_TRACK
+    assert tracking_result.metadata == EXPECTED_METADATA
+    assert tracking_result.webhook_url == DEFAULT_WEBHOOK_URL
+
+
+def test_frozen_configuration_merge_cache():
+    configuration = FrozenConfiguration(merge_cache_size=2, **DEFAULT_SETTINGS)
+
+    derived = configuration.merge_with_kwargs(
+        {"append_slash": True, "default_metadata": {"a": [1, 2]}})
+    assert derived is not configuration
+    assert derived.append_slash
+    assert derived.default_metadata == {"a": [1, 2]}
+    assert derived.webhook_url == DEFAULT_WEBHOOK_URL
+    assert derived is configuration.merge_with_kwargs(
+        {"default_metadata": {"a": [1, 2]}, "append_slash": True})
+
+    url = get_open_tracking_url(configuration=configuration, append_slash=True)
+    assert url == "https://a.b.com/tracking/open/e30=/"
+
+    configuration.merge_with_kwargs({"webhook_url": "http://1.com/"})
+    configuration.merge_with_kwargs({"webhook_url": "http://2.com/"})
+    assert len(configuration.merge_cache) == 2
+    assert derived is not configuration.merge_with_kwargs(
+        {"default_metadata": {"a": [1, 2]}, "append_slash": True})
+
+
+def test_frozen_configuration_url_prefix():
+    configuration = FrozenConfiguration(
+        base_open_tracking_url="https://a.b.com/tracking/open",
+        base_click_tracking_url="https://a.b.com")
+
+    assert get_open_tracking_url(configuration=configuration) ==\
+        get_open_tracking_url(
+            base_open_tracking_url="https://a.b.com/tracking/open")
+    assert get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, configuration=configuration) ==\
+        get_click_tracking_url(
+            DEFAULT_URL_TO_TRACK, base_click_tracking_url="https://a.b.com")
+
+
+def test_frozen_configuration_pickle():
+    configuration = DEFAULT_CONFIGURATION.freeze()
+    configuration.merge_with_kwargs({"append_slash": True})
+
+    unpickled = pickle.loads(pickle.dumps(configuration))
+
+    assert unpickled.webhook_url == DEFAULT_WEBHOOK_URL
+    assert len(unpickled.merge_cache) == 0
+    with pytest.raises(AttributeError):
+        unpickled.webhook_url = "http://other.com/"
+
+
+def test_lazy_imports():
+    # Decoding plain links does not import the optional dependencies.
+    output = subprocess.check_output([
+        sys.executable, "-c",
+        "import sys, pytracking, pytracking.wsgi\n"
+        "pytracking.get_open_tracking_result(pytracking.get_open_tracking_url("
+        "{'a': 1}, base_open_tracking_url='https://a.com/'), "
+        "base_open_tracking_url='https://a.com/')\n"
+        "print(' '.join(sorted(name for name in sys.modules if name in ("
+        "'cryptography', 'lxml', 'requests', 'sqlite3'))))"],
+        universal_newlines=True)
+    assert output.strip() == ""
@@ -0,0 +1,77 @@
+import pytest
+
+from pytracking import (
+    Configuration, get_click_tracking_result, get_click_tracking_url)
+from pytracking.signing import (
+    decode_signed_token, encode_signed_token, sign, verify)
+from .test_pytracking import (
+    DEFAULT_METADATA, DEFAULT_SETTINGS, DEFAULT_URL_TO_TRACK,
+    EXPECTED_METADATA)
+
+
+DEFAULT_SIGNING_KEY = b"signing key"
+
+
+def _tamper(token, index):
+    replacement = "B" if token[index] != "B" else "C"
+    return token[:index] + replacement + token[index + 1:]
+
+
+def test_sign():
+    signature = sign(b"data", DEFAULT_SIGNING_KEY)
+
+    assert len(signature) == 8
+    assert verify(b"data", signature, DEFAULT_SIGNING_KEY)
+    assert not verify(b"datb", signature, DEFAULT_SIGNING_KEY)
+    assert not verify(b"data", signature, b"other key")
+    assert not verify(b"data", signature, DEFAULT_SIGNING_KEY, b"h")
+
+
+def test_signed_token():
+    token = encode_signed_token(b"\x01payload", DEFAULT_SIGNING_KEY)
+
+    assert token.startswith("h")
+    assert decode_signed_token(token, DEFAULT_SIGNING_KEY) == b"\x01payload"
+
+    for invalid in ("e30=", "h", _tamper(token, 1), _tamper(token, 5)):
+        with pytest.raises(ValueError):
+            decode_signed_token(invalid, DEFAULT_SIGNING_KEY)
+    # A signature of another kind of token is not valid
+    with pytest.raises(ValueError):
+        decode_signed_token(
+            "s" + token[1:], DEFAULT_SIGNING_KEY, prefix="s")
+
+
+def test_signed_tracking_urls():
+    configuration = Configuration(
+        sign_links=True, signing_key=DEFAULT_SIGNING_KEY, codec="compact",
+        **DEFAULT_SETTINGS)
+
+    url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, configuration)
+    path = url[len(DEFAULT_SETTINGS["base_click_tracking_url"]):]
+    assert path.startswith("h")
+
+    tracking_result = get_click_tracking_result(
+        url, configuration=configuration)
+    assert tracking_result.tracked_url == DEFAULT_URL_TO_TRACK
+    assert tracking_result.metadata == EXPECTED_METADATA
+
+    # Signed links are decoded by configurations that do not sign links
+    assert get_click_tracking_result(
+        url, signing_key=DEFAULT_SIGNING_KEY,
+        **DEFAULT_SETTINGS).tracked_url == DEFAULT_URL_TO_TRACK
+
+    with pytest.raises(ValueError):
+        get_click_tracking_result(
+            _tamper(url, len(url) - len(path) + 3),
+            configuration=configuration)
+    with pytest.raises(ValueError):
+        get_click_tracking_result(
+            url, configuration=configuration, signing_key=b"other key")
+
+    # Unsigned links are rejected
+    unsigned_url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, **DEFAULT_SETTINGS)
+    with pytest.raises(ValueError):
+        get_click_tracking_result(unsigned_url, configuration=configuration)
@@ -0,0 +1,190 @@
+import os
+import time
+
+import pytest
+
+from pytracking import TrackingResult
+from .test_pytracking import DEFAULT_METADATA, DEFAULT_URL_TO_TRACK
+
+from pytracking.spool import (
+    SpoolDrainer, WebhookSpool, get_segment_names, main, replay)
+
+
+DEFAULT_WEBHOOK_URL = "https://www.example.com/webhook/"
+
+
+def _get_tracking_result(index, timestamp=1389177318):
+    return TrackingResult(
+        is_click_tracking=True, tracked_url=DEFAULT_URL_TO_TRACK,
+        webhook_url=DEFAULT_WEBHOOK_URL,
+        metadata=dict(DEFAULT_METADATA, index=index), timestamp=timestamp)
+
+
+def _get_indexes(tracking_results):
+    return [
+        tracking_result.metadata["index"]
+        for tracking_result in tracking_results]
+
+
+def test_spool_drain(tmpdir):
+    directory = str(tmpdir)
+    sent = []
+
+    with WebhookSpool(directory, segment_max_bytes=1000) as spool:
+        for index in range(20):
+            spool.append(_get_tracking_result(index))
+
+    assert len(get_segment_names(directory)) > 1
+
+    drainer = SpoolDrainer(directory, send=sent.append, batch_size=3)
+    assert drainer.drain() == 20
+    assert _get_indexes(sent) == list(range(20))
+    assert sent[0].to_json_dict() == _get_tracking_result(0).to_json_dict()
+
+    # Only new records are sent
+    assert drainer.drain() == 0
+    with WebhookSpool(directory) as spool:
+        spool.append(_get_tracking_result(20))
+    assert SpoolDrainer(directory, send=sent.append).drain() == 1
+    assert _get_indexes(sent) == list(range(21))
+
+
+def test_spool_drain_failure(tmpdir):
+    directory = str(tmpdir)
+    sent = []
+
+    def send(tracking_result):
+        if tracking_result.metadata["index"] == 3 and not failed:
+            failed.append(True)
+            raise IOError("Webhook is down")
+        sent.append(tracking_result)
+
+    failed = []
+    with WebhookSpool(directory) as spool:
+        for index in range(5):
+            spool.append(_get_tracking_result(index))
+
+    drainer = SpoolDrainer(directory, send=send)
+    try:
+        drainer.drain()
+    except IOError:
+        pass
+    assert _get_indexes(sent) == [0, 1, 2]
+
+    assert drainer.drain() == 2
+    assert _get_indexes(sent) == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_spool_fork(tmpdir):
+    directory = str(tmpdir)
+    spool = WebhookSpool(directory, fsync_max_records=1)
+    spool.append(_get_tracking_result(0))
+
+    pid = os.fork()
+    if pid == 0:
+        # The child process starts its own segment and sync thread.
+        status = 1
+        try:
+            spool.append(_get_tracking_result(1))
+            deadline = time.time() + 5
+            while spool.unsynced_count and time.time() < deadline:
+                time.sleep(0.01)
+            if spool.sync_thread.is_alive() and not spool.unsynced_count:
+                status = 0
+            spool.close()
+        finally:
+            os._exit(status)
+
+    (_, status) = os.waitpid(pid, 0)
+    spool.close()
+    assert status == 0
+
+    sent = []
+    assert SpoolDrainer(directory, send=sent.append).drain() == 2
+    assert sorted(_get_indexes(sent)) == [0, 1]
+
+
+def test_spool_partial_record(tmpdir):
+    directory = str(tmpdir)
+    sent = []
+
+    spool = WebhookSpool(directory)
+    spool.append(_get_tracking_result(0))
+    spool.sync()
+    # Simulates a record being written
+    os.write(spool.fd, b'{"spooled_at": ')
+
+    drainer = SpoolDrainer(directory, send=sent.append)
+    assert drainer.drain() == 1
+    assert drainer.drain() == 0
+    spool.close()
+
+
+def test_spool_rate(tmpdir):
+    directory = str(tmpdir)
+    sent = []
+
+    with WebhookSpool(directory) as spool:
+        for index in range(5):
+            spool.append(_get_tracking_result(index))
+
+    start = time.monotonic()
+    SpoolDrainer(directory, send=sent.append, max_rate=100).drain()
+
+    assert len(sent) == 5
+    assert time.monotonic() - start >= 0.04
+
+
+def test_spool_replay(tmpdir):
+    directory = str(tmpdir)
+    sent = []
+
+    with WebhookSpool(directory) as spool:
+        for index in range(10):
+            spool.append(_get_tracking_result(index, timestamp=1000 + index))
+
+    drainer = SpoolDrainer(directory, send=lambda tracking_result: None)
+    drainer.drain()
+    checkpoint = drainer.get_checkpoint()
+
+    assert replay(directory, 1003, 1006, send=sent.append) == 3
+    assert _get_indexes(sent) == [3, 4, 5]
+    assert drainer.get_checkpoint() == checkpoint
+
+
+def test_spool_purge(tmpdir):
+    directory = str(tmpdir)
+
+    with WebhookSpool(directory) as spool:
+        spool.append(_get_tracking_result(0))
+    with WebhookSpool(directory) as spool:
+        spool.append(_get_tracking_result(1))
+
+    drainer = SpoolDrainer(directory, send=lambda tracking_result: None)
+    assert drainer.purge(older_than_seconds=0) == []
+
+    drainer.drain()
+    names = get_segment_names(directory)
+    assert drainer.purge(older_than_seconds=3600) == []
+    assert drainer.purge(older_than_seconds=0) == names
+    assert get_segment_names(directory) == []
+
+
+def test_spool_command_line(tmpdir, capsys, monkeypatch):
+    directory = str(tmpdir)
+    sent = []
+    monkeypatch.setattr(
+        "pytracking.spool._get_default_send",
+        lambda configuration: sent.append)
+
+    with WebhookSpool(directory) as spool:
+        for index in range(3):
+            spool.append(_get_tracking_result(index, timestamp=1000 + index))
+
+    main(["drain", directory, "--once"])
+    assert capsys.readouterr().out == "Sent 3 records\n"
+
+    main(["replay", directory, "--start", "1001", "--end", "1002"])
+    assert capsys.readouterr().out == "Sent 1 records\n"
+    assert _get_indexes(sent) == [0, 1, 2, 1]
@@ -0,0 +1,104 @@
+from pytracking import TrackingResult
+from pytracking.stats import (
+    Rollup, RingCounter, StatsAggregator, TRACKED_URL_KEY)
+
+
+class FakeClock(object):
+
+    def __init__(self, now=6000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def get_result(is_open=True, timestamp=None, **metadata):
+    return TrackingResult(
+        is_open_tracking=is_open, is_click_tracking=not is_open,
+        tracked_url=None if is_open else "https://www.bob.com/",
+        metadata=metadata, timestamp=timestamp)
+
+
+def test_ring_counter():
+    counter = RingCounter(3)
+    assert counter.increment(10, True)
+    assert counter.increment(10, False)
+    assert counter.increment(12, True)
+    assert counter.get(10) == (1, 1)
+
+    # Bucket 13 replaces bucket 10 in the ring.
+    assert counter.increment(13, False)
+    assert counter.get(10) is None
+    assert not counter.increment(10, True)
+    assert list(counter.iter_buckets(0)) == [(12, 1, 0), (13, 0, 1)]
+
+
+def test_aggregator_groupings():
+    clock = FakeClock()
+    aggregator = StatsAggregator(
+        [("campaign",), ("campaign", "link"), (TRACKED_URL_KEY,)],
+        clock=clock)
+
+    aggregator.add(get_result(campaign=1))
+    aggregator.add(get_result(campaign=1))
+    aggregator.add(get_result(False, campaign=1, link="a"))
+    aggregator.add(get_result(False, timestamp=6060, campaign=1, link="a"))
+    # Not counted: no grouping key.
+    aggregator.add(get_result(other=1))
+
+    assert aggregator.get_rollups(("campaign",), (1,)) == [
+        Rollup(("campaign",), (1,), 6000, 2, 1),
+        Rollup(("campaign",), (1,), 6060, 0, 1)]
+    assert aggregator.get_rollups(("campaign", "link"), (1, "a"))[0] ==\
+        Rollup(("campaign", "link"), (1, "a"), 6000, 0, 1)
+    assert aggregator.get_rollups(
+        (TRACKED_URL_KEY,), ("https://www.bob.com/",))[0].clicks == 1
+    assert aggregator.get_rollups(("campaign",), (2,)) == []
+    assert len(aggregator.counters) == 4
+
+
+def test_aggregator_flush():
+    clock = FakeClock()
+    flushed = []
+    aggregator = StatsAggregator(
+        [("campaign",)], sink=flushed.append, window_buckets=2, clock=clock)
+
+    aggregator.add(get_result(campaign=1))
+    aggregator.add(get_result(False, campaign=2))
+    assert aggregator.flush() == flushed[0]
+    assert sorted(flushed[0]) == [
+        Rollup(("campaign",), (1,), 6000, 1, 0),
+        Rollup(("campaign",), (2,), 6000, 0, 1)]
+
+    # Only the counts that changed are flushed, with their totals.
+    aggregator.add(get_result(campaign=1))
+    aggregator.flush()
+    assert flushed[1] == [Rollup(("campaign",), (1,), 6000, 2, 0)]
+    assert aggregator.flush() == []
+    assert len(flushed) == 2
+
+    # Events older than the window are ignored and idle groups forgotten.
+    clock.now = 6000 + 180
+    aggregator.add(get_result(campaign=1, timestamp=5900))
+    assert aggregator.late_events == 1
+    aggregator.flush()
+    assert not aggregator.counters
+
+
+def test_aggregator_background_flush():
+    flushed = []
+    errors = []
+
+    def sink(rollups):
+        flushed.extend(rollups)
+        raise ValueError("sink error")
+
+    with StatsAggregator(
+            [("campaign",)], sink=sink, flush_interval_seconds=60,
+            error_callback=errors.append) as aggregator:
+        aggregator.add(get_result(campaign=1))
+
+    assert aggregator.closed
+    assert not aggregator.thread.is_alive()
+    assert flushed[0].opens == 1
+    assert isinstance(errors[0], ValueError)
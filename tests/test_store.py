@@ -0,0 +1,164 @@
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pytracking import (
+    Configuration, generate_tracking_urls, get_click_tracking_result,
+    get_click_tracking_url, get_open_tracking_result)
+from pytracking.store import (
+    MemoryTokenStore, SQLiteTokenStore, TokenStore, decode_token_id,
+    encode_token_id)
+from .test_pytracking import (
+    DEFAULT_METADATA, DEFAULT_SETTINGS, DEFAULT_URL_TO_TRACK,
+    EXPECTED_METADATA)
+
+
+DEFAULT_SIGNING_KEY = b"signing key"
+
+
+class CountingStore(MemoryTokenStore):
+
+    def __init__(self, cache_size=2):
+        super().__init__(cache_size)
+        self.insert_calls = 0
+        self.select_calls = 0
+
+    def insert_many(self, payloads):
+        self.insert_calls += 1
+        return super().insert_many(payloads)
+
+    def select(self, token_id):
+        self.select_calls += 1
+        return super().select(token_id)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def token_store(request, tmpdir):
+    if request.param == "memory":
+        return MemoryTokenStore()
+    return SQLiteTokenStore(os.path.join(str(tmpdir), "tokens.db"))
+
+
+def test_token_id():
+    token = encode_token_id(300, DEFAULT_SIGNING_KEY)
+
+    assert token.startswith("s")
+    assert len(token) < 16
+    assert decode_token_id(token, DEFAULT_SIGNING_KEY) == 300
+
+    tampered = token[0] + ("B" if token[1] != "B" else "C") + token[2:]
+    for invalid in ("e30=", "s", token[:-1], tampered):
+        with pytest.raises(ValueError):
+            decode_token_id(invalid, DEFAULT_SIGNING_KEY)
+    with pytest.raises(ValueError):
+        decode_token_id(token, b"other key")
+
+
+def test_token_store(token_store):
+    assert token_store.put_many([]) == []
+    token_ids = token_store.put_many([b"a", b"b", b"c"])
+    assert len(set(token_ids)) == 3
+    token_id = token_store.put(b"d")
+    assert token_id not in token_ids
+
+    assert [token_store.get(token_id) for token_id in token_ids] ==\
+        [b"a", b"b", b"c"]
+    assert token_store.get(token_id) == b"d"
+    with pytest.raises(KeyError):
+        token_store.get(token_id + 1)
+
+
+def test_token_store_read_through_cache():
+    token_store = CountingStore(cache_size=2)
+    token_ids = token_store.put_many([b"a", b"b", b"c"])
+
+    for _ in range(3):
+        assert token_store.get(token_ids[0]) == b"a"
+    assert token_store.select_calls == 1
+
+    token_store.get(token_ids[1])
+    token_store.get(token_ids[2])
+    token_store.get(token_ids[0])
+    assert token_store.select_calls == 4
+
+
+def test_sqlite_token_store_threads_and_pickle(tmpdir):
+    path = os.path.join(str(tmpdir), "tokens.db")
+    token_store = SQLiteTokenStore(path)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        id_lists = list(executor.map(
+            lambda index: token_store.put_many([b"x"] * 10), range(20)))
+    token_ids = [token_id for id_list in id_lists for token_id in id_list]
+    assert sorted(token_ids) == list(range(1, 201))
+
+    unpickled = pickle.loads(pickle.dumps(token_store))
+    assert unpickled.get(200) == b"x"
+    assert SQLiteTokenStore(path).put(b"y") == 201
+
+    with pytest.raises(TypeError):
+        pickle.dumps(MemoryTokenStore())
+
+
+def test_token_store_tracking_urls(token_store):
+    configuration = Configuration(
+        token_store=token_store, signing_key=DEFAULT_SIGNING_KEY,
+        codec="compact", **DEFAULT_SETTINGS)
+
+    url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, configuration)
+    assert len(url) < len(DEFAULT_SETTINGS["base_click_tracking_url"]) + 16
+
+    tracking_result = get_click_tracking_result(
+        url, configuration=configuration)
+    assert tracking_result.tracked_url == DEFAULT_URL_TO_TRACK
+    assert tracking_result.metadata == EXPECTED_METADATA
+
+    # Links without ID are still decoded
+    json_url = get_click_tracking_url(
+        DEFAULT_URL_TO_TRACK, DEFAULT_METADATA, **DEFAULT_SETTINGS)
+    assert get_click_tracking_result(
+        json_url, configuration=configuration).tracked_url ==\
+        DEFAULT_URL_TO_TRACK
+
+    with pytest.raises(ValueError):
+        get_click_tracking_result(
+            url, configuration=configuration, signing_key=b"other key")
+
+
+def test_token_store_bulk_insert():
+    token_store = CountingStore()
+    configuration = Configuration(
+        token_store=token_store, signing_key=DEFAULT_SIGNING_KEY,
+        **DEFAULT_SETTINGS)
+    metadata_list = [{"recipient_id": i} for i in range(10)]
+
+    tracking_urls = list(generate_tracking_urls(
+        [DEFAULT_URL_TO_TRACK, "https://www.example.com/"], metadata_list,
+        configuration=configuration, chunksize=5))
+
+    assert token_store.insert_calls == 2
+    assert len(token_store.payloads) == 30
+    assert configuration.merge_with_kwargs({}).token_store is token_store
+    for metadata, (open_url, click_urls) in zip(
+            metadata_list, tracking_urls):
+        assert get_open_tracking_result(
+            open_url, configuration=configuration).metadata[
+                "recipient_id"] == metadata["recipient_id"]
+        tracking_result = get_click_tracking_result(
+            click_urls[1], configuration=configuration)
+        assert tracking_result.tracked_url == "https://www.example.com/"
+        assert tracking_result.metadata["recipient_id"] ==\
+            metadata["recipient_id"]
+
+
+def test_token_store_signing_key_required():
+    with pytest.raises(ValueError):
+        get_click_tracking_url(
+            DEFAULT_URL_TO_TRACK, token_store=MemoryTokenStore(),
+            **DEFAULT_SETTINGS)
+
+    with pytest.raises(NotImplementedError):
+        TokenStore().put(b"a")
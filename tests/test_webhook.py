@@ -1,6 +1,15 @@
+import gzip
+import json
+import pickle
+import threading
+import time
 from unittest.mock import patch
 
+import pytest
+import requests
+
 from pytracking import (
+    Configuration, TrackingResult,
     get_click_tracking_url, get_click_tracking_url_path,
     get_click_tracking_result, get_open_tracking_url,
     get_open_tracking_result, get_open_tracking_url_path,
@@ -62,3 +71,231 @@ def test_send_webhook_open():
 
         mocked_post.assert_called_once_with(
             DEFAULT_WEBHOOK_URL, json=payload, timeout=DEFAULT_TIMEOUT_SECONDS)
+
+
+def _get_tracking_results(count, webhook_url=DEFAULT_WEBHOOK_URL):
+    return [
+        TrackingResult(
+            is_open_tracking=True, webhook_url=webhook_url,
+            metadata={"index": index}, timestamp=1389177318)
+        for index in range(count)]
+
+
+def _get_posted_payloads(mocked_post):
+    payloads = []
+    for call in mocked_post.call_args_list:
+        body = call[1]["data"]
+        if call[1]["headers"].get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        payloads.extend(json.loads(body.decode("utf-8")))
+    return payloads
+
+
+def test_batch_webhook_sender_max_count():
+    tracking_results = _get_tracking_results(10)
+
+    with patch("pytracking.webhook.requests.post") as mocked_post:
+        with pytracking.webhook.BatchWebhookSender(
+                max_count=4, max_latency_seconds=60) as sender:
+            for tracking_result in tracking_results:
+                sender.add(tracking_result)
+            sender.flush()
+            assert mocked_post.call_count == 3
+
+    assert [len(json.loads(call[1]["data"].decode("utf-8")))
+            for call in mocked_post.call_args_list] == [4, 4, 2]
+    assert _get_posted_payloads(mocked_post) == [
+        tracking_result.to_webhook_payload()
+        for tracking_result in tracking_results]
+    assert mocked_post.call_args[0] == (DEFAULT_WEBHOOK_URL,)
+    assert mocked_post.call_args[1]["timeout"] == DEFAULT_TIMEOUT_SECONDS
+
+
+def test_batch_webhook_sender_max_bytes_and_compression():
+    tracking_results = _get_tracking_results(6)
+    other_tracking_results = _get_tracking_results(
+        1, "https://other.com/webhook/")
+
+    with patch("pytracking.webhook.requests.post") as mocked_post:
+        sender = pytracking.webhook.BatchWebhookSender(
+            max_bytes=300, max_latency_seconds=60, compress=True)
+        for tracking_result in tracking_results + other_tracking_results:
+            sender.add(tracking_result)
+        sender.close()
+
+    assert mocked_post.call_count == 4
+    assert [call[0][0] for call in mocked_post.call_args_list].count(
+        "https://other.com/webhook/") == 1
+    assert sorted(
+        payload["metadata"]["index"]
+        for payload in _get_posted_payloads(mocked_post)) ==\
+        [0, 0, 1, 2, 3, 4, 5]
+
+
+def test_batch_webhook_sender_max_latency():
+    with patch("pytracking.webhook.requests.post") as mocked_post:
+        sender = pytracking.webhook.BatchWebhookSender(
+            max_latency_seconds=0.05)
+        for tracking_result in _get_tracking_results(3):
+            sender.add(tracking_result)
+
+        deadline = time.time() + 5
+        while not mocked_post.called and time.time() < deadline:
+            time.sleep(0.01)
+
+        assert mocked_post.call_count == 1
+        sender.close()
+
+    assert len(_get_posted_payloads(mocked_post)) == 3
+
+
+def test_batch_webhook_sender_error():
+    errors = []
+
+    with patch("pytracking.webhook.requests.post") as mocked_post:
+        mocked_post.side_effect = ConnectionError("Webhook is down")
+        sender = pytracking.webhook.BatchWebhookSender(
+            error_callback=lambda *args: errors.append(args))
+        for tracking_result in _get_tracking_results(3):
+            sender.add(tracking_result)
+        sender.close()
+
+    assert len(errors) == 1
+    assert errors[0][:2] == (DEFAULT_WEBHOOK_URL, 3)
+    with pytest.raises(RuntimeError):
+        sender.add(_get_tracking_results(1)[0])
+
+
+def test_batch_webhook_sender_error_callback_raises():
+    calls = []
+
+    def error_callback(webhook_url, count, error):
+        calls.append(webhook_url)
+        raise ValueError("Broken callback")
+
+    with patch("pytracking.webhook.requests.post") as mocked_post:
+        mocked_post.side_effect = ConnectionError("Webhook is down")
+        sender = pytracking.webhook.BatchWebhookSender(
+            error_callback=error_callback)
+        for webhook_url in ("https://a.com/", "https://b.com/"):
+            for tracking_result in _get_tracking_results(2, webhook_url):
+                sender.add(tracking_result)
+        closer = threading.Thread(target=sender.close)
+        closer.daemon = True
+        closer.start()
+        closer.join(5)
+
+    assert not closer.is_alive()
+    assert sorted(calls) == ["https://a.com/", "https://b.com/"]
+
+
+class FakeSession(object):
+    """requests.Session stand-in that returns or raises the given outcomes
+    in order.
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+        self.adapters = {}
+
+    def mount(self, prefix, adapter):
+        self.adapters[prefix] = adapter
+
+    def post(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        return response
+
+    def close(self):
+        pass
+
+
+def test_webhook_client_retries():
+    session = FakeSession([
+        503, requests.Timeout(), requests.ConnectionError(), 200])
+    client = pytracking.webhook.WebhookClient(
+        pool_size=4, backoff_seconds=0, session=session)
+
+    response = client.post(DEFAULT_WEBHOOK_URL, json={})
+
+    assert response.status_code == 200
+    assert len(session.calls) == 4
+    assert session.adapters["https://"]._pool_maxsize == 4
+
+    session.outcomes = [requests.Timeout()] * 2
+    client.max_retries = 1
+    with pytest.raises(requests.Timeout):
+        client.post(DEFAULT_WEBHOOK_URL, json={})
+
+    session.outcomes = [404]
+    assert client.post(DEFAULT_WEBHOOK_URL, json={}).status_code == 404
+
+
+def test_webhook_client_pickle():
+    client = pytracking.webhook.WebhookClient(
+        pool_size=2, max_retries=1, failure_threshold=1,
+        session=FakeSession([500, 500]))
+    client.post(DEFAULT_WEBHOOK_URL)
+    assert client.is_circuit_open(DEFAULT_WEBHOOK_URL)
+
+    # Each process has its own session and circuits.
+    configuration = pickle.loads(pickle.dumps(
+        Configuration(webhook_client=client).freeze()))
+    unpickled = configuration.webhook_client
+    assert isinstance(unpickled.session, requests.Session)
+    assert unpickled.max_retries == 1
+    assert unpickled.failure_threshold == 1
+    assert not unpickled.is_circuit_open(DEFAULT_WEBHOOK_URL)
+
+
+def test_webhook_client_circuit_breaker():
+    session = FakeSession([500] * 4)
+    client = pytracking.webhook.WebhookClient(
+        max_retries=1, backoff_seconds=0, failure_threshold=2,
+        reset_timeout_seconds=0.05, session=session)
+
+    assert client.post(DEFAULT_WEBHOOK_URL).status_code == 500
+    assert not client.is_circuit_open(DEFAULT_WEBHOOK_URL)
+    assert client.post(DEFAULT_WEBHOOK_URL).status_code == 500
+    assert client.is_circuit_open(DEFAULT_WEBHOOK_URL)
+
+    with pytest.raises(pytracking.webhook.CircuitOpenError):
+        client.post(DEFAULT_WEBHOOK_URL)
+    assert len(session.calls) == 4
+
+    # Other hosts are not affected
+    session.outcomes = [200]
+    assert client.post("https://other.com/webhook/").status_code == 200
+
+    # After the reset timeout, a successful trial request closes the circuit
+    time.sleep(0.06)
+    session.outcomes = [200, 200]
+    assert client.post(DEFAULT_WEBHOOK_URL).status_code == 200
+    assert not client.is_circuit_open(DEFAULT_WEBHOOK_URL)
+    assert client.post(DEFAULT_WEBHOOK_URL).status_code == 200
+
+
+def test_send_webhook_client():
+    tracking_result = _get_tracking_results(1)[0]
+    session = FakeSession([200, 200])
+    client = pytracking.webhook.WebhookClient(session=session)
+    configuration = Configuration(webhook_client=client)
+
+    pytracking.webhook.send_webhook(tracking_result, client=client)
+    pytracking.webhook.send_webhook(
+        tracking_result, configuration=configuration,
+        webhook_timeout_seconds=1)
+
+    assert session.calls == [
+        (DEFAULT_WEBHOOK_URL, {
+            "json": tracking_result.to_webhook_payload(),
+            "timeout": DEFAULT_TIMEOUT_SECONDS}),
+        (DEFAULT_WEBHOOK_URL, {
+            "json": tracking_result.to_webhook_payload(), "timeout": 1})]
+    assert configuration.merge_with_kwargs({}).webhook_client is client
+    assert configuration.freeze().webhook_client is client